@@ -0,0 +1,114 @@
+"""Shared plumbing for the benchmark scripts: environment setup, stats and result files"""
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+# Settings the app refuses to start without; benchmarks never talk to a real Mongo
+BENCH_ENV = {
+    "DATABASE_URL": "mongodb://memdb",
+    "SECRET_KEY": "benchmark-secret",
+    "ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "600",
+}
+
+
+def prepare_app():
+    """Point the app at the in-memory database. Call before importing src."""
+    for key, value in BENCH_ENV.items():
+        os.environ.setdefault(key, value)
+    from benchmarks import memdb
+    memdb.install()
+
+
+def raise_fd_limit() -> int:
+    """Thousands of sockets need thousands of file descriptors"""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    except (ImportError, ValueError, OSError):
+        return -1
+
+
+def process_memory(pid: int) -> Dict[str, int]:
+    """Current and peak resident set size of a process, in bytes (Linux only)"""
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    name, value = line.split(":", 1)
+                    memory["rss" if name == "VmRSS" else "peak_rss"] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return memory
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = (len(sorted_values) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+def latency_summary(samples: List[float]) -> dict:
+    """Seconds in, milliseconds out"""
+    values = sorted(samples)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean_ms": sum(values) / len(values) * 1000,
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": values[-1] * 1000,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_metadata() -> dict:
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def default_output(name: str) -> str:
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    return os.path.join(RESULTS_DIR, f"{name}-{stamp}.json")
+
+
+def write_results(path: str, results: dict):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as out:
+        json.dump(results, out, indent=2, sort_keys=True)
+    print(f"📝 Results written to {path}")
+
+
+def load_results(path: str) -> dict:
+    with open(path) as source:
+        return json.load(source)
@@ -0,0 +1,452 @@
+"""In-memory stand-in for the slice of the async pymongo API the app uses.
+
+Benchmarks install it with install() before importing src, so src.db.main
+builds its collections on top of it and no Mongo server is needed. It is
+deliberately simple - linear scans, no query planner - and only meant to make
+the database cheap and predictable so the numbers reflect our own code.
+"""
+import copy
+from typing import Any, Dict, List, Optional, Tuple
+import pymongo
+from bson import ObjectId
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+_MISSING = object()
+
+
+def _get(doc: dict, path: str):
+    value = doc
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _compare(value, condition) -> bool:
+    if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+        for op, arg in condition.items():
+            if op == "$exists":
+                if (value is not _MISSING) != bool(arg):
+                    return False
+            elif op == "$in":
+                values = value if isinstance(value, list) else [value]
+                if not any(v in arg for v in values):
+                    return False
+            elif op == "$nin":
+                values = value if isinstance(value, list) else [value]
+                if any(v in arg for v in values):
+                    return False
+            elif op == "$ne":
+                if value == arg:
+                    return False
+            elif op in ("$gt", "$gte", "$lt", "$lte"):
+                if value is _MISSING or value is None:
+                    return False
+                if op == "$gt" and not value > arg:
+                    return False
+                if op == "$gte" and not value >= arg:
+                    return False
+                if op == "$lt" and not value < arg:
+                    return False
+                if op == "$lte" and not value <= arg:
+                    return False
+            else:
+                raise NotImplementedError(f"memdb: query operator {op}")
+        return True
+    if isinstance(value, list) and not isinstance(condition, list):
+        return condition in value
+    return (None if value is _MISSING else value) == condition
+
+
+def matches(doc: dict, query: Optional[dict]) -> bool:
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, sub) for sub in condition):
+                return False
+        elif not _compare(_get(doc, key), condition):
+            return False
+    return True
+
+
+def project(doc: dict, projection: Optional[dict]) -> dict:
+    if not projection:
+        return copy.deepcopy(doc)
+    included = [key for key, on in projection.items() if on and key != "_id"]
+    if included:
+        out = {key: copy.deepcopy(doc[key]) for key in included if key in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            out["_id"] = doc["_id"]
+        return out
+    out = copy.deepcopy(doc)
+    for key, on in projection.items():
+        if not on:
+            out.pop(key, None)
+    return out
+
+
+def _sort_key(path: str):
+    def key(doc):
+        value = _get(doc, path)
+        # Missing and None sort first, like Mongo
+        return (0, 0) if value is _MISSING or value is None else (1, value)
+    return key
+
+
+def _sorted(docs: List[dict], spec: List[Tuple[str, int]]) -> List[dict]:
+    for path, direction in reversed(spec):
+        docs.sort(key=_sort_key(path), reverse=direction < 0)
+    return docs
+
+
+class Result:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class MemoryCursor:
+    def __init__(self, collection: "MemoryCollection", query: Optional[dict], projection: Optional[dict]):
+        self._collection = collection
+        self._query = query or {}
+        self._projection = projection
+        self._sort: List[Tuple[str, int]] = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key, direction: Optional[int] = None):
+        self._sort = [(key, direction or 1)] if isinstance(key, str) else list(key)
+        return self
+
+    def skip(self, count: int):
+        self._skip = count
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def batch_size(self, size: int):
+        return self
+
+    def _results(self) -> List[dict]:
+        docs = [doc for doc in self._collection.docs if matches(doc, self._query)]
+        if self._sort:
+            docs = _sorted(docs, self._sort)
+        docs = docs[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+        return [project(doc, self._projection) for doc in docs]
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        docs = self._results()
+        return docs[:length] if length else docs
+
+    def __aiter__(self):
+        self._iter = iter(self._results())
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class MemoryCollection:
+    def __init__(self, name: str):
+        self.name = name
+        self.docs: List[dict] = []
+        self.indexes: Dict[str, dict] = {"_id_": {"key": [("_id", 1)], "unique": True}}
+        # index name -> {key values: document} for unique indexes
+        self._unique: Dict[str, Dict[Any, dict]] = {"_id_": {}}
+
+    # Unique indexes
+
+    @staticmethod
+    def _index_key(doc: dict, fields: List[str]):
+        values = tuple(_get(doc, field) for field in fields)
+        values = tuple(None if value is _MISSING else value for value in values)
+        try:
+            hash(values)
+            return values
+        except TypeError:
+            return repr(values)
+
+    def _unique_fields(self, name: str) -> List[str]:
+        return [field for field, _ in self.indexes[name]["key"]]
+
+    def _check_unique(self, doc: dict, replacing: Optional[dict] = None):
+        for name, entries in self._unique.items():
+            fields = self._unique_fields(name)
+            existing = entries.get(self._index_key(doc, fields))
+            if existing is not None and existing is not replacing:
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error collection: {self.name} index: {name}",
+                    11000,
+                    {"keyPattern": dict(self.indexes[name]["key"])}
+                )
+
+    def _index(self, doc: dict):
+        for name, entries in self._unique.items():
+            entries[self._index_key(doc, self._unique_fields(name))] = doc
+
+    def _unindex(self, doc: dict):
+        for name, entries in self._unique.items():
+            key = self._index_key(doc, self._unique_fields(name))
+            if entries.get(key) is doc:
+                del entries[key]
+
+    def _store(self, doc: dict) -> dict:
+        doc = copy.deepcopy(doc)
+        doc.setdefault("_id", ObjectId())
+        self._check_unique(doc)
+        self.docs.append(doc)
+        self._index(doc)
+        return doc
+
+    def _replace(self, position: int, new: dict):
+        old = self.docs[position]
+        self._check_unique(new, replacing=old)
+        self._unindex(old)
+        self.docs[position] = new
+        self._index(new)
+
+    # Updates
+
+    @staticmethod
+    def _apply(doc: dict, update: dict, inserting: bool = False) -> dict:
+        new = copy.deepcopy(doc)
+        for op, fields in update.items():
+            for key, value in fields.items():
+                if op == "$set":
+                    new[key] = value
+                elif op == "$unset":
+                    new.pop(key, None)
+                elif op == "$inc":
+                    new[key] = new.get(key, 0) + value
+                elif op == "$addToSet":
+                    items = new.setdefault(key, [])
+                    if value not in items:
+                        items.append(value)
+                elif op == "$push":
+                    new.setdefault(key, []).append(value)
+                elif op == "$setOnInsert":
+                    if inserting:
+                        new[key] = value
+                else:
+                    raise NotImplementedError(f"memdb: update operator {op}")
+        return new
+
+    def _upsert_base(self, query: dict) -> dict:
+        return {
+            key: value for key, value in query.items()
+            if not key.startswith("$") and not (isinstance(value, dict) and any(k.startswith("$") for k in value))
+        }
+
+    # Reads
+
+    def find(self, filter: Optional[dict] = None, projection: Optional[dict] = None, sort=None, limit: int = 0, **kwargs) -> MemoryCursor:
+        cursor = MemoryCursor(self, filter, projection)
+        if sort:
+            cursor.sort(sort)
+        if limit:
+            cursor.limit(limit)
+        return cursor
+
+    async def find_one(self, filter: Optional[dict] = None, projection: Optional[dict] = None, sort=None, **kwargs) -> Optional[dict]:
+        results = self.find(filter, projection, sort=sort).limit(1)._results()
+        return results[0] if results else None
+
+    async def count_documents(self, filter: dict, **kwargs) -> int:
+        return sum(1 for doc in self.docs if matches(doc, filter))
+
+    async def aggregate(self, pipeline: List[dict], **kwargs) -> MemoryCursor:
+        docs = [copy.deepcopy(doc) for doc in self.docs]
+        for stage in pipeline:
+            (op, arg), = stage.items()
+            if op == "$match":
+                docs = [doc for doc in docs if matches(doc, arg)]
+            elif op == "$sort":
+                docs = _sorted(docs, list(arg.items()))
+            elif op == "$limit":
+                docs = docs[:arg]
+            elif op == "$group":
+                groups: Dict[Any, dict] = {}
+                key_path = arg["_id"].lstrip("$")
+                for doc in docs:
+                    key = doc.get(key_path)
+                    group = groups.setdefault(key, {"_id": key})
+                    for field, accumulator in arg.items():
+                        if field == "_id":
+                            continue
+                        (acc_op, source), = accumulator.items()
+                        if acc_op != "$first":
+                            raise NotImplementedError(f"memdb: accumulator {acc_op}")
+                        group.setdefault(field, doc.get(source.lstrip("$")))
+                docs = list(groups.values())
+            else:
+                raise NotImplementedError(f"memdb: pipeline stage {op}")
+
+        cursor = MemoryCursor(self, None, None)
+        cursor._results = lambda: docs
+        return cursor
+
+    # Writes
+
+    async def insert_one(self, document: dict, **kwargs) -> Result:
+        stored = self._store(document)
+        document.setdefault("_id", stored["_id"])
+        return Result(inserted_id=stored["_id"])
+
+    async def insert_many(self, documents: List[dict], ordered: bool = True, **kwargs) -> Result:
+        errors = []
+        for i, document in enumerate(documents):
+            document.setdefault("_id", ObjectId())
+            try:
+                self._store(document)
+            except DuplicateKeyError as e:
+                errors.append({"index": i, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+        return Result(inserted_ids=[document["_id"] for document in documents])
+
+    async def update_one(self, filter: dict, update: dict, upsert: bool = False, **kwargs) -> Result:
+        for i, doc in enumerate(self.docs):
+            if matches(doc, filter):
+                self._replace(i, self._apply(doc, update))
+                return Result(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            stored = self._store(self._apply(self._upsert_base(filter), update, inserting=True))
+            return Result(matched_count=0, modified_count=0, upserted_id=stored["_id"])
+        return Result(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def update_many(self, filter: dict, update: dict, upsert: bool = False, **kwargs) -> Result:
+        count = 0
+        for i, doc in enumerate(self.docs):
+            if matches(doc, filter):
+                self._replace(i, self._apply(doc, update))
+                count += 1
+        if not count and upsert:
+            await self.update_one(filter, update, upsert=True)
+        return Result(matched_count=count, modified_count=count)
+
+    async def find_one_and_update(
+        self,
+        filter: dict,
+        update: dict,
+        projection: Optional[dict] = None,
+        upsert: bool = False,
+        return_document=ReturnDocument.BEFORE,
+        **kwargs
+    ) -> Optional[dict]:
+        before = await self.find_one(filter)
+        result = await self.update_one(filter, update, upsert=upsert)
+        if return_document == ReturnDocument.AFTER:
+            _id = result.upserted_id if result.upserted_id is not None else (before or {}).get("_id")
+            return await self.find_one({"_id": _id}, projection) if _id is not None else None
+        return project(before, projection) if before else None
+
+    async def delete_one(self, filter: dict, **kwargs) -> Result:
+        for i, doc in enumerate(self.docs):
+            if matches(doc, filter):
+                self._unindex(doc)
+                del self.docs[i]
+                return Result(deleted_count=1)
+        return Result(deleted_count=0)
+
+    async def delete_many(self, filter: dict, **kwargs) -> Result:
+        kept = []
+        for doc in self.docs:
+            if matches(doc, filter):
+                self._unindex(doc)
+            else:
+                kept.append(doc)
+        deleted = len(self.docs) - len(kept)
+        self.docs = kept
+        return Result(deleted_count=deleted)
+
+    async def find_one_and_delete(self, filter: dict, projection: Optional[dict] = None, **kwargs) -> Optional[dict]:
+        doc = await self.find_one(filter, projection)
+        if doc is not None:
+            await self.delete_one({"_id": doc["_id"]})
+        return doc
+
+    async def bulk_write(self, requests: list, ordered: bool = True, **kwargs) -> Result:
+        for request in requests:
+            if isinstance(request, UpdateOne):
+                await self.update_one(request._filter, request._doc, upsert=bool(request._upsert))
+            elif isinstance(request, UpdateMany):
+                await self.update_many(request._filter, request._doc, upsert=bool(request._upsert))
+            elif isinstance(request, InsertOne):
+                await self.insert_one(request._doc)
+            elif isinstance(request, DeleteOne):
+                await self.delete_one(request._filter)
+            elif isinstance(request, DeleteMany):
+                await self.delete_many(request._filter)
+            else:
+                raise NotImplementedError(f"memdb: bulk operation {type(request).__name__}")
+        return Result(acknowledged=True)
+
+    # Indexes
+
+    async def create_index(self, keys, name: Optional[str] = None, unique: bool = False, **kwargs) -> str:
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        name = name or "_".join(f"{field}_{direction}" for field, direction in keys)
+        self.indexes[name] = {"key": list(keys), "unique": unique, **kwargs}
+        if unique:
+            self._unique[name] = {}
+            for doc in self.docs:
+                self._check_unique(doc, replacing=doc)
+                self._unique[name][self._index_key(doc, self._unique_fields(name))] = doc
+        return name
+
+    async def index_information(self) -> dict:
+        return copy.deepcopy(self.indexes)
+
+
+class MemoryDatabase:
+    def __init__(self, name: str):
+        self.name = name
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def get_collection(self, name: str, **kwargs) -> MemoryCollection:
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(name)
+        return self._collections[name]
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        return self.get_collection(name)
+
+    async def command(self, command, **kwargs) -> dict:
+        return {"ok": 1.0}
+
+
+class MemoryClient:
+    """Drop-in for pymongo.AsyncMongoClient; connection options are accepted and ignored"""
+
+    def __init__(self, *args, **kwargs):
+        self._databases: Dict[str, MemoryDatabase] = {}
+        self.admin = MemoryDatabase("admin")
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        if name not in self._databases:
+            self._databases[name] = MemoryDatabase(name)
+        return self._databases[name]
+
+    def get_database(self, name: str, **kwargs) -> MemoryDatabase:
+        return self[name]
+
+    async def close(self):
+        pass
+
+
+def install():
+    """Make src.db.main build its client on memdb. Call before anything imports src."""
+    pymongo.AsyncMongoClient = MemoryClient
@@ -0,0 +1,369 @@
+"""Micro-benchmarks for the per-request hot paths: auth, keys, history and contacts.
+
+Everything runs in-process against the in-memory database with fixed
+fixtures - a 10k-message conversation and a user with 5k contacts - so runs
+are comparable. Each benchmark reports ops/sec (best of several timed
+rounds), peak bytes allocated per call and blocks left allocated per call.
+
+Run from backend/:
+
+    python -m benchmarks.micro                          # everything
+    python -m benchmarks.micro -k history -k keys       # names containing either
+    python -m benchmarks.micro --out base.json          # save a baseline
+    python -m benchmarks.micro --compare base.json --max-regression 10
+
+With --compare every benchmark is shown next to the baseline, and the exit
+status is 1 if any got slower than --max-regression percent.
+"""
+import argparse
+import asyncio
+import base64
+import gc
+import inspect
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Optional
+
+from benchmarks.common import default_output, load_results, prepare_app, run_metadata, write_results
+
+MESSAGES = 10_000
+CONTACTS = 5_000
+PAGE = 50
+KEY_BATCH = 200
+
+# name -> setup(fixtures) returning the callable to time (plain or async)
+BENCHMARKS: Dict[str, Callable] = {}
+
+
+def bench(name: str):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+class Fixtures:
+    """Seeded database contents shared by every benchmark"""
+
+    async def build(self, seed: int):
+        from bson import ObjectId
+        from src.db import migrations
+        from src.db.keys import key_fields
+        from src.db.main import connections, messages, users
+        from src.utils.auth import create_token
+
+        rng = random.Random(seed)
+        ids = [ObjectId(rng.randbytes(12)) for _ in range(CONTACTS + 1)]
+        now = datetime.now(timezone.utc)
+
+        hex_keys = (rng.randbytes(1184).hex(), rng.randbytes(1952).hex())
+        docs = []
+        for i, _id in enumerate(ids):
+            doc = {
+                "_id": _id,
+                "username": f"user{i}",
+                "email": f"user{i}@bench.local",
+                "password_hash": b"",
+                "invite_code": f"invite{i}",
+                "is_active": True,
+            }
+            if i % 2:
+                doc.update(key_fields(rng.randbytes(1184), rng.randbytes(1952)))
+            else:
+                # Pre-migration users still hold hex keys
+                doc.update(kyber_public_key=hex_keys[0], dilithium_public_key=hex_keys[1])
+            docs.append(doc)
+        await users.insert_many(docs)
+
+        self.user_id, self.peer_id = str(ids[0]), str(ids[1])
+        self.user = await users.find_one({"_id": ids[0]}, {"password_hash": 0})
+        self.user["id"] = self.user_id
+        self.token = create_token({"sub": "user0"})
+        self.contact_ids = [str(_id) for _id in ids[1:]]
+        self.hex_doc = {"kyber_public_key": hex_keys[0], "dilithium_public_key": hex_keys[1]}
+
+        await connections.insert_many([
+            {"owner_id": self.user_id, "contact_id": contact, "contact_username": f"user{i + 1}", "created_at": now + timedelta(microseconds=i * 1000)}
+            for i, contact in enumerate(self.contact_ids)
+        ])
+
+        conversation = migrations.conversation_id(self.user_id, self.peer_id)
+        b64 = lambda size: base64.b64encode(rng.randbytes(size)).decode()
+        ciphertext, iv, signature = b64(1088), b64(12), b64(3293)
+        self.messages = [
+            {
+                "_id": ObjectId(),
+                "sender_id": self.user_id if i % 2 else self.peer_id,
+                "receiver_id": self.peer_id if i % 2 else self.user_id,
+                "conversation_id": conversation,
+                "message_type": "encrypted",
+                "ciphertext": ciphertext,
+                "encrypted_message": b64(272),
+                "iv": iv,
+                "signature": signature,
+                "timestamp": now - timedelta(seconds=MESSAGES - i),
+            }
+            for i in range(MESSAGES)
+        ]
+        await messages.insert_many(self.messages)
+
+        migrations.completed[migrations.CONVERSATION_ID_BACKFILL] = True
+        migrations.completed[migrations.CONNECTIONS_BACKFILL] = True
+
+
+# --- Auth -------------------------------------------------------------------
+
+@bench("auth.create_token")
+def _create_token(fx):
+    from src.utils.auth import create_token
+    return lambda: create_token({"sub": "user0"})
+
+
+@bench("auth.decode_token")
+def _decode_token(fx):
+    from src.utils.auth import decode_token
+    return lambda: decode_token(fx.token)
+
+
+@bench("auth.resolve_principal_cached")
+def _resolve_principal(fx):
+    from src.utils.auth import resolve_principal
+    return lambda: resolve_principal(fx.token)
+
+
+@bench("auth.hash_password")
+def _hash_password(fx):
+    from src.utils.auth import hash_password
+    return lambda: hash_password("Benchmark#Passw0rd")
+
+
+@bench("auth.verify_password")
+def _verify_password(fx):
+    from src.utils.auth import hash_password, verify_password
+    hashed = hash_password("Benchmark#Passw0rd")
+    return lambda: verify_password("Benchmark#Passw0rd", hashed)
+
+
+# --- Keys -------------------------------------------------------------------
+
+@bench("keys.hex_to_base64")
+def _hex_to_base64(fx):
+    """What get_keys used to do on every call"""
+    def convert():
+        return (
+            base64.b64encode(bytes.fromhex(fx.hex_doc["kyber_public_key"])).decode(),
+            base64.b64encode(bytes.fromhex(fx.hex_doc["dilithium_public_key"])).decode(),
+        )
+    return convert
+
+
+@bench("keys.directory_get_cached")
+def _directory_get(fx):
+    from src.db.keys import key_directory
+    return lambda: key_directory.get(fx.peer_id)
+
+
+@bench(f"keys.directory_batch_{KEY_BATCH}_cached")
+def _directory_batch(fx):
+    from src.db.keys import key_directory, etag
+    ids = fx.contact_ids[:KEY_BATCH]
+
+    async def batch():
+        return etag(await key_directory.get_many(ids))
+    return batch
+
+
+@bench(f"keys.directory_batch_{KEY_BATCH}_cold")
+def _directory_batch_cold(fx):
+    from src.db.keys import key_directory
+    ids = fx.contact_ids[:KEY_BATCH]
+
+    async def batch():
+        key_directory._cache.clear()
+        return await key_directory.get_many(ids)
+    return batch
+
+
+# --- History ----------------------------------------------------------------
+
+@bench(f"history.entries_{PAGE}")
+def _history_entries(fx):
+    from src.routes.chat import history_entry
+    page = fx.messages[-PAGE:]
+    return lambda: [history_entry(msg) for msg in page]
+
+
+@bench("history.newest_page_cached")
+def _history_cached(fx):
+    from src.routes.chat import get_messages_with_signatures
+    return lambda: get_messages_with_signatures(fx.peer_id, None, None, PAGE, fx.user)
+
+
+@bench("history.newest_page_uncached")
+def _history_uncached(fx):
+    from src.db import migrations
+    from src.db.recent import recent_messages
+    from src.routes.chat import get_messages_with_signatures
+    conversation = migrations.conversation_id(fx.user_id, fx.peer_id)
+
+    async def read():
+        recent_messages.invalidate(conversation)
+        return await get_messages_with_signatures(fx.peer_id, None, None, PAGE, fx.user)
+    return read
+
+
+@bench("history.older_page")
+def _history_older(fx):
+    from src.routes.chat import get_messages_with_signatures
+    from src.utils.pagination import encode_cursor
+    middle = fx.messages[MESSAGES // 2]
+    cursor = encode_cursor(middle["timestamp"], middle["_id"])
+    return lambda: get_messages_with_signatures(fx.peer_id, cursor, None, PAGE, fx.user)
+
+
+# --- Contacts ---------------------------------------------------------------
+
+@bench(f"contacts.page_{PAGE}")
+def _contact_page(fx):
+    from src.db.contacts import contact_page
+    return lambda: contact_page(fx.user_id, None, PAGE)
+
+
+@bench(f"contacts.ids_{CONTACTS}")
+def _contact_ids(fx):
+    from src.db.contacts import contact_ids
+    return lambda: contact_ids(fx.user_id)
+
+
+# --- Runner -----------------------------------------------------------------
+
+async def _call(fn):
+    result = fn()
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+async def _timed(fn, calls: int) -> float:
+    started = time.perf_counter()
+    for _ in range(calls):
+        result = fn()
+        if inspect.isawaitable(result):
+            await result
+    return time.perf_counter() - started
+
+
+async def measure(fn, min_time: float, rounds: int) -> dict:
+    # Warm caches and find a call count that takes at least min_time
+    await _call(fn)
+    calls = 1
+    while True:
+        elapsed = await _timed(fn, calls)
+        if elapsed >= min_time or calls >= 1_000_000:
+            break
+        calls = max(calls * 2, int(calls * min_time / max(elapsed, 1e-9)))
+
+    timings = [elapsed]
+    for _ in range(rounds - 1):
+        timings.append(await _timed(fn, calls))
+    best = min(timings)
+
+    # Allocations: peak bytes per call and blocks still held afterwards
+    samples = max(1, min(calls, 100))
+    gc.collect()
+    tracemalloc.start()
+    peaks = []
+    blocks_before = sys.getallocatedblocks()
+    for _ in range(samples):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        await _call(fn)
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    blocks_after = sys.getallocatedblocks()
+    tracemalloc.stop()
+
+    return {
+        "calls": calls,
+        "rounds": rounds,
+        "ops_per_sec": calls / best,
+        "mean_us": best / calls * 1e6,
+        "spread_pct": (max(timings) - best) / best * 100,
+        "peak_alloc_bytes": sum(peaks) / len(peaks),
+        "retained_blocks_per_call": (blocks_after - blocks_before) / samples,
+    }
+
+
+def compare(current: dict, baseline: dict, max_regression: Optional[float]) -> bool:
+    """Print current results next to the baseline; False if something regressed too far"""
+    ok = True
+    print(f"\n{'benchmark':<40}{'baseline/s':>14}{'current/s':>14}{'change':>10}{'alloc':>10}")
+    for name, result in current.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:<40}{'-':>14}{result['ops_per_sec']:>14.0f}{'new':>10}")
+            continue
+        change = (result["ops_per_sec"] / before["ops_per_sec"] - 1) * 100
+        alloc = result["peak_alloc_bytes"] - before["peak_alloc_bytes"]
+        flag = ""
+        if max_regression is not None and change < -max_regression:
+            flag = "  ❌"
+            ok = False
+        print(f"{name:<40}{before['ops_per_sec']:>14.0f}{result['ops_per_sec']:>14.0f}{change:>+9.1f}%{alloc:>+10.0f}{flag}")
+    return ok
+
+
+async def run(args) -> dict:
+    fixtures = Fixtures()
+    started = time.perf_counter()
+    await fixtures.build(args.seed)
+    print(f"🧪 Fixtures ready in {time.perf_counter() - started:.1f}s ({MESSAGES} messages, {CONTACTS} contacts)", file=sys.__stdout__)
+
+    selected = [name for name in BENCHMARKS if not args.k or any(pattern in name for pattern in args.k)]
+    results = {}
+    for name in selected:
+        fn = BENCHMARKS[name](fixtures)
+        result = await measure(fn, args.min_time, args.rounds)
+        results[name] = result
+        print(f"{name:<40}{result['ops_per_sec']:>14.1f} ops/s{result['mean_us']:>12.1f} us"
+              f"{result['peak_alloc_bytes'] / 1024:>10.1f} KiB peak", file=sys.__stdout__)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for auth, key, history and contact hot paths")
+    parser.add_argument("-k", action="append", help="only run benchmarks whose name contains this (repeatable)")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per timed round")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="results file (default: benchmarks/results/micro-<time>.json)")
+    parser.add_argument("--compare", help="baseline results file to compare against")
+    parser.add_argument("--max-regression", type=float, help="fail if ops/sec drops more than this percent")
+    args = parser.parse_args(argv)
+
+    prepare_app()
+    # Keep the app's own logging out of the numbers and the output
+    stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    write_results(args.out or default_output("micro"), {
+        "benchmark": "micro",
+        **run_metadata(),
+        "config": {"min_time": args.min_time, "rounds": args.rounds, "seed": args.seed},
+        "benchmarks": results,
+    })
+
+    if args.compare:
+        if not compare(results, load_results(args.compare)["benchmarks"], args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
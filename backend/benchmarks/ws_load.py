@@ -0,0 +1,420 @@
+"""Load test for the /ws/chat socket of a single worker.
+
+Starts the app under uvicorn on localhost in a child process, backed by the
+in-memory database (benchmarks/memdb.py), with one seeded user per client.
+Client processes then open authenticated sockets, pair up, and send each
+other encrypted-message frames sized like real Kyber768/Dilithium3 traffic
+at a fixed rate. Every frame carries its send time, so the receiving client
+measures end-to-end delivery latency, and the sender times the
+"✅ Message delivered" ack.
+
+Run from backend/:
+
+    python -m benchmarks.ws_load --clients 2000 --rate 2 --duration 30
+    python -m benchmarks.ws_load --clients 500 --rate 20 --client-procs 2 --out results/ws.json
+
+Results (throughput, latency percentiles, server memory per connection and
+the server's own queue stats) are written as JSON for comparing releases.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import multiprocessing
+import os
+import random
+import struct
+import sys
+import time
+import urllib.request
+from collections import Counter, deque
+from typing import Deque, List, Optional, Tuple
+
+from benchmarks.common import (
+    default_output, latency_summary, prepare_app, process_memory,
+    raise_fd_limit, run_metadata, write_results,
+)
+
+# Wire sizes of the post-quantum pieces of one message
+KYBER768_CIPHERTEXT = 1088
+KYBER768_PUBLIC_KEY = 1184
+DILITHIUM3_SIGNATURE = 3293
+DILITHIUM3_PUBLIC_KEY = 1952
+AES_GCM_IV = 12
+AES_GCM_TAG = 16
+
+# Sequence number and perf_counter send time at the front of encryptedMessage.
+# 24 bytes base64-encode to exactly 32 characters, so the rest of the payload
+# can be encoded once per client and reused.
+STAMP = struct.Struct(">Qd8x")
+STAMP_B64 = 32
+
+DELIVERED = "✅ Message delivered"
+# Statuses that answer a send the client made, without it being delivered
+SEND_FAILURES = ("❌", "⚠️ Message delivered but not stored")
+
+
+def b64(data: bytes) -> str:
+    return base64.b64encode(data).decode()
+
+
+def seed_users(count: int, seed: int) -> List[Tuple[str, str]]:
+    """(user_id, username) for every benchmark user, the same for a given seed"""
+    from bson import ObjectId
+    rng = random.Random(seed)
+    return [(str(ObjectId(rng.randbytes(12))), f"bench{i}") for i in range(count)]
+
+
+# --- Server process ---------------------------------------------------------
+
+def serve(port: int, users: List[Tuple[str, str]], seed: int, log: Optional[str], ready):
+    raise_fd_limit()
+    prepare_app()
+    # The app logs to stdout; keep it out of the benchmark's own output
+    sys.stdout = open(log or os.devnull, "w", buffering=1)
+    asyncio.run(_serve(port, users, seed, ready))
+
+
+async def _serve(port: int, users: List[Tuple[str, str]], seed: int, ready):
+    import uvicorn
+    from bson import ObjectId
+    import src
+    from src.db.main import users as user_collection
+    from src.db.keys import key_fields
+
+    rng = random.Random(seed)
+    await user_collection.insert_many([
+        {
+            "_id": ObjectId(user_id),
+            "username": username,
+            "email": f"{username}@bench.local",
+            "password_hash": b"",
+            "invite_code": username,
+            "is_active": True,
+            **key_fields(rng.randbytes(KYBER768_PUBLIC_KEY), rng.randbytes(DILITHIUM3_PUBLIC_KEY)),
+        }
+        for user_id, username in users
+    ])
+
+    server = uvicorn.Server(uvicorn.Config(
+        src.app, host="127.0.0.1", port=port, log_level="warning",
+        ws="auto", lifespan="on", backlog=4096,
+    ))
+    task = asyncio.create_task(server.serve())
+    while not server.started and not task.done():
+        await asyncio.sleep(0.05)
+    ready.set()
+    await task
+
+
+# --- Client processes -------------------------------------------------------
+
+class Client:
+    __slots__ = ("user_id", "peer_id", "token", "ws", "prefix", "suffix", "seq", "pending")
+
+    def __init__(self, user_id: str, peer_id: str, token: str, rng: random.Random, plaintext: int):
+        self.user_id = user_id
+        self.peer_id = peer_id
+        self.token = token
+        self.ws = None
+        self.seq = 0
+        # Send times of messages still waiting for their delivered ack, oldest first
+        self.pending: Deque[float] = deque()
+
+        self.prefix = (
+            '{"type":"encrypted-message","from":"%s","to":"%s","ciphertext":"%s","iv":"%s","signature":"%s","encryptedMessage":"'
+            % (
+                user_id, peer_id,
+                b64(rng.randbytes(KYBER768_CIPHERTEXT)),
+                b64(rng.randbytes(AES_GCM_IV)),
+                b64(rng.randbytes(DILITHIUM3_SIGNATURE)),
+            )
+        )
+        tail = rng.randbytes(max(plaintext + AES_GCM_TAG - STAMP.size, 0))
+        self.suffix = b64(tail) + '"}'
+
+    def message(self, sent_at: float) -> str:
+        self.seq += 1
+        return self.prefix + b64(STAMP.pack(self.seq, sent_at)) + self.suffix
+
+
+class Window:
+    """Only traffic sent inside [start, end) counts towards the results"""
+
+    def __init__(self):
+        self.start = float("inf")
+        self.end = float("inf")
+
+    def __contains__(self, sent_at: float) -> bool:
+        return self.start <= sent_at < self.end
+
+
+class ClientStats:
+    def __init__(self):
+        self.sent = 0
+        self.delivered = 0
+        self.acked = 0
+        self.delivery: List[float] = []
+        self.acks: List[float] = []
+        self.statuses: Counter = Counter()
+        self.errors: Counter = Counter()
+
+
+async def _receive(client: Client, window: Window, stats: ClientStats):
+    async for message in client.ws:
+        now = time.perf_counter()
+        if isinstance(message, bytes):
+            continue
+        if message.startswith("STATUS:"):
+            text = message[7:]
+            if text == DELIVERED or text.startswith(SEND_FAILURES):
+                sent_at = client.pending.popleft() if client.pending else None
+                if text == DELIVERED:
+                    if sent_at is not None and sent_at in window:
+                        stats.acked += 1
+                        stats.acks.append(now - sent_at)
+                else:
+                    stats.errors[text] += 1
+            else:
+                stats.statuses[text.split(" ", 1)[0]] += 1
+            continue
+
+        frame = json.loads(message)
+        if frame.get("type") == "encrypted-message":
+            _, sent_at = STAMP.unpack(base64.b64decode(frame["encryptedMessage"][:STAMP_B64]))
+            if sent_at in window:
+                stats.delivered += 1
+                stats.delivery.append(now - sent_at)
+        elif frame.get("type") == "ping":
+            await client.ws.send('{"type":"pong"}')
+
+
+async def _send(client: Client, rate: float, stop_at: float, stats: ClientStats):
+    interval = 1.0 / rate
+    # Spread clients over the interval instead of firing in lockstep
+    next_at = time.perf_counter() + random.uniform(0, interval)
+    while True:
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        sent_at = time.perf_counter()
+        if sent_at >= stop_at:
+            return
+        client.pending.append(sent_at)
+        await client.ws.send(client.message(sent_at))
+        stats.sent += 1
+        next_at += interval
+
+
+async def _connect(client: Client, url: str, limit: asyncio.Semaphore) -> bool:
+    import websockets
+    async with limit:
+        try:
+            client.ws = await websockets.connect(
+                url,
+                additional_headers={"Cookie": f"access_token={client.token}"},
+                max_size=None,
+                ping_interval=None,
+                compression=None,
+                open_timeout=60,
+            )
+            return True
+        except Exception as e:
+            print(f"⚠️ Client {client.user_id} failed to connect: {e}", file=sys.stderr)
+            return False
+
+
+async def _run_clients(args, clients_spec, connected, start, results):
+    rng = random.Random(args.seed + len(clients_spec))
+    clients = [Client(user_id, peer_id, token, rng, args.plaintext) for user_id, peer_id, token in clients_spec]
+    url = f"ws://127.0.0.1:{args.port}/api/v1/ws/chat"
+
+    limit = asyncio.Semaphore(args.connect_concurrency)
+    outcome = await asyncio.gather(*(_connect(client, url, limit) for client in clients))
+    live = [client for client, ok in zip(clients, outcome) if ok]
+    connected.put((len(live), len(clients) - len(live)))
+
+    # Every client process starts sending at the same moment
+    await asyncio.get_running_loop().run_in_executor(None, start.wait)
+
+    stats = ClientStats()
+    window = Window()
+    began = time.perf_counter()
+    window.start = began + args.warmup
+    window.end = window.start + args.duration
+
+    receivers = [asyncio.create_task(_receive(client, window, stats)) for client in live]
+    senders = [asyncio.create_task(_send(client, args.rate, window.end, stats)) for client in live]
+    await asyncio.gather(*senders, return_exceptions=True)
+    # Give in-flight messages and acks a chance to land
+    await asyncio.sleep(args.drain)
+
+    for client in live:
+        await client.ws.close()
+    for task in receivers:
+        task.cancel()
+    await asyncio.gather(*receivers, return_exceptions=True)
+
+    results.put({
+        "sent": stats.sent,
+        "delivered": stats.delivered,
+        "acked": stats.acked,
+        "delivery": stats.delivery,
+        "acks": stats.acks,
+        "statuses": dict(stats.statuses),
+        "errors": dict(stats.errors),
+        "unacked": sum(len(client.pending) for client in live),
+    })
+
+
+def run_clients(args, clients_spec, connected, start, results):
+    raise_fd_limit()
+    asyncio.run(_run_clients(args, clients_spec, connected, start, results))
+
+
+# --- Driver -----------------------------------------------------------------
+
+def _server_stats(port: int, token: str) -> Optional[dict]:
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{port}/api/v1/ws/queues",
+        headers={"Cookie": f"access_token={token}"}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            stats = json.load(response)
+            stats.pop("connection", None)
+            return stats
+    except Exception as e:
+        print(f"⚠️ Could not read server stats: {e}", file=sys.stderr)
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the /ws/chat socket of one worker")
+    parser.add_argument("--clients", type=int, default=1000, help="connected clients, paired two by two")
+    parser.add_argument("--rate", type=float, default=1.0, help="messages per second each client sends")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5.0, help="seconds of traffic before measuring")
+    parser.add_argument("--drain", type=float, default=3.0, help="seconds to wait for in-flight messages")
+    parser.add_argument("--plaintext", type=int, default=256, help="plaintext bytes per message")
+    parser.add_argument("--client-procs", type=int, default=1, help="processes driving the clients")
+    parser.add_argument("--connect-concurrency", type=int, default=200)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--server-log", help="file for the server's own output")
+    parser.add_argument("--out", help="results file (default: benchmarks/results/ws_load-<time>.json)")
+    args = parser.parse_args(argv)
+    if args.clients < 2 or args.clients % 2:
+        parser.error("--clients must be an even number >= 2")
+
+    raise_fd_limit()
+    prepare_app()
+    from src.utils.auth import create_token
+
+    users = seed_users(args.clients, args.seed)
+    tokens = [create_token({"sub": username}) for _, username in users]
+    # Client 2k talks to 2k+1 and back
+    specs = [(users[i][0], users[i ^ 1][0], tokens[i]) for i in range(args.clients)]
+
+    ctx = multiprocessing.get_context("spawn")
+    ready = ctx.Event()
+    # Not a daemon: the app starts its own password-hashing worker processes,
+    # which daemonic processes may not do. Stopped explicitly below instead.
+    server = ctx.Process(target=serve, args=(args.port, users, args.seed, args.server_log, ready))
+    server.start()
+    try:
+        if not ready.wait(120) or not server.is_alive():
+            sys.exit("❌ Server did not start")
+        memory_idle = process_memory(server.pid)
+        print(f"🚀 Server up (pid {server.pid}), connecting {args.clients} clients")
+
+        connected, results, start = ctx.Queue(), ctx.Queue(), ctx.Event()
+        procs = []
+        per_proc = -(-args.clients // 2 // args.client_procs) * 2
+        for i in range(0, args.clients, per_proc):
+            proc = ctx.Process(target=run_clients, args=(args, specs[i:i + per_proc], connected, start, results), daemon=True)
+            proc.start()
+            procs.append(proc)
+
+        connect_started = time.perf_counter()
+        established = failed = 0
+        for _ in procs:
+            ok, bad = connected.get()
+            established += ok
+            failed += bad
+        connect_seconds = time.perf_counter() - connect_started
+        memory_connected = process_memory(server.pid)
+        print(f"🔌 {established} connected ({failed} failed) in {connect_seconds:.1f}s")
+
+        start.set()
+        print(f"📨 Sending at {args.rate}/s per client: {args.warmup}s warmup, {args.duration}s measured")
+        parts = [results.get() for _ in procs]
+        for proc in procs:
+            proc.join(10)
+        memory_end = process_memory(server.pid)
+        server_stats = _server_stats(args.port, tokens[0])
+    finally:
+        server.terminate()
+        server.join(10)
+
+    delivery = [sample for part in parts for sample in part["delivery"]]
+    acks = [sample for part in parts for sample in part["acks"]]
+    errors, statuses = Counter(), Counter()
+    for part in parts:
+        errors.update(part["errors"])
+        statuses.update(part["statuses"])
+
+    per_connection = None
+    if established and "rss" in memory_idle and "rss" in memory_connected:
+        per_connection = (memory_connected["rss"] - memory_idle["rss"]) / established
+
+    report = {
+        "benchmark": "ws_load",
+        **run_metadata(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("out", "server_log")},
+        "connections": {
+            "requested": args.clients,
+            "established": established,
+            "failed": failed,
+            "connect_seconds": connect_seconds,
+        },
+        "throughput": {
+            "sent": sum(part["sent"] for part in parts),
+            "delivered_in_window": len(delivery),
+            "acked_in_window": len(acks),
+            "unacked": sum(part["unacked"] for part in parts),
+            "offered_msgs_per_sec": established * args.rate,
+            "delivered_msgs_per_sec": len(delivery) / args.duration,
+        },
+        "delivery_latency": latency_summary(delivery),
+        "ack_latency": latency_summary(acks),
+        "errors": dict(errors),
+        "statuses": dict(statuses),
+        "server_memory": {
+            "rss_idle": memory_idle.get("rss"),
+            "rss_connected": memory_connected.get("rss"),
+            "rss_end": memory_end.get("rss"),
+            "peak_rss": memory_end.get("peak_rss"),
+            "bytes_per_connection": per_connection,
+        },
+        "server_stats": server_stats,
+    }
+
+    delivered = report["delivery_latency"]
+    acked = report["ack_latency"]
+    print(f"📊 {report['throughput']['delivered_msgs_per_sec']:.0f} msgs/s delivered "
+          f"(offered {report['throughput']['offered_msgs_per_sec']:.0f})")
+    if delivered["count"]:
+        print(f"   delivery p50 {delivered['p50_ms']:.2f}ms  p95 {delivered['p95_ms']:.2f}ms  p99 {delivered['p99_ms']:.2f}ms")
+    if acked["count"]:
+        print(f"   ack      p50 {acked['p50_ms']:.2f}ms  p95 {acked['p95_ms']:.2f}ms  p99 {acked['p99_ms']:.2f}ms")
+    if per_connection is not None:
+        print(f"   server memory {per_connection / 1024:.1f} KiB per connection")
+    if errors:
+        print(f"   errors: {dict(errors)}")
+
+    write_results(args.out or default_output("ws_load"), report)
+
+
+if __name__ == "__main__":
+    main()
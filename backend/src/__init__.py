@@ -1,14 +1,64 @@
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+from secrets import compare_digest
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
 from middleware import corsPolicy
 from src.routes.auth import authRouter
 from src.routes.user import userRouter
 from src.routes.chat import chatRouter
+from src.routes.health import healthRouter
+from src.ws.connection_manager import manager
+from src.db.writer import message_writer
+from src.db import main as database
+from src.db.migrations import run_migrations
+from src.ws.offline import offline_queue
+from src.ws.heartbeat import heartbeat
+from src.utils.passwords import password_hasher
+from src.utils.email import outbox
+from src.utils.metrics import REGISTRY
+from src.utils.log import configure_logging
+from src.utils.loop_monitor import loop_monitor
+from src.config import Config
 
 version = "v1"
+
+# Log records are written by a background thread from here on
+configure_logging()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # First, so blocking during startup is caught too
+    if Config.LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+    await database.ping()
+    # Backfills can take a while on a large collection - don't hold up startup
+    migrations_task = asyncio.create_task(run_migrations())
+    message_writer.start()
+    await offline_queue.start()
+    await manager.start()
+    heartbeat.start()
+    outbox.start()
+    await password_hasher.start()
+    yield
+    await outbox.stop()
+    await heartbeat.stop()
+    await manager.stop()
+    migrations_task.cancel()
+    await offline_queue.stop()
+    # Flush buffered messages before the process exits
+    await message_writer.stop()
+    await database.close()
+    password_hasher.shutdown()
+    await loop_monitor.stop()
+
+
 app = FastAPI(
     title= "login",
     description="A simple login page",
-    version=version
+    version=version,
+    lifespan=lifespan
 )
 
 corsPolicy(app)
@@ -16,4 +66,15 @@ corsPolicy(app)
 app.include_router(authRouter, prefix=f"/api/{version}/auth")
 app.include_router(userRouter, prefix="/api/{version}/user")
 app.include_router(chatRouter, prefix="/api/{version}")
+app.include_router(healthRouter, prefix=f"/api/{version}/health")
+
 
+if Config.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics(request: Request):
+        """Prometheus scrape target"""
+        if Config.METRICS_TOKEN and not compare_digest(
+            request.headers.get("authorization", ""), f"Bearer {Config.METRICS_TOKEN}"
+        ):
+            raise HTTPException(status_code=401, detail="Unauthorized")
+        return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
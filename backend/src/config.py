@@ -1,3 +1,4 @@
+from typing import Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -6,7 +7,109 @@ class Settings(BaseSettings):
     SECRET_KEY: str
     ALGORITHM: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int
-    
+
+    # Mongo connection pool
+    MONGO_MAX_POOL_SIZE: int = 100
+    MONGO_MIN_POOL_SIZE: int = 0
+    MONGO_MAX_IDLE_TIME_MS: int = 60000
+    MONGO_WAIT_QUEUE_TIMEOUT_MS: int = 5000
+
+    # Authenticated-principal cache; also bounds how stale a cached user can be
+    PRINCIPAL_CACHE_SIZE: int = 10000
+    PRINCIPAL_CACHE_TTL: float = 30.0
+
+    # bcrypt runs in a process pool; 0 workers means min(4, cpu count)
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 0
+    PASSWORD_HASH_MAX_PENDING: int = 64
+
+    # Login OTPs and their rate limits. "memory" keeps both per process - only use it with a single worker.
+    OTP_STORE: str = "mongo"
+    OTP_TTL_SECONDS: int = 600
+    OTP_MAX_ATTEMPTS: int = 5
+    OTP_RATE_WINDOW_SECONDS: int = 600
+    OTP_ISSUE_PER_USER: int = 5
+    OTP_ISSUE_PER_IP: int = 20
+    OTP_VERIFY_PER_USER: int = 10
+    OTP_VERIFY_PER_IP: int = 50
+
+    # Outbound mail; MAIL_SMTP_URL (smtp://host:port) overrides the relay, e.g. for a local stand-in
+    MAIL_SMTP_URL: str = ""
+    MAIL_CONCURRENCY: int = 2
+    MAIL_BATCH_SIZE: int = 20
+    MAIL_QUEUE_MAX: int = 1000
+    MAIL_MAX_RETRIES: int = 3
+
+    # Cross-worker routing: empty for in-process only, or redis://host:port/db
+    BACKPLANE_URL: str = ""
+    BACKPLANE_CHANNEL_PREFIX: str = "qchat"
+    WORKER_ID: str = ""
+
+    # Per-connection outbound queues; policy is "drop" or "disconnect"
+    OUTBOUND_QUEUE_MAX: int = 256
+    OUTBOUND_HIGH_WATERMARK: int = 192
+    OUTBOUND_LOW_WATERMARK: int = 64
+    OUTBOUND_OVERFLOW_POLICY: str = "drop"
+    OUTBOUND_STALL_TIMEOUT: float = 30.0
+
+    # Write-behind message persistence
+    MESSAGE_FLUSH_BATCH_SIZE: int = 100
+    MESSAGE_FLUSH_INTERVAL: float = 0.05
+    MESSAGE_BACKLOG_MAX: int = 10000
+    MESSAGE_FLUSH_MAX_RETRIES: int = 5
+    MESSAGE_FLUSH_RETRY_DELAY: float = 0.5
+
+    # Store-and-forward for offline recipients; a drain that backs up the receiver's
+    # outbound queue steps aside and resumes after OFFLINE_DRAIN_RETRY_DELAY
+    OFFLINE_DRAIN_BATCH_SIZE: int = 50
+    OFFLINE_MAX_CONCURRENT_DRAINS: int = 32
+    OFFLINE_DRAIN_RETRY_DELAY: float = 1.0
+    # Messages held per offline receiver; only contacts may queue for someone
+    OFFLINE_MAX_PENDING_PER_RECEIVER: int = 1000
+
+    # WebSocket heartbeats: one scheduler tick pings sockets idle for PING_INTERVAL
+    # and reaps those silent for IDLE_TIMEOUT (0 disables reaping)
+    HEARTBEAT_TICK: float = 5.0
+    HEARTBEAT_JITTER: float = 0.2
+    HEARTBEAT_PING_INTERVAL: float = 25.0
+    HEARTBEAT_IDLE_TIMEOUT: float = 75.0
+
+    # Presence changes are coalesced per watcher and pushed once per window
+    PRESENCE_BATCH_WINDOW: float = 0.25
+
+    # Public key directory: in-process cache, batch size cap and client cache lifetime.
+    # Keys are served with a fingerprint ETag, so expired client copies revalidate with a 304
+    KEY_CACHE_SIZE: int = 10000
+    KEY_CACHE_TTL: float = 300.0
+    KEY_BATCH_MAX: int = 200
+    KEY_HTTP_MAX_AGE: int = 86400
+
+    # Newest messages of each conversation kept in memory for the history endpoint;
+    # conversations are evicted LRU once all rings together pass MAX_BYTES
+    RECENT_MESSAGES_PER_CONVERSATION: int = 100
+    RECENT_MESSAGES_MAX_BYTES: int = 32 * 1024 * 1024
+    RECENT_MESSAGES_TTL: float = 300.0
+
+    # Logging: level, "text" or "json", longest field value written and records buffered
+    # for the writer thread. Per-frame events are sampled at LOG_SAMPLE_RATE when enabled.
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "text"
+    LOG_FIELD_MAX_LENGTH: int = 200
+    LOG_QUEUE_MAX: int = 10000
+    LOG_SAMPLE_RATE: float = 0.01
+
+    # Event-loop diagnostics, off by default: loop lag is sampled every LOOP_MONITOR_INTERVAL
+    # and a callback holding the loop past LOOP_BLOCK_THRESHOLD has its stack captured
+    LOOP_MONITOR_ENABLED: bool = False
+    LOOP_MONITOR_INTERVAL: float = 0.1
+    LOOP_BLOCK_THRESHOLD: float = 0.1
+    LOOP_BLOCK_HISTORY: int = 100
+
+    # Prometheus text metrics at /metrics, off by default. When METRICS_TOKEN is set,
+    # scrapers must send "Authorization: Bearer <token>"
+    METRICS_ENABLED: bool = False
+    METRICS_TOKEN: Optional[str] = None
+
     model_config = SettingsConfigDict(
     env_file=".env"
     )
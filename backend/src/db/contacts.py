@@ -0,0 +1,103 @@
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from bson import ObjectId
+from src.db.main import connections, messages, users
+from src.db import migrations
+from src.utils.pagination import encode_cursor, keyset_filter
+
+# Connections are edges {owner_id, contact_id, contact_username, created_at}, one
+# per direction, so a user's contacts are an index range rather than an array
+# riding along on every user document.
+
+CONTACT_PROJECTION = {"contact_id": 1, "contact_username": 1, "created_at": 1}
+
+
+async def add_connection(user: dict, contact: dict):
+    """Connect two users both ways. Safe to repeat - existing edges are left alone."""
+    now = datetime.now(timezone.utc)
+    await connections.bulk_write([
+        migrations.connection_edge(str(user["_id"]), str(contact["_id"]), contact.get("username"), now),
+        migrations.connection_edge(str(contact["_id"]), str(user["_id"]), user.get("username"), now),
+    ], ordered=False)
+
+
+async def _legacy_contact_ids(user_id: str) -> List[str]:
+    """connected_users array of a user the backfill hasn't reached yet"""
+    doc = await users.find_one({"_id": ObjectId(user_id)}, {"connected_users": 1})
+    return (doc or {}).get("connected_users", [])
+
+
+async def contact_ids(user_id: str) -> List[str]:
+    """Every contact of user_id - answered from the unique index alone"""
+    edges = await connections.find(
+        {"owner_id": user_id},
+        {"_id": 0, "contact_id": 1}
+    ).to_list()
+    ids = [edge["contact_id"] for edge in edges]
+    if not migrations.is_complete(migrations.CONNECTIONS_BACKFILL):
+        ids = list(dict.fromkeys(ids + await _legacy_contact_ids(user_id)))
+    return ids
+
+
+async def is_contact(user_id: str, contact_id: str) -> bool:
+    """Whether user_id is connected to contact_id - a single index lookup"""
+    if await connections.find_one({"owner_id": user_id, "contact_id": contact_id}, {"_id": 1}):
+        return True
+    if not migrations.is_complete(migrations.CONNECTIONS_BACKFILL):
+        return contact_id in await _legacy_contact_ids(user_id)
+    return False
+
+
+async def contact_page(
+    user_id: str,
+    position: Optional[Tuple[datetime, ObjectId]],
+    limit: int
+) -> Tuple[List[dict], Optional[str]]:
+    """One page of contacts as [{user_id, username}], oldest connection first"""
+    if not migrations.is_complete(migrations.CONNECTIONS_BACKFILL):
+        # Until the backfill finishes some contacts only exist in the legacy array,
+        # which can't be paged - hand back the whole list once
+        if position is not None:
+            return [], None
+        ids = [uid for uid in await contact_ids(user_id) if ObjectId.is_valid(uid)]
+        docs = await users.find({"_id": {"$in": [ObjectId(uid) for uid in ids]}}, {"username": 1}).to_list()
+        return [{"user_id": str(doc["_id"]), "username": doc["username"]} for doc in docs], None
+
+    query = {"owner_id": user_id, **keyset_filter("created_at", position, older=False)}
+    edges = await connections.find(query, CONTACT_PROJECTION).sort(
+        [("created_at", 1), ("_id", 1)]
+    ).limit(limit + 1).to_list(limit + 1)
+
+    next_cursor = None
+    if len(edges) > limit:
+        edges = edges[:limit]
+        next_cursor = encode_cursor(edges[-1]["created_at"], edges[-1]["_id"])
+
+    return [{"user_id": edge["contact_id"], "username": edge["contact_username"]} for edge in edges], next_cursor
+
+
+async def last_messages(user_id: str, contacts: List[str]) -> Dict[str, dict]:
+    """Newest message of each conversation between user_id and contacts, in one aggregate"""
+    if not contacts or not migrations.is_complete(migrations.CONVERSATION_ID_BACKFILL):
+        return {}
+
+    by_conversation = {migrations.conversation_id(user_id, contact): contact for contact in contacts}
+    cursor = await messages.aggregate([
+        {"$match": {"conversation_id": {"$in": list(by_conversation)}}},
+        # Exact reverse of conversation_timeline, so the index hands back the newest first
+        {"$sort": {"conversation_id": -1, "timestamp": -1, "_id": -1}},
+        {"$group": {
+            "_id": "$conversation_id",
+            "timestamp": {"$first": "$timestamp"},
+            "sender_id": {"$first": "$sender_id"},
+            "message_type": {"$first": "$message_type"},
+        }},
+    ])
+    return {
+        by_conversation[row["_id"]]: {
+            "timestamp": row["timestamp"].isoformat() if row.get("timestamp") else None,
+            "sender_id": row.get("sender_id"),
+            "message_type": row.get("message_type"),
+        }
+        for row in await cursor.to_list()
+    }
@@ -0,0 +1,80 @@
+from datetime import datetime, timezone
+from typing import Dict, List, NamedTuple, Optional
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError
+from src.db.main import db
+from src.utils.log import get_logger
+
+log = get_logger("db.indexes")
+
+
+class IndexSpec(NamedTuple):
+    name: str
+    keys: List[tuple]
+    unique: bool = False
+    # Makes this a TTL index: documents expire this many seconds after the indexed date
+    expire_after: Optional[int] = None
+
+
+# Every index the app relies on, by collection. ensure_indexes() creates them at startup.
+INDEXES: Dict[str, List[IndexSpec]] = {
+    "users": [
+        IndexSpec("username_unique", [("username", ASCENDING)], unique=True),
+        IndexSpec("email_unique", [("email", ASCENDING)], unique=True),
+        IndexSpec("invite_code_unique", [("invite_code", ASCENDING)], unique=True),
+    ],
+    "messages": [
+        # One range scan per conversation, already in page order
+        IndexSpec("conversation_timeline", [("conversation_id", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)]),
+    ],
+    "pending_messages": [
+        IndexSpec("receiver_pending", [("receiver_id", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)]),
+    ],
+    "connections": [
+        # One edge per direction; also covers "who are my contacts" without touching the documents
+        IndexSpec("owner_contact_unique", [("owner_id", ASCENDING), ("contact_id", ASCENDING)], unique=True),
+        # Contact list pages in the order the connections were made
+        IndexSpec("owner_timeline", [("owner_id", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)]),
+    ],
+    "otps": [
+        IndexSpec("otp_expiry", [("expires_at", ASCENDING)], expire_after=0),
+    ],
+    "otp_rate_limits": [
+        IndexSpec("window_expiry", [("expires_at", ASCENDING)], expire_after=0),
+    ],
+}
+
+# "collection.index" -> {"state": pending|building|ready|failed, ...}
+index_status: Dict[str, dict] = {
+    f"{collection}.{spec.name}": {"state": "pending"}
+    for collection, specs in INDEXES.items()
+    for spec in specs
+}
+
+
+async def ensure_indexes():
+    """Create every declared index, recording the outcome of each build"""
+    for collection, specs in INDEXES.items():
+        for spec in specs:
+            key = f"{collection}.{spec.name}"
+            index_status[key] = {"state": "building", "started_at": datetime.now(timezone.utc)}
+            try:
+                options = {"name": spec.name, "unique": spec.unique}
+                if spec.expire_after is not None:
+                    options["expireAfterSeconds"] = spec.expire_after
+                await db[collection].create_index(spec.keys, **options)
+                index_status[key] = {"state": "ready", "finished_at": datetime.now(timezone.utc)}
+            except PyMongoError as e:
+                # e.g. existing duplicates block a unique index - keep going with the rest
+                log.error("❌ Index build failed", index=key, error=e)
+                index_status[key] = {"state": "failed", "error": str(e), "finished_at": datetime.now(timezone.utc)}
+
+    ready = sum(1 for status in index_status.values() if status["state"] == "ready")
+    log.info("🗂️ Indexes ready", ready=ready, total=len(index_status))
+
+
+def schema_report() -> dict:
+    return {
+        "ready": all(status["state"] == "ready" for status in index_status.values()),
+        "indexes": index_status,
+    }
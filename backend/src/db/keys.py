@@ -0,0 +1,112 @@
+import base64
+import hashlib
+from typing import Dict, Iterable, Optional
+from bson import ObjectId
+from src.config import Config
+from src.db.main import users
+from src.utils.cache import TTLCache
+
+# Public keys are stored base64 encoded - the form clients send and receive - next
+# to a fingerprint of both keys and a version that goes up whenever they change.
+
+KEY_PROJECTION = {
+    "kyber_public_key": 1,
+    "dilithium_public_key": 1,
+    "key_fingerprint": 1,
+    "key_version": 1,
+}
+
+
+def fingerprint(kyber: bytes, dilithium: bytes) -> str:
+    """SHA-256 over both keys, length-prefixed so the boundary can't shift"""
+    digest = hashlib.sha256()
+    for key in (kyber, dilithium):
+        digest.update(len(key).to_bytes(4, "big"))
+        digest.update(key)
+    return digest.hexdigest()
+
+
+def key_fields(kyber: bytes, dilithium: bytes, version: int = 1) -> dict:
+    """User document fields for a key pair"""
+    return {
+        "kyber_public_key": base64.b64encode(kyber).decode(),
+        "dilithium_public_key": base64.b64encode(dilithium).decode(),
+        "key_fingerprint": fingerprint(kyber, dilithium),
+        "key_version": version,
+    }
+
+
+def _record(doc: dict) -> Optional[dict]:
+    """Directory entry for a user document, converting hex keys the backfill hasn't reached"""
+    if doc.get("key_fingerprint"):
+        fields = doc
+    else:
+        try:
+            fields = key_fields(bytes.fromhex(doc["kyber_public_key"]), bytes.fromhex(doc["dilithium_public_key"]))
+        except (KeyError, TypeError, ValueError):
+            return None
+    return {
+        "kyber_public_key": fields["kyber_public_key"],
+        "dilithium_public_key": fields["dilithium_public_key"],
+        "key_fingerprint": fields["key_fingerprint"],
+        "key_version": fields.get("key_version", 1),
+    }
+
+
+def etag(records: Dict[str, Optional[dict]]) -> str:
+    """Strong ETag for a set of directory entries (None = unknown user)"""
+    digest = hashlib.sha256()
+    for user_id in sorted(records):
+        record = records[user_id]
+        state = f"{record['key_fingerprint']}:{record['key_version']}" if record else "-"
+        digest.update(f"{user_id}={state}\n".encode())
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+class KeyDirectory:
+    """Looks up public keys for many users at once.
+
+    Entries are cached per user, so a batch only queries the users it hasn't
+    seen lately - in a single $in - and nothing is re-encoded on the way out.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self._cache = TTLCache(max_size, ttl)
+
+    async def get_many(self, user_ids: Iterable[str]) -> Dict[str, Optional[dict]]:
+        found: Dict[str, Optional[dict]] = {}
+        misses = []
+        for user_id in dict.fromkeys(user_ids):
+            record = self._cache.get(user_id)
+            if record is not None:
+                found[user_id] = record
+            elif ObjectId.is_valid(user_id):
+                misses.append(user_id)
+            else:
+                found[user_id] = None
+
+        if misses:
+            docs = await users.find(
+                {"_id": {"$in": [ObjectId(user_id) for user_id in misses]}},
+                KEY_PROJECTION
+            ).to_list()
+            loaded = {str(doc["_id"]): _record(doc) for doc in docs}
+            for user_id in misses:
+                record = loaded.get(user_id)
+                found[user_id] = record
+                if record is not None:
+                    self._cache.set(user_id, record)
+        return found
+
+    async def get(self, user_id: str) -> Optional[dict]:
+        return (await self.get_many([user_id]))[user_id]
+
+    def invalidate(self, user_id: str):
+        """Call whenever a user's keys change"""
+        self._cache.pop(str(user_id))
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+key_directory = KeyDirectory(Config.KEY_CACHE_SIZE, Config.KEY_CACHE_TTL)
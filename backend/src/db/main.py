@@ -1,21 +1,72 @@
 import pymongo
-from pymongo.mongo_client import MongoClient,CodecOptions
+from pymongo import AsyncMongoClient, monitoring
+from pymongo.mongo_client import CodecOptions
 from src.config import Config
+from src.utils.metrics import db_command_failures, db_command_seconds
 from datetime import timezone
+from src.utils.log import get_logger
+
+log = get_logger("db")
 
 codec_options = CodecOptions(tz_aware=True, tzinfo= timezone.utc)
 uri = Config.DATABASE_URL
 
-client = MongoClient(uri)
+class CommandTimer(monitoring.CommandListener):
+    """Feeds per-collection command latency to the metrics registry.
+
+    The driver reports durations itself, so this only remembers which
+    collection each in-flight request targets.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            target = event.command.get("collection")
+        if not isinstance(target, str):
+            target = "-"
+        self._inflight[(event.connection_id, event.request_id)] = target
+
+    def succeeded(self, event):
+        collection = self._inflight.pop((event.connection_id, event.request_id), "-")
+        db_command_seconds.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        collection = self._inflight.pop((event.connection_id, event.request_id), "-")
+        db_command_seconds.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+        db_command_failures.labels(collection, event.command_name).inc()
+
+
+# Native asyncio driver - queries never block the event loop every WebSocket shares
+client = AsyncMongoClient(
+    uri,
+    maxPoolSize=Config.MONGO_MAX_POOL_SIZE,
+    minPoolSize=Config.MONGO_MIN_POOL_SIZE,
+    maxIdleTimeMS=Config.MONGO_MAX_IDLE_TIME_MS,
+    waitQueueTimeoutMS=Config.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    event_listeners=[CommandTimer()] if Config.METRICS_ENABLED else []
+)
 
 db = client["auth"]
 
 users = db.get_collection("users", codec_options=codec_options)
 messages = db.get_collection("messages", codec_options=codec_options)
+pending_messages = db.get_collection("pending_messages", codec_options=codec_options)
+schema_migrations = db.get_collection("schema_migrations", codec_options=codec_options)
+otps = db.get_collection("otps", codec_options=codec_options)
+otp_rate_limits = db.get_collection("otp_rate_limits", codec_options=codec_options)
+connections = db.get_collection("connections", codec_options=codec_options)
+
+
+async def ping():
+    try:
+        await client.admin.command('ping')
+        log.info("🍃 Connected to MongoDB")
+    except pymongo.errors.PyMongoError as e:
+        log.error("❌ MongoDB ping failed", error=e)
 
 
-try:
-    client.admin.command('ping')
-    print("Pinged your deployment. You successfully connected to MongoDB!")
-except pymongo.errors.PyMongoError as e:
-    print(e)
\ No newline at end of file
+async def close():
+    await client.close()
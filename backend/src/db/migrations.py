@@ -0,0 +1,182 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import Dict, Optional
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+from src.db.main import connections, messages, schema_migrations, users
+from src.db.indexes import ensure_indexes
+from src.db.keys import key_fields
+from src.utils.log import get_logger
+
+log = get_logger("db.migrations")
+
+CONVERSATION_ID_BACKFILL = "messages_conversation_id_backfill"
+CONNECTIONS_BACKFILL = "users_connected_users_to_edges"
+PUBLIC_KEYS_BACKFILL = "users_public_keys_to_base64"
+
+# Migrations that finished, either in this process or recorded by another worker
+completed: Dict[str, bool] = {}
+
+
+def conversation_id(user_a: str, user_b: str) -> str:
+    """Canonical key for the conversation between two users, the same from both sides"""
+    return ":".join(sorted((user_a, user_b)))
+
+
+def is_complete(name: str) -> bool:
+    return completed.get(name, False)
+
+
+async def backfill_conversation_ids(batch_size: int = 1000) -> int:
+    """Set conversation_id on messages written before it existed, one batch at a time"""
+    updated = 0
+    last_id = None
+    while True:
+        query = {"conversation_id": {"$exists": False}}
+        if last_id is not None:
+            # Walk by _id so each batch starts where the last one ended instead of rescanning
+            query["_id"] = {"$gt": last_id}
+        batch = await messages.find(
+            query,
+            {"sender_id": 1, "receiver_id": 1}
+        ).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            return updated
+        last_id = batch[-1]["_id"]
+
+        updates = []
+        for doc in batch:
+            try:
+                key = conversation_id(doc["sender_id"], doc["receiver_id"])
+            except (KeyError, TypeError):
+                log.warning("⚠️ Skipping message without sender or receiver", message_id=doc["_id"])
+                continue
+            updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"conversation_id": key}}))
+        if updates:
+            await messages.bulk_write(updates, ordered=False)
+        updated += len(updates)
+        # Let live traffic through between batches
+        await asyncio.sleep(0)
+
+
+def connection_edge(owner_id: str, contact_id: str, contact_username: Optional[str], created_at: datetime) -> UpdateOne:
+    """Idempotent upsert of one owner -> contact edge"""
+    return UpdateOne(
+        {"owner_id": owner_id, "contact_id": contact_id},
+        {"$setOnInsert": {"contact_username": contact_username, "created_at": created_at}},
+        upsert=True
+    )
+
+
+async def backfill_connections(batch_size: int = 500) -> int:
+    """Move the embedded users.connected_users arrays into the connections collection.
+
+    Each batch upserts its edges before unsetting the arrays, so a crash midway
+    only repeats upserts that are already there.
+    """
+    moved = 0
+    last_id = None
+    while True:
+        query = {"connected_users": {"$exists": True}}
+        if last_id is not None:
+            # Walk by _id so each batch starts where the last one ended instead of rescanning
+            query["_id"] = {"$gt": last_id}
+        batch = await users.find(
+            query,
+            {"connected_users": 1}
+        ).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            return moved
+        last_id = batch[-1]["_id"]
+
+        contact_ids = {cid for doc in batch for cid in doc.get("connected_users") or [] if ObjectId.is_valid(cid)}
+        names = {
+            str(doc["_id"]): doc.get("username")
+            for doc in await users.find(
+                {"_id": {"$in": [ObjectId(cid) for cid in contact_ids]}},
+                {"username": 1}
+            ).to_list()
+        }
+
+        now = datetime.now(timezone.utc)
+        edges = [
+            connection_edge(str(doc["_id"]), cid, names[cid], now)
+            for doc in batch
+            for cid in dict.fromkeys(doc.get("connected_users") or [])
+            # Drop dangling ids left behind by deleted users
+            if cid in names
+        ]
+        if edges:
+            await connections.bulk_write(edges, ordered=False)
+        await users.update_many(
+            {"_id": {"$in": [doc["_id"] for doc in batch]}},
+            {"$unset": {"connected_users": ""}}
+        )
+        moved += len(edges)
+        # Let live traffic through between batches
+        await asyncio.sleep(0)
+
+
+async def backfill_public_keys(batch_size: int = 500) -> int:
+    """Re-encode hex public keys as base64 and give them a fingerprint and version"""
+    converted = 0
+    last_id = None
+    while True:
+        query = {"key_fingerprint": {"$exists": False}, "kyber_public_key": {"$exists": True}}
+        if last_id is not None:
+            # Walk by _id so documents with unreadable keys are passed over, not retried forever
+            query["_id"] = {"$gt": last_id}
+        batch = await users.find(
+            query,
+            {"kyber_public_key": 1, "dilithium_public_key": 1}
+        ).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            return converted
+        last_id = batch[-1]["_id"]
+
+        updates = []
+        for doc in batch:
+            try:
+                fields = key_fields(bytes.fromhex(doc["kyber_public_key"]), bytes.fromhex(doc["dilithium_public_key"]))
+            except (KeyError, TypeError, ValueError):
+                log.warning("⚠️ Skipping unreadable public keys", user_id=doc["_id"])
+                continue
+            updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": fields}))
+        if updates:
+            await users.bulk_write(updates, ordered=False)
+        converted += len(updates)
+        # Let live traffic through between batches
+        await asyncio.sleep(0)
+
+
+async def _run_once(name: str, migration) -> Optional[int]:
+    if await schema_migrations.find_one({"_id": name}):
+        completed[name] = True
+        return None
+
+    result = await migration()
+    await schema_migrations.update_one(
+        {"_id": name},
+        {"$set": {"completed_at": datetime.now(timezone.utc), "result": result}},
+        upsert=True
+    )
+    completed[name] = True
+    return result
+
+
+async def run_migrations():
+    """Ensure indexes and apply pending data migrations"""
+    try:
+        await ensure_indexes()
+        updated = await _run_once(CONVERSATION_ID_BACKFILL, backfill_conversation_ids)
+        if updated is not None:
+            log.info("🗂️ Backfilled conversation_id", messages=updated)
+        moved = await _run_once(CONNECTIONS_BACKFILL, backfill_connections)
+        if moved is not None:
+            log.info("🗂️ Moved connections into the connections collection", edges=moved)
+        converted = await _run_once(PUBLIC_KEYS_BACKFILL, backfill_public_keys)
+        if converted is not None:
+            log.info("🗂️ Re-encoded public keys", users=converted)
+    except PyMongoError as e:
+        log.error("❌ Migrations failed", error=e)
@@ -0,0 +1,172 @@
+import time
+from collections import OrderedDict, deque
+from typing import Deque, List, Optional
+from src.config import Config
+
+# Rough per-document overhead on top of its string/bytes payload
+DOC_OVERHEAD = 256
+
+
+def _doc_size(doc: dict) -> int:
+    return DOC_OVERHEAD + sum(
+        len(value) for value in doc.values()
+        if isinstance(value, (str, bytes, bytearray, memoryview))
+    )
+
+
+class ConversationRing:
+    """Newest messages of one conversation, oldest first, with no gaps.
+
+    complete means the ring holds the conversation's entire history, so a
+    page shorter than requested is still the right answer.
+    """
+
+    __slots__ = ("messages", "size", "complete", "filled_at")
+
+    def __init__(self):
+        self.messages: Deque[dict] = deque()
+        self.size = 0
+        self.complete = False
+        self.filled_at = time.monotonic()
+
+
+class RecentMessages:
+    """Per-conversation ring buffers of recent message documents.
+
+    Each ring keeps at most per_conversation messages; all rings together stay
+    under max_bytes by evicting whole conversations, least recently used first.
+    Sends are appended as they are handed to the writer and newest-page history
+    reads refill a ring from Mongo, so the newest page of an active chat never
+    needs a query. A ring is trusted for ttl seconds after it was created or
+    refilled, which bounds staleness from messages another worker stored.
+    """
+
+    def __init__(self, per_conversation: int = 100, max_bytes: int = 32 * 1024 * 1024, ttl: float = 300.0):
+        self.per_conversation = per_conversation
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._rings: "OrderedDict[str, ConversationRing]" = OrderedDict()
+        self.bytes = 0
+
+        # Stats
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _ring(self, conversation_id: str) -> ConversationRing:
+        ring = self._rings.get(conversation_id)
+        if ring is None:
+            ring = self._rings[conversation_id] = ConversationRing()
+        self._rings.move_to_end(conversation_id)
+        return ring
+
+    def _push(self, ring: ConversationRing, doc: dict):
+        size = _doc_size(doc)
+        ring.messages.append(doc)
+        ring.size += size
+        self.bytes += size
+        while len(ring.messages) > self.per_conversation:
+            self._pop_oldest(ring)
+            ring.complete = False
+
+    def _pop_oldest(self, ring: ConversationRing):
+        size = _doc_size(ring.messages.popleft())
+        ring.size -= size
+        self.bytes -= size
+
+    def _drop(self, conversation_id: str):
+        ring = self._rings.pop(conversation_id, None)
+        if ring is not None:
+            self.bytes -= ring.size
+
+    def _enforce_limit(self):
+        while self.bytes > self.max_bytes and self._rings:
+            oldest = next(iter(self._rings))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def append(self, conversation_id: str, doc: dict):
+        """Record a message that was just sent; it is the newest of its conversation"""
+        if self.per_conversation <= 0:
+            return
+        self._push(self._ring(conversation_id), doc)
+        self._enforce_limit()
+
+    def fill(self, conversation_id: str, docs: List[dict], complete: bool):
+        """Seed a ring with the newest page read from Mongo (oldest first).
+
+        Messages already in the ring that Mongo doesn't have yet - sent but not
+        flushed - are kept on top.
+        """
+        if self.per_conversation <= 0:
+            return
+        previous = self._rings.get(conversation_id)
+        seen = {doc["_id"] for doc in docs}
+        unflushed = []
+        if previous is not None:
+            newest = (docs[-1]["timestamp"], docs[-1]["_id"]) if docs else None
+            unflushed = [
+                doc for doc in previous.messages
+                if doc["_id"] not in seen and (newest is None or (doc["timestamp"], doc["_id"]) > newest)
+            ]
+            self._drop(conversation_id)
+
+        ring = self._ring(conversation_id)
+        ring.complete = complete
+        for doc in docs + unflushed:
+            self._push(ring, doc)
+        self._enforce_limit()
+
+    def newest(self, conversation_id: str, limit: int) -> Optional[List[dict]]:
+        """The newest limit messages oldest first, or None if they aren't all in memory"""
+        ring = self._rings.get(conversation_id)
+        if ring is not None and time.monotonic() - ring.filled_at > self.ttl:
+            self._drop(conversation_id)
+            ring = None
+        if ring is None or (len(ring.messages) < limit and not ring.complete):
+            self.misses += 1
+            return None
+
+        self._rings.move_to_end(conversation_id)
+        self.hits += 1
+        count = min(limit, len(ring.messages))
+        return [ring.messages[i] for i in range(len(ring.messages) - count, len(ring.messages))]
+
+    def discard(self, conversation_id: str, message_id):
+        """Forget one message, e.g. because storing it failed"""
+        ring = self._rings.get(conversation_id)
+        if ring is None:
+            return
+        for doc in ring.messages:
+            if doc["_id"] == message_id:
+                ring.messages.remove(doc)
+                size = _doc_size(doc)
+                ring.size -= size
+                self.bytes -= size
+                return
+
+    def invalidate(self, conversation_id: str):
+        """Drop a conversation whose history changed somewhere we didn't see"""
+        if conversation_id in self._rings:
+            self._drop(conversation_id)
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "conversations": len(self._rings),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+recent_messages = RecentMessages(
+    per_conversation=Config.RECENT_MESSAGES_PER_CONVERSATION,
+    max_bytes=Config.RECENT_MESSAGES_MAX_BYTES,
+    ttl=Config.RECENT_MESSAGES_TTL,
+)
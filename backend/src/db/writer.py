@@ -0,0 +1,174 @@
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Deque, List, Optional, Tuple
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, PyMongoError
+from src.config import Config
+from src.db.main import messages
+from src.utils.log import get_logger
+
+log = get_logger("db.writer")
+
+# on_stored(success) is awaited once the document is durable or given up on
+StoredCallback = Callable[[bool], Awaitable[None]]
+
+DUPLICATE_KEY = 11000
+
+
+class MessageWriter:
+    """Write-behind buffer that persists chat messages in batches.
+
+    put() only appends to an in-memory buffer, so delivery never waits on Mongo.
+    A background flusher writes the buffer with insert_many as soon as
+    batch_size documents are waiting or flush_interval seconds have passed,
+    retrying failed batches with exponential backoff. Documents get their _id
+    up front so a retried batch can't insert the same message twice.
+    """
+
+    def __init__(
+        self,
+        collection,
+        batch_size: int = 100,
+        flush_interval: float = 0.05,
+        max_backlog: int = 10000,
+        max_retries: int = 5,
+        retry_base_delay: float = 0.5,
+    ):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backlog = max_backlog
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+
+        self._buffer: Deque[Tuple[dict, Optional[StoredCallback]]] = deque()
+        self._in_flight = 0
+        self._has_items = asyncio.Event()
+        self._full = asyncio.Event()
+        self._closing = False
+        self._task: Optional[asyncio.Task] = None
+
+        # Stats
+        self.written = 0
+        self.failed = 0
+        self.rejected = 0
+        self.batches = 0
+
+    @property
+    def backlog(self) -> int:
+        return len(self._buffer) + self._in_flight
+
+    def start(self):
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything that is buffered, then stop the flusher"""
+        if self._task is None:
+            return
+        self._closing = True
+        self._has_items.set()
+        self._full.set()
+        await self._task
+        self._task = None
+
+    def put(self, doc: dict, on_stored: Optional[StoredCallback] = None) -> bool:
+        """Buffer a message document; False if the backlog is full"""
+        if self._closing or self.backlog >= self.max_backlog:
+            self.rejected += 1
+            return False
+
+        doc.setdefault("_id", ObjectId())
+        self._buffer.append((doc, on_stored))
+        self._has_items.set()
+        if len(self._buffer) >= self.batch_size:
+            self._full.set()
+        return True
+
+    async def _run(self):
+        while True:
+            if not self._buffer:
+                if self._closing:
+                    break
+                self._has_items.clear()
+                await self._has_items.wait()
+                continue
+
+            if len(self._buffer) < self.batch_size and not self._closing:
+                # Give the batch a moment to fill up
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            self._in_flight = len(batch)
+            try:
+                await self._write_batch(batch)
+            except Exception:
+                log.exception("❌ Message flusher error")
+            finally:
+                self._in_flight = 0
+
+    async def _write_batch(self, batch: List[Tuple[dict, Optional[StoredCallback]]]):
+        pending = batch
+
+        for attempt in range(self.max_retries + 1):
+            docs = [doc for doc, _ in pending]
+            try:
+                await self.collection.insert_many(docs, ordered=False)
+                stored, pending = pending, []
+            except BulkWriteError as e:
+                # A duplicate _id means an earlier attempt already stored that document
+                retry_indexes = {
+                    err["index"] for err in e.details.get("writeErrors", [])
+                    if err.get("code") != DUPLICATE_KEY
+                }
+                stored = [item for i, item in enumerate(pending) if i not in retry_indexes]
+                pending = [item for i, item in enumerate(pending) if i in retry_indexes]
+            except PyMongoError as e:
+                log.warning("⚠️ Batch insert failed", messages=len(docs), attempt=attempt + 1, error=e)
+                stored = []
+
+            self.written += len(stored)
+            await self._notify(stored, True)
+            if not pending:
+                self.batches += 1
+                log.debug("💾 Flushed batch", messages=len(batch), sample=Config.LOG_SAMPLE_RATE)
+                return
+
+            await asyncio.sleep(min(self.retry_base_delay * (2 ** attempt), 30.0))
+
+        log.error("❌ Giving up on messages", messages=len(pending), attempts=self.max_retries + 1)
+        self.failed += len(pending)
+        await self._notify(pending, False)
+
+    async def _notify(self, items, success: bool):
+        for _, on_stored in items:
+            if on_stored:
+                try:
+                    await on_stored(success)
+                except Exception:
+                    log.exception("⚠️ Stored callback failed")
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self._buffer),
+            "in_flight": self._in_flight,
+            "written": self.written,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "batches": self.batches,
+        }
+
+
+message_writer = MessageWriter(
+    messages,
+    batch_size=Config.MESSAGE_FLUSH_BATCH_SIZE,
+    flush_interval=Config.MESSAGE_FLUSH_INTERVAL,
+    max_backlog=Config.MESSAGE_BACKLOG_MAX,
+    max_retries=Config.MESSAGE_FLUSH_MAX_RETRIES,
+    retry_base_delay=Config.MESSAGE_FLUSH_RETRY_DELAY,
+)
@@ -1,28 +1,31 @@
-from fastapi import APIRouter,Response,BackgroundTasks,HTTPException
+from fastapi import APIRouter,Response,HTTPException,Request
 from src.utils.auth import register_user, authenticate_user,send_otp,verify_login_otp,create_token
 from src.models.auth import UserRegister,UserLogin,OTPVerification,OTPRequest
 from src.config import Config
 authRouter = APIRouter() 
 
+def client_ip(request: Request):
+    return request.client.host if request.client else None
+
 @authRouter.post("/register")
-def register(data: UserRegister, background_tasks: BackgroundTasks):
-    return register_user(data, background_tasks)
+async def register(data: UserRegister):
+    return await register_user(data)
 
 @authRouter.post("/login")
-async def login(data: UserLogin, response: Response, background_tasks: BackgroundTasks):
+async def login(data: UserLogin, response: Response, request: Request):
     # Authenticate user credentials first
-    user_data = authenticate_user(data)
+    user_data = await authenticate_user(data)
     
     # At this point, credentials are valid but don't set cookie yet
     # Instead, send OTP for additional verification using existing utility
     
-    await send_otp(data.username, background_tasks)
+    sent = await send_otp(data.username, client_ip(request))
     
     # Return response indicating OTP is required
     return {
         "otp_required": True,
         "msg": "OTP sent to your registered email for verification",
-        "expires_in": "10 minutes"
+        "expires_in": sent["expires_in"]
     }
 
 
@@ -33,7 +36,7 @@ async def login(data: UserLogin, response: Response, background_tasks: Backgroun
 
 
 @authRouter.post("/send-otp")
-async def resend_otp(data: dict, background_tasks: BackgroundTasks):
+async def resend_otp(data: dict, request: Request):
     """
     Resend OTP for existing login attempt using existing utility
     """
@@ -43,12 +46,12 @@ async def resend_otp(data: dict, background_tasks: BackgroundTasks):
         raise HTTPException(status_code=400, detail="Username is required")
     
     # Use existing utility function to send OTP
-    result = await send_otp(username, background_tasks)
+    result = await send_otp(username, client_ip(request))
     
     return result
 
 @authRouter.post("/verify-otp")
-async def verify_otp_and_login(data: dict, response: Response):
+async def verify_otp_and_login(data: dict, response: Response, request: Request):
     """
     Verify OTP and complete login process using existing utility
     """
@@ -59,7 +62,7 @@ async def verify_otp_and_login(data: dict, response: Response):
         raise HTTPException(status_code=400, detail="Username and OTP are required")
     
     # Use existing utility function to verify OTP
-    verification_result = await verify_login_otp(username, otp)
+    verification_result = await verify_login_otp(username, otp, client_ip(request))
     
     # Extract token from verification result
     token = verification_result["token"]
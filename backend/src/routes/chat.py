@@ -1,227 +1,373 @@
 
-from fastapi import WebSocket, WebSocketDisconnect, APIRouter, Depends, HTTPException
+from fastapi import WebSocket, WebSocketDisconnect, APIRouter, Depends, HTTPException, Query
 from fastapi.websockets import WebSocketState
 from src.ws.connection_manager import manager
+from src.ws.offline import offline_queue
+from src.ws.heartbeat import heartbeat
+from src.ws.protocol import (
+    BINARY, BINARY_SUBPROTOCOL, JSON, TYPE_NAMES, Frame, FrameType, ProtocolError, Status,
+    decode, decode_message, encode_control, encode_status, negotiate, send_frame
+)
+from src.utils.metrics import ws_error_statuses, ws_frames_in, ws_frames_out
+from src.utils.log import get_logger
+from src.config import Config
 from src.utils.auth import get_current_user_ws, get_current_user
 from src.db.main import messages
+from src.db.recent import recent_messages
+from src.db import migrations
+from src.db.contacts import contact_ids
+from src.utils.pagination import encode_cursor, decode_cursor, keyset_filter
 from datetime import datetime
 from fastapi.responses import JSONResponse
-import traceback
-import asyncio
-import json
+from typing import Optional
 
 chatRouter = APIRouter()
+log = get_logger("chat")
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+
+# Only the fields the history response is built from
+HISTORY_PROJECTION = {
+    "sender_id": 1,
+    "receiver_id": 1,
+    "message_type": 1,
+    "timestamp": 1,
+    "ciphertext": 1,
+    "encrypted_message": 1,
+    "iv": 1,
+    "signature": 1,
+    "message": 1,
+    "relay_id": 1,
+    "frame": 1,
+    "protocol": 1,
+}
+
+async def send_status(websocket: WebSocket, protocol: str, code: Status, *args):
+    if code >= 100:
+        ws_error_statuses.labels(code.name.lower()).inc()
+    ws_frames_out.labels("status").inc()
+    await send_frame(websocket, encode_status(protocol, code, *args))
+
 @chatRouter.websocket("/ws/chat")
 async def chat_socket(websocket: WebSocket):    
+    user_id = None
+    session = None
     try:
+        # Binary clients offer our subprotocol; everyone else stays on JSON
+        protocol = negotiate(websocket.scope.get("subprotocols", []))
+
         # Accept the WebSocket connection first
-        await websocket.accept()
-        print("🔌 WebSocket connection accepted")
+        await websocket.accept(subprotocol=BINARY_SUBPROTOCOL if protocol == BINARY else None)
+        log.debug("🔌 WebSocket connection accepted", protocol=protocol)
         
         # Authenticate the user
         user = await get_current_user_ws(websocket)
         if not user:
-            await websocket.send_text("STATUS:❌ Unauthorized - Please log in")
+            await send_status(websocket, protocol, Status.UNAUTHORIZED)
             await websocket.close(code=1008, reason="Unauthorized")
             return
        
         user_id = str(user["_id"])
-        print(f"✅ User authenticated: {user_id}")
+        log.debug("✅ User authenticated", user_id=user_id)
 
         # Connect the user to the manager
-        await manager.connect(websocket, user_id)
+        # Their contacts decide whose presence they hear about
+        session = await manager.connect(websocket, user_id, protocol, await contact_ids(user_id))
         
         # Send initial status
-        await websocket.send_text("STATUS:✅ Connected successfully")
+        await send_status(websocket, protocol, Status.CONNECTED)
+
+        # Deliver anything that was queued while the user was offline
+        manager._spawn(offline_queue.drain(user_id, manager))
         
         # Main message handling loop
         try:
             while websocket.client_state == WebSocketState.CONNECTED:
                 try:
-                    # Set a timeout for receiving messages to allow for periodic cleanup
-                    data = await asyncio.wait_for(websocket.receive_json(), timeout=30.0)
-                    print(f"📨 Received data from {user_id}: {data}")
+                    # Pings and idle timeouts are the heartbeat scheduler's job
+                    message = await websocket.receive()
+                    if message["type"] == "websocket.disconnect":
+                        raise WebSocketDisconnect(message.get("code", 1000))
+                    session.touch()
 
-                    msg_type = data.get("type")
+                    frame = decode_message(message)
+                    ws_frames_in.labels(TYPE_NAMES.get(frame.type, "unknown")).inc()
+                    log.debug("📨 Frame received", user_id=user_id, protocol=frame.protocol, type=frame.type, sample=Config.LOG_SAMPLE_RATE)
                     
-                    if msg_type == "encrypted-message":
-                        await handle_encrypted_message(websocket, user_id, data)
+                    if frame.type == FrameType.ENCRYPTED_MESSAGE:
+                        await handle_encrypted_message(websocket, user_id, frame, protocol)
                         
-                    elif msg_type == "pair":
-                        await handle_pair_request(websocket, user_id, data)
+                    elif frame.type == FrameType.RELAY:
+                        await handle_relay(websocket, user_id, frame, protocol)
+
+                    elif frame.type == FrameType.PAIR:
+                        await handle_pair_request(websocket, user_id, frame, protocol)
                         
-                    elif msg_type == "ping":
+                    elif frame.type == FrameType.PRESENCE_SUBSCRIBE:
+                        manager.subscribe_presence(session)
+
+                    elif frame.type == FrameType.PRESENCE_UNSUBSCRIBE:
+                        manager.unsubscribe_presence(session)
+
+                    elif frame.type == FrameType.PING:
                         # Handle ping/pong for connection health
-                        await websocket.send_text(json.dumps({"type": "pong"}))
+                        ws_frames_out.labels("pong").inc()
+                        await send_frame(websocket, encode_control(protocol, FrameType.PONG))
+
+                    elif frame.type == FrameType.PONG:
+                        # Already counted as traffic above
+                        pass
                         
                     else:
-                        print(f"⚠️ Unknown message type: {msg_type}")
-                        await websocket.send_text("STATUS:❌ Unknown message type")
-
-                except asyncio.TimeoutError:
-                    # Send a ping to check if connection is still alive
-                    try:
-                        await websocket.send_text(json.dumps({"type": "ping"}))
-                    except Exception:
-                        # Connection is likely dead
-                        break
-                        
-                except json.JSONDecodeError as e:
-                    print(f"❌ Invalid JSON from {user_id}: {e}")
-                    await websocket.send_text("STATUS:❌ Invalid message format")
+                        log.warning("⚠️ Unknown message type", user_id=user_id, type=frame.get("type") or frame.type)
+                        await send_status(websocket, protocol, Status.UNKNOWN_TYPE)
+
+                except ProtocolError as e:
+                    log.warning("❌ Invalid frame", user_id=user_id, error=e)
+                    await send_status(websocket, protocol, Status.INVALID_FORMAT)
+
+                except WebSocketDisconnect:
+                    raise
                     
-                except Exception as e:
-                    print(f"❌ Error processing message from {user_id}: {e}")
-                    traceback.print_exc()
-                    await websocket.send_text(f"STATUS:❌ Message processing error")
+                except Exception:
+                    log.exception("❌ Error processing message", user_id=user_id)
+                    await send_status(websocket, protocol, Status.PROCESSING_ERROR)
 
         except WebSocketDisconnect:
-            print(f"🔌 WebSocket disconnect event for {user_id}")
+            log.debug("🔌 WebSocket disconnect event", user_id=user_id)
             
-        except Exception as e:
-            print(f"❌ Unexpected error in message loop for {user_id}: {e}")
-            traceback.print_exc()
+        except Exception:
+            log.exception("❌ Unexpected error in message loop", user_id=user_id)
             
         finally:
             # Ensure cleanup happens
             if user_id:
-                print(f"🧹 Cleaning up connection for {user_id}")
-                manager.disconnect(user_id)
+                log.debug("🧹 Cleaning up connection", user_id=user_id)
+                # Only this socket's session - a newer connection may have replaced it
+                manager.disconnect(user_id, session=session)
 
-    except Exception as e:
-        print(f"❌ Connection error during setup: {e}")
-        traceback.print_exc()
+    except Exception:
+        log.exception("❌ Connection error during setup")
         try:
             if websocket.client_state == WebSocketState.CONNECTED:
                 await websocket.close(code=1011, reason="Internal server error")
         except Exception:
             pass
         
-        if user_id:
-            manager.disconnect(user_id)
+        if session:
+            manager.disconnect(user_id, session=session)
 
-async def handle_encrypted_message(websocket: WebSocket, user_id: str, data: dict):
+async def handle_encrypted_message(websocket: WebSocket, user_id: str, frame: Frame, protocol: str):
     """Handle encrypted message sending"""
     try:
         # Validate required fields
         required_fields = ["ciphertext", "encryptedMessage", "iv", "from", "to"]
-        missing_fields = [field for field in required_fields if field not in data]
+        missing_fields = [field for field in required_fields if field not in frame.fields]
         
         if missing_fields:
-            await websocket.send_text(f"STATUS:❌ Missing fields: {', '.join(missing_fields)}")
+            await send_status(websocket, protocol, Status.MISSING_FIELDS, ", ".join(missing_fields))
             return
 
-        to_user_id = data.get("to")
-        from_user_id = data.get("from")
-        signature = data.get("signature")  # Extract signature
+        to_user_id = frame.get("to")
+        from_user_id = frame.get("from")
+        signature = frame.get("signature")  # Extract signature
         
         # Verify the sender matches the authenticated user
         if from_user_id != user_id:
-            await websocket.send_text("STATUS:❌ Sender ID mismatch")
+            await send_status(websocket, protocol, Status.SENDER_MISMATCH)
             return
 
         if not to_user_id:
-            await websocket.send_text("STATUS:❌ Missing recipient")
-            return
-
-        # Log signature presence for debugging
-        print(f"📝 Message has signature: {bool(signature)}")
-
-        # Check if recipient is online
-        if not manager.is_user_online(to_user_id):
-            await websocket.send_text(f"STATUS:❌ User {to_user_id} is not online")
+            await send_status(websocket, protocol, Status.MISSING_RECIPIENT)
             return
 
-        # Pair users for this conversation
-        manager.pair_users(user_id, to_user_id)
-        manager.pair_users(to_user_id, user_id)
+        # Pair users for this conversation; offline recipients get it on reconnect
+        if manager.is_user_online(to_user_id):
+            manager.pair_users(user_id, to_user_id)
+            manager.pair_users(to_user_id, user_id)
 
-        print(f"🔄 Attempting to send message from {user_id} to {to_user_id}")
+        log.debug("🔄 Handling encrypted message", sender_id=user_id, receiver_id=to_user_id, signed=bool(signature), sample=Config.LOG_SAMPLE_RATE)
 
-        # Send the encrypted message (signature is already included in data)
-        success = await manager.send_to_peer(user_id, data)
+        # Send the encrypted message (signature is already included in the frame)
+        success = await manager.send_to_peer(user_id, frame)
         
         if not success:
-            await websocket.send_text("STATUS:❌ Failed to deliver message")
+            await send_status(websocket, protocol, Status.DELIVERY_FAILED)
             
-    except Exception as e:
-        print(f"❌ Error handling encrypted message: {e}")
-        traceback.print_exc()
-        await websocket.send_text("STATUS:❌ Message handling error")
+    except Exception:
+        log.exception("❌ Error handling encrypted message", user_id=user_id)
+        await send_status(websocket, protocol, Status.HANDLING_ERROR)
+
+async def handle_relay(websocket: WebSocket, user_id: str, frame: Frame, protocol: str):
+    """Forward an opaque relay frame; only the routing header is looked at"""
+    try:
+        missing_fields = [field for field in ("from", "to") if not frame.get(field)]
+        if not frame.has_body():
+            missing_fields.append("body")
+        if missing_fields:
+            await send_status(websocket, protocol, Status.MISSING_FIELDS, ", ".join(missing_fields))
+            return
+
+        if frame.get("from") != user_id:
+            await send_status(websocket, protocol, Status.SENDER_MISMATCH)
+            return
+
+        to_user_id = frame.get("to")
+        if manager.is_user_online(to_user_id):
+            manager.pair_users(user_id, to_user_id)
+            manager.pair_users(to_user_id, user_id)
+
+        if not await manager.send_to_peer(user_id, frame):
+            await send_status(websocket, protocol, Status.DELIVERY_FAILED)
+
+    except Exception:
+        log.exception("❌ Error handling relay frame", user_id=user_id)
+        await send_status(websocket, protocol, Status.HANDLING_ERROR)
 
-async def handle_pair_request(websocket: WebSocket, user_id: str, data: dict):
+async def handle_pair_request(websocket: WebSocket, user_id: str, frame: Frame, protocol: str):
     """Handle explicit pairing requests"""
     try:
-        peer_id = data.get("to")
+        peer_id = frame.get("to")
         if not peer_id:
-            await websocket.send_text("STATUS:❌ Missing 'to' field in pair request")
+            await send_status(websocket, protocol, Status.PAIR_MISSING_PEER)
             return
             
         if not manager.is_user_online(peer_id):
-            await websocket.send_text(f"STATUS:❌ User {peer_id} is not online")
+            await send_status(websocket, protocol, Status.PEER_NOT_ONLINE, peer_id)
             return
             
         manager.pair_users(user_id, peer_id)
-        await websocket.send_text(f"STATUS:🔐 Paired with {peer_id}")
+        await send_status(websocket, protocol, Status.PAIRED, peer_id)
         
-    except Exception as e:
-        print(f"❌ Error handling pair request: {e}")
-        await websocket.send_text("STATUS:❌ Pairing error")
+    except Exception:
+        log.exception("❌ Error handling pair request", user_id=user_id)
+        await send_status(websocket, protocol, Status.PAIRING_ERROR)
 
-# NEW: Add endpoint to retrieve messages with signatures
+@chatRouter.get("/ws/queues")
+async def get_queue_stats(current_user = Depends(get_current_user)):
+    """Outbound queue stats: the caller's own connection plus totals for this worker"""
+    stats = manager.get_queue_stats()
+    return {
+        "connection": stats.get(str(current_user["_id"])),
+        "connections": len(stats),
+        "total_depth": sum(s["depth"] for s in stats.values()),
+        "congested": sum(1 for s in stats.values() if s["congested"]),
+        "dropped": sum(s["dropped"] for s in stats.values()),
+        "heartbeat": heartbeat.stats(),
+        "presence": manager.presence.stats(),
+        "recent_messages": recent_messages.stats(),
+    }
 
-@chatRouter.get("/messages/{peer_id}")
-async def get_messages_with_signatures(peer_id: str, current_user = Depends(get_current_user)):
-    """Retrieve messages between current user and peer, including signatures"""
-    try:
-        user_id = str(current_user["_id"])
-        
-        # Find all messages between the two users
+async def _read_history(user_id: str, peer_id: str, position, older: bool, limit: int) -> list:
+    """One page of the conversation from Mongo, oldest first"""
+    if migrations.is_complete(migrations.CONVERSATION_ID_BACKFILL):
+        message_filter = {"conversation_id": migrations.conversation_id(user_id, peer_id)}
+    else:
+        # Older messages may not carry conversation_id until the backfill finishes
         message_filter = {
             "$or": [
                 {"sender_id": user_id, "receiver_id": peer_id},
                 {"sender_id": peer_id, "receiver_id": user_id}
             ]
         }
+    page_filter = keyset_filter("timestamp", position, older)
+    if page_filter:
+        message_filter = {"$and": [message_filter, page_filter]}
+
+    direction = -1 if older else 1
+    cursor = messages.find(message_filter, HISTORY_PROJECTION).sort(
+        [("timestamp", direction), ("_id", direction)]
+    ).limit(limit)
+    page = await cursor.to_list(limit)
+    if older:
+        page.reverse()
+    return page
+
+def history_entry(msg: dict) -> dict:
+    """Response shape of one stored message"""
+    message_data = {
+        "_id": str(msg["_id"]),
+        "sender_id": msg["sender_id"],
+        "receiver_id": msg["receiver_id"],
+        "message_type": msg.get("message_type", "text"),
+        "timestamp": msg["timestamp"].isoformat(),  # Convert to ISO string
+    }
+    
+    # Include encrypted fields if present
+    if msg.get("ciphertext"):
+        message_data["ciphertext"] = msg["ciphertext"]
+    if msg.get("encrypted_message"):
+        message_data["encrypted_message"] = msg["encrypted_message"]
+    if msg.get("iv"):
+        message_data["iv"] = msg["iv"]
+    if msg.get("signature"):
+        message_data["signature"] = msg["signature"]
+    
+    # Relays were stored as the forwarded frame - hand back the body as base64
+    if msg.get("message_type") == "relay":
+        message_data["relay_id"] = msg.get("relay_id")
+        message_data["body"] = decode(msg.get("protocol", JSON), msg["frame"]).b64("body")
+
+    # Include plain message if present (for backward compatibility)
+    if msg.get("message"):
+        message_data["message"] = msg["message"]
+    return message_data
+
+# NEW: Add endpoint to retrieve messages with signatures
+
+@chatRouter.get("/messages/{peer_id}")
+async def get_messages_with_signatures(
+    peer_id: str,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    current_user = Depends(get_current_user)
+):
+    """Retrieve one page of messages between current user and peer, including signatures.
+
+    Without a cursor this is the newest page. next_cursor continues in the
+    direction the page was read: after a newest or `before` page pass it back
+    as `before` to scroll into older history; after an `after` page pass it
+    back as `after` to keep fetching what is newer. Messages within a page are
+    always oldest first.
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either 'before' or 'after', not both")
+
+    # Walk backwards from the newest message unless asked for what comes after a cursor
+    older = after is None
+    position = decode_cursor(after or before) if (after or before) else None
+
+    try:
+        user_id = str(current_user["_id"])
         
-        # Retrieve messages sorted by timestamp
-        cursor = messages.find(message_filter).sort("timestamp", 1)
-        message_list = []
-        
-        for msg in cursor:
-            message_data = {
-                "_id": str(msg["_id"]),
-                "sender_id": msg["sender_id"],
-                "receiver_id": msg["receiver_id"],
-                "message_type": msg.get("message_type", "text"),
-                "timestamp": msg["timestamp"].isoformat(),  # Convert to ISO string
-            }
-            
-            # Include encrypted fields if present
-            if msg.get("ciphertext"):
-                message_data["ciphertext"] = msg["ciphertext"]
-            if msg.get("encrypted_message"):
-                message_data["encrypted_message"] = msg["encrypted_message"]
-            if msg.get("iv"):
-                message_data["iv"] = msg["iv"]
-            if msg.get("signature"):
-                message_data["signature"] = msg["signature"]
-                print(f"📤 Including signature for message {msg['_id']}")
-            
-            # Include plain message if present (for backward compatibility)
-            if msg.get("message"):
-                message_data["message"] = msg["message"]
-                
-            message_list.append(message_data)
+        conversation = migrations.conversation_id(user_id, peer_id)
+
+        # The newest page of a recently active chat is usually already in memory
+        page = recent_messages.newest(conversation, limit) if position is None else None
+        if page is None:
+            page = await _read_history(user_id, peer_id, position, older, limit)
+            if position is None:
+                recent_messages.fill(conversation, page, complete=len(page) < limit)
+
+        next_cursor = None
+        if len(page) == limit:
+            # Pages are oldest first - the cursor continues from the far end
+            last = page[0] if older else page[-1]
+            next_cursor = encode_cursor(last["timestamp"], last["_id"])
+
+        message_list = [history_entry(msg) for msg in page]
         
-        print(f"📜 Retrieved {len(message_list)} messages for {user_id} <-> {peer_id}")
-        print(f"📝 Messages with signatures: {sum(1 for msg in message_list if msg.get('signature'))}")
+        log.debug("📜 Retrieved messages", user_id=user_id, peer_id=peer_id, count=len(message_list))
         
-        return message_list
+        return {
+            "messages": message_list,
+            "next_cursor": next_cursor
+        }
         
-    except Exception as e:
-        print(f"❌ Error retrieving messages: {e}")
-        traceback.print_exc()
+    except Exception:
+        log.exception("❌ Error retrieving messages", user_id=user_id, peer_id=peer_id)
         raise HTTPException(status_code=500, detail="Failed to retrieve messages")
                             
 
@@ -296,29 +442,29 @@ async def test_websocket(websocket: WebSocket):
     Use this to test if basic WebSocket functionality works
     """
     try:
-        print("🧪 Test WebSocket: Accepting connection...")
+        log.debug("🧪 Test WebSocket: Accepting connection")
         await websocket.accept()
-        print("🧪 Test WebSocket: Connection accepted!")
+        log.debug("🧪 Test WebSocket: Connection accepted")
         
         await websocket.send_text("STATUS:✅ Test connection successful!")
         
         while True:
             try:
                 data = await websocket.receive_text()
-                print(f"🧪 Test WebSocket received: {data}")
+                log.debug("🧪 Test WebSocket received", body=data)
                 
                 # Echo the message back
                 await websocket.send_text(f"Echo: {data}")
                 
             except WebSocketDisconnect:
-                print("🧪 Test WebSocket: Client disconnected")
+                log.debug("🧪 Test WebSocket: Client disconnected")
                 break
             except Exception as e:
-                print(f"🧪 Test WebSocket error: {e}")
+                log.warning("🧪 Test WebSocket error", error=e)
                 break
                 
     except Exception as e:
-        print(f"🧪 Test WebSocket setup error: {e}")
+        log.warning("🧪 Test WebSocket setup error", error=e)
         try:
             await websocket.close(code=1011, reason=str(e))
         except:
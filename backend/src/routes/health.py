@@ -0,0 +1,22 @@
+from fastapi import APIRouter, Depends
+from src.db.indexes import schema_report
+from src.db import migrations
+from src.utils.loop_monitor import loop_monitor
+from src.utils.auth import get_current_user
+from src.config import Config
+
+healthRouter = APIRouter()
+
+@healthRouter.get("/schema")
+async def get_schema_status():
+    """Index build status and applied data migrations"""
+    report = schema_report()
+    report["migrations"] = dict(migrations.completed)
+    return report
+
+if Config.LOOP_MONITOR_ENABLED:
+    # Stacks show source lines and paths - signed-in users only, and only when switched on
+    @healthRouter.get("/loop")
+    async def get_loop_status(current_user = Depends(get_current_user)):
+        """Event-loop lag and every call site caught blocking it"""
+        return loop_monitor.report()
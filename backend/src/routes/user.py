@@ -1,32 +1,38 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response
 from src.utils.auth import get_current_user
+from src.utils.pagination import decode_cursor
 from bson import ObjectId
-from typing import Dict
+from typing import Dict, Optional
 from src.db.main import users
+from src.db.contacts import add_connection, contact_ids, contact_page, last_messages
+from src.db.keys import key_directory, etag
 from src.ws.connection_manager import manager
-import base64
+from src.config import Config
 userRouter = APIRouter()
 
 @userRouter.get("/me")
-def me(user=Depends(get_current_user)):
+async def me(user=Depends(get_current_user)):
     user["_id"] = str(user["_id"])
     return user
 
 @userRouter.post("/connect")
-def connect_with_invite_code(data: dict, current_user=Depends(get_current_user)):
+async def connect_with_invite_code(data: dict, current_user=Depends(get_current_user)):
     invite_code = data.get("invite_code")
     if not invite_code:
         raise HTTPException(status_code=400, detail="Invite code is required")
 
-    target_user = users.find_one({"invite_code": invite_code}, {"username": 1})
+    target_user = await users.find_one({"invite_code": invite_code}, {"username": 1})
     if not target_user:
         raise HTTPException(status_code=404, detail="No user found with this invite code")
 
     if target_user["_id"] == current_user["_id"]:
         raise HTTPException(status_code=400, detail="You cannot connect to yourself")
 
-    users.update_one({"_id": current_user["_id"]}, {"$addToSet": {"connected_users": str(target_user["_id"])}})
-    users.update_one({"_id": target_user["_id"]}, {"$addToSet": {"connected_users": str(current_user["_id"])}})
+    await add_connection(current_user, target_user)
+    # Live sessions start following each other's presence right away
+    manager.add_contact(str(current_user["_id"]), str(target_user["_id"]))
+    manager.add_contact(str(target_user["_id"]), str(current_user["_id"]))
 
     return {
         "msg": "Connected successfully",
@@ -34,45 +40,74 @@ def connect_with_invite_code(data: dict, current_user=Depends(get_current_user))
     }
 
 @userRouter.get("/connections")
-def get_connections(current_user=Depends(get_current_user)):
-    ids = current_user.get("connected_users", [])
-    users_list = list(users.find({"_id": {"$in": [ObjectId(uid) for uid in ids]}}))
-    return [{"username": u["username"], "user_id": str(u["_id"])} for u in users_list]
+async def get_connections(
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    include: str = Query("", description="Comma separated extras: presence, last_message"),
+    current_user=Depends(get_current_user)
+):
+    """One page of connections, optionally with presence and each conversation's latest message"""
+    user_id = str(current_user["_id"])
+    extras = {part.strip() for part in include.split(",") if part.strip()}
+    position = decode_cursor(cursor) if cursor else None
+
+    page, next_cursor = await contact_page(user_id, position, limit)
+
+    if "presence" in extras:
+        online = manager.presence_of(contact["user_id"] for contact in page)
+        for contact in page:
+            contact["online"] = online[contact["user_id"]]
+    if "last_message" in extras:
+        latest = await last_messages(user_id, [contact["user_id"] for contact in page])
+        for contact in page:
+            contact["last_message"] = latest.get(contact["user_id"])
+
+    return {"connections": page, "next_cursor": next_cursor}
+
+@userRouter.get("/presence")
+async def get_presence(current_user=Depends(get_current_user)):
+    """Online state of every connection in one call"""
+    return manager.presence_of(await contact_ids(str(current_user["_id"])))
+
+def _cached_keys(request: Request, body: dict, tag: str) -> Response:
+    """Key response with a strong ETag, or a bare 304 if the client already has it"""
+    headers = {
+        "ETag": tag,
+        # Private: the response depends on the caller's session cookie
+        "Cache-Control": f"private, max-age={Config.KEY_HTTP_MAX_AGE}",
+    }
+    presented = request.headers.get("if-none-match", "")
+    if any(candidate.strip() in (tag, "*") for candidate in presented.split(",")):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(body, headers=headers)
+
+@userRouter.get("/keys")
+async def get_keys_batch(
+    request: Request,
+    user_ids: str = Query(..., description="Comma separated user ids"),
+    current_user=Depends(get_current_user)
+):
+    """Public keys of many users in one query, e.g. a whole contact list"""
+    ids = list(dict.fromkeys(uid.strip() for uid in user_ids.split(",") if uid.strip()))
+    if not ids:
+        raise HTTPException(status_code=400, detail="user_ids is required")
+    if len(ids) > Config.KEY_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {Config.KEY_BATCH_MAX} user ids per request")
+
+    records = await key_directory.get_many(ids)
+    body = {
+        "keys": {uid: record for uid, record in records.items() if record is not None},
+        "missing": [uid for uid, record in records.items() if record is None],
+    }
+    return _cached_keys(request, body, etag(records))
 
 @userRouter.get("/keys/{user_id}")
-async def get_keys(user_id: str):
-    try:
-        # Validate ObjectId
-        if not ObjectId.is_valid(user_id):
-            raise HTTPException(status_code=400, detail="Invalid user_id")
-
-        # Fetch only the needed fields (async if Motor)
-        user =  users.find_one(
-            {"_id": ObjectId(user_id)},
-            {"_id": 0, "kyber_public_key": 1, "dilithium_public_key": 1}
-        )
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-
-        # Decode hex strings to bytes
-        try:
-            kyber_bytes = bytes.fromhex(user["kyber_public_key"])
-            dilithium_bytes = bytes.fromhex(user["dilithium_public_key"])
-        except Exception as e:
-            raise HTTPException(status_code=500, detail="Invalid key format stored")
-
-        # Encode bytes to base64 for frontend transmission
-        kyber_b64 = base64.b64encode(kyber_bytes).decode("utf-8")
-        dilithium_b64 = base64.b64encode(dilithium_bytes).decode("utf-8")
-
-        return {
-            "kyber_public_key": kyber_b64,
-            "dilithium_public_key": dilithium_b64,
-        }
-
-    except HTTPException:
-        # Re-raise known HTTP errors
-        raise
-    except Exception as e:
-        # Unexpected errors
-        raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
\ No newline at end of file
+async def get_keys(user_id: str, request: Request, current_user=Depends(get_current_user)):
+    if not ObjectId.is_valid(user_id):
+        raise HTTPException(status_code=400, detail="Invalid user_id")
+
+    record = await key_directory.get(user_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    return _cached_keys(request, dict(record), etag({user_id: record}))
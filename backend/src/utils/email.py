@@ -1,9 +1,15 @@
-from typing import List
-from fastapi import BackgroundTasks, FastAPI
-from fastapi_mail import ConnectionConfig, FastMail, MessageSchema, MessageType
+import asyncio
+from email.message import EmailMessage
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+import aiosmtplib
+from fastapi_mail import ConnectionConfig
 from pydantic import BaseModel, EmailStr
-from starlette.responses import JSONResponse
 from src.config import Config
+from src.utils.metrics import emails
+from src.utils.log import get_logger
+
+log = get_logger("mail")
 
 
 class EmailSchema(BaseModel):
@@ -16,25 +22,227 @@ conf = ConnectionConfig(
     MAIL_FROM="keshav.lath11@gmail.com",
     MAIL_PORT=587,
     MAIL_SERVER="smtp-relay.brevo.com",
-    MAIL_STARTTLS=True,  
-    MAIL_SSL_TLS=False,   
-    USE_CREDENTIALS=True, 
+    MAIL_STARTTLS=True,
+    MAIL_SSL_TLS=False,
+    USE_CREDENTIALS=True,
     VALIDATE_CERTS=True
 )
 
 
-def welcome_email(
-    recipient: list,
-    html: str,
-    subject: str,
-    background_tasks: BackgroundTasks
-):
-    message = MessageSchema(
-        subject=subject,
-        recipients=recipient,
-        body=html,
-        subtype=MessageType.html
+def is_permanent_failure(error: Exception) -> bool:
+    """5xx replies, including every recipient of a mail being refused with one"""
+    if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+        return bool(error.recipients) and all(refused.code >= 500 for refused in error.recipients)
+    return isinstance(error, aiosmtplib.SMTPResponseException) and error.code >= 500
+
+
+class Outbox:
+    """In-memory mail queue drained by workers that each keep a warm SMTP session.
+
+    enqueue() never touches the network. Every worker owns one SMTP connection
+    and sends up to batch_size queued mails over it per round, reconnecting
+    only when the server has dropped it. Failed mails are retried with
+    backoff, so a flaky relay doesn't cost the user their OTP.
+    """
+
+    def __init__(
+        self,
+        hostname: str,
+        port: int,
+        sender: str,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        use_tls: bool = False,
+        start_tls: bool = False,
+        validate_certs: bool = True,
+        concurrency: int = 2,
+        batch_size: int = 20,
+        max_queue: int = 1000,
+        max_retries: int = 3,
+        retry_base_delay: float = 1.0,
+    ):
+        self.hostname = hostname
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.start_tls = start_tls
+        self.validate_certs = validate_certs
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._workers: List[asyncio.Task] = []
+        # Mails waiting out their backoff, by timer, so stop() can flush them
+        self._retries: Dict[asyncio.TimerHandle, Tuple[EmailMessage, int]] = {}
+        self._stopping = False
+
+        # Stats
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.rejected = 0
+
+    def start(self):
+        if not self._workers:
+            self._stopping = False
+            self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.concurrency)]
+
+    async def stop(self, timeout: float = 10.0):
+        """Give queued mail a chance to go out, then close the sessions.
+
+        Mails waiting to be retried are sent along with the rest instead of
+        after their backoff; one that fails again while stopping is given up on.
+        """
+        if not self._workers:
+            return
+        self._stopping = True
+        retries, self._retries = self._retries, {}
+        for handle, (message, attempt) in retries.items():
+            handle.cancel()
+            self._requeue(message, attempt)
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            log.warning("⚠️ Outbox stopped with mails unsent", unsent=self._queue.qsize())
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def enqueue(self, recipients: List[str], subject: str, html: str) -> bool:
+        """Queue an HTML mail; False if the outbox is full"""
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = ", ".join(recipients)
+        message["Subject"] = subject
+        message.set_content(html, subtype="html")
+        try:
+            self._queue.put_nowait((message, 0))
+            return True
+        except asyncio.QueueFull:
+            self.rejected += 1
+            emails.labels("rejected").inc()
+            log.error("❌ Outbox full, dropping mail", to=recipients)
+            return False
+
+    def _client(self) -> aiosmtplib.SMTP:
+        return aiosmtplib.SMTP(
+            hostname=self.hostname,
+            port=self.port,
+            use_tls=self.use_tls,
+            start_tls=self.start_tls,
+            validate_certs=self.validate_certs,
+        )
+
+    async def _ensure_connected(self, smtp: aiosmtplib.SMTP):
+        if smtp.is_connected:
+            return
+        await smtp.connect()
+        if self.username:
+            await smtp.login(self.username, self.password)
+
+    async def _worker(self, number: int):
+        smtp = self._client()
+        try:
+            while True:
+                batch = [await self._queue.get()]
+                while len(batch) < self.batch_size and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+
+                for message, attempt in batch:
+                    try:
+                        await self._ensure_connected(smtp)
+                        await smtp.send_message(message)
+                        self.sent += 1
+                        emails.labels("sent").inc()
+                    except (aiosmtplib.SMTPException, OSError) as e:
+                        log.warning("⚠️ Mail worker failed to send", worker=number, to=message["To"], error=e)
+                        if is_permanent_failure(e):
+                            # Bad mailbox, policy rejection - retrying won't change the answer
+                            self._give_up(message, attempt)
+                            continue
+                        if not isinstance(e, aiosmtplib.SMTPResponseException):
+                            # Connection-level trouble - start over with a fresh session
+                            smtp.close()
+                            smtp = self._client()
+                        self._retry(message, attempt)
+                    finally:
+                        self._queue.task_done()
+        finally:
+            if smtp.is_connected:
+                try:
+                    await smtp.quit()
+                except Exception:
+                    smtp.close()
+
+    def _give_up(self, message: EmailMessage, attempt: int):
+        self.failed += 1
+        emails.labels("failed").inc()
+        log.error("❌ Giving up on mail", to=message["To"], attempts=attempt + 1)
+
+    def _retry(self, message: EmailMessage, attempt: int):
+        if attempt >= self.max_retries or self._stopping:
+            self._give_up(message, attempt)
+            return
+        self.retried += 1
+        emails.labels("retried").inc()
+        delay = self.retry_base_delay * (2 ** attempt)
+
+        def due():
+            self._retries.pop(handle, None)
+            self._requeue(message, attempt + 1)
+
+        handle = asyncio.get_running_loop().call_later(delay, due)
+        self._retries[handle] = (message, attempt + 1)
+
+    def _requeue(self, message: EmailMessage, attempt: int):
+        try:
+            self._queue.put_nowait((message, attempt))
+        except asyncio.QueueFull:
+            self._give_up(message, attempt)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "retrying": len(self._retries),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "rejected": self.rejected,
+        }
+
+
+def create_outbox() -> Outbox:
+    options = {
+        "concurrency": Config.MAIL_CONCURRENCY,
+        "batch_size": Config.MAIL_BATCH_SIZE,
+        "max_queue": Config.MAIL_QUEUE_MAX,
+        "max_retries": Config.MAIL_MAX_RETRIES,
+    }
+    if Config.MAIL_SMTP_URL:
+        # Plain local relay, e.g. smtp://localhost:1025 for a development stand-in
+        url = urlparse(Config.MAIL_SMTP_URL)
+        return Outbox(url.hostname, url.port or 25, conf.MAIL_FROM, url.username, url.password, **options)
+
+    return Outbox(
+        conf.MAIL_SERVER,
+        conf.MAIL_PORT,
+        conf.MAIL_FROM,
+        conf.MAIL_USERNAME if conf.USE_CREDENTIALS else None,
+        conf.MAIL_PASSWORD.get_secret_value() if conf.USE_CREDENTIALS else None,
+        use_tls=conf.MAIL_SSL_TLS,
+        start_tls=conf.MAIL_STARTTLS,
+        validate_certs=conf.VALIDATE_CERTS,
+        **options
     )
-    fm = FastMail(conf)
-    background_tasks.add_task(fm.send_message, message)
-    # return JSONResponse(status_code=200, content={"message": "Email has been sent"})
+
+
+outbox = create_outbox()
+
+
+def send_email(recipient: list, html: str, subject: str) -> bool:
+    return outbox.enqueue(recipient, subject, html)
@@ -0,0 +1,214 @@
+from html import escape
+from string import Template
+
+
+class CompiledTemplate:
+    """A $placeholder template split into literal chunks once, at import time.
+
+    render() is a single join instead of re-scanning the whole document per
+    mail. Values are HTML-escaped.
+    """
+
+    def __init__(self, source: str):
+        self.parts = []
+        self.fields = set()
+        pos = 0
+        for match in Template.pattern.finditer(source):
+            self.parts.append(source[pos:match.start()])
+            name = match.group("named") or match.group("braced")
+            if name is None:
+                # "$$" or a stray "$" - keep it literally
+                self.parts.append(match.group(0))
+            else:
+                self.parts.append((name,))
+                self.fields.add(name)
+            pos = match.end()
+        self.parts.append(source[pos:])
+
+    def render(self, **values) -> str:
+        missing = self.fields - values.keys()
+        if missing:
+            raise KeyError(f"Missing template values: {', '.join(sorted(missing))}")
+        return "".join(
+            part if isinstance(part, str) else escape(str(values[part[0]]))
+            for part in self.parts
+        )
+
+
+WELCOME_SUBJECT = "Welcome to Our Secure Platform - Account Created Successfully"
+
+WELCOME_TEMPLATE = CompiledTemplate("""
+    <!DOCTYPE html>
+<html lang="en">
+<head>
+  <meta charset="UTF-8">
+  <title>Welcome to Our Secure Platform</title>
+  <style>
+    body {
+      font-family: Arial, sans-serif;
+      background-color: #f4f4f4;
+      margin: 0;
+      padding: 0;
+    }
+    .container {
+      background-color: #ffffff;
+      margin: 50px auto;
+      padding: 30px;
+      max-width: 600px;
+      border-radius: 8px;
+      box-shadow: 0 0 10px rgba(0, 0, 0, 0.1);
+    }
+    h1 {
+      color: #333333;
+    }
+    p {
+      color: #555555;
+      line-height: 1.6;
+    }
+    .invite-code {
+      background-color: #f8f9fa;
+      border: 2px dashed #007bff;
+      padding: 15px;
+      text-align: center;
+      margin: 20px 0;
+      border-radius: 5px;
+    }
+    .code {
+      font-family: 'Courier New', monospace;
+      font-size: 18px;
+      font-weight: bold;
+      color: #007bff;
+    }
+    .button {
+      display: inline-block;
+      padding: 10px 20px;
+      margin-top: 20px;
+      background-color: #4CAF50;
+      color: #ffffff;
+      text-decoration: none;
+      border-radius: 5px;
+    }
+    .footer {
+      margin-top: 30px;
+      font-size: 12px;
+      color: #aaaaaa;
+    }
+  </style>
+</head>
+<body>
+  <div class="container">
+    <h1>Welcome to Our Secure Platform!</h1>
+    <p>Hi $username,</p>
+    <p>Thank you for registering with our quantum-secure platform. We're excited to have you on board!</p>
+    <p>Your account has been successfully created with post-quantum cryptographic protection.</p>
+    
+    <div class="invite-code">
+      <p><strong>Your Invite Code:</strong></p>
+      <p class="code">$invite_code</p>
+      <p><small>Share this code with friends to invite them to the platform</small></p>
+    </div>
+    
+    <p>Your account is now active and ready to use. You can start exploring our secure features immediately.</p>
+    <p>If you have any questions or need assistance, feel free to reply to this email.</p>
+    
+    <div class="footer">
+      &copy; 2025 Secure Platform. All rights reserved.
+    </div>
+  </div>
+</body>
+</html>
+""")
+
+
+OTP_SUBJECT = "Login Verification - Your OTP Code"
+
+OTP_TEMPLATE = CompiledTemplate("""
+    <!DOCTYPE html>
+<html lang="en">
+<head>
+  <meta charset="UTF-8">
+  <title>Login Verification - OTP</title>
+  <style>
+    body {
+      font-family: Arial, sans-serif;
+      background-color: #f4f4f4;
+      margin: 0;
+      padding: 0;
+    }
+    .container {
+      background-color: #ffffff;
+      margin: 50px auto;
+      padding: 30px;
+      max-width: 600px;
+      border-radius: 8px;
+      box-shadow: 0 0 10px rgba(0, 0, 0, 0.1);
+    }
+    h1 {
+      color: #333333;
+      text-align: center;
+    }
+    p {
+      color: #555555;
+      line-height: 1.6;
+    }
+    .otp-box {
+      background-color: #f8f9fa;
+      border: 2px solid #007bff;
+      padding: 20px;
+      text-align: center;
+      margin: 25px 0;
+      border-radius: 8px;
+    }
+    .otp-code {
+      font-family: 'Courier New', monospace;
+      font-size: 32px;
+      font-weight: bold;
+      color: #007bff;
+      letter-spacing: 5px;
+      margin: 10px 0;
+    }
+    .warning {
+      background-color: #fff3cd;
+      border: 1px solid #ffeaa7;
+      color: #856404;
+      padding: 15px;
+      border-radius: 5px;
+      margin: 20px 0;
+    }
+    .footer {
+      margin-top: 30px;
+      font-size: 12px;
+      color: #aaaaaa;
+      text-align: center;
+    }
+  </style>
+</head>
+<body>
+  <div class="container">
+    <h1>🔐 Login Verification</h1>
+    <p>Hello <strong>$username</strong>,</p>
+    <p>We received a login attempt for your secure account. To complete the login process, please use the OTP below:</p>
+    
+    <div class="otp-box">
+      <p><strong>Your OTP Code:</strong></p>
+      <div class="otp-code">$otp</div>
+      <p><small>This code is valid for $expires_in</small></p>
+    </div>
+    
+    <div class="warning">
+      <strong>⚠️ Security Notice:</strong><br>
+      If you didn't attempt to log in, please ignore this email and consider changing your password.
+      Never share this OTP with anyone.
+    </div>
+    
+    <p>This OTP will expire in $expires_in for your security.</p>
+    <p>If you have any concerns about your account security, please contact our support team immediately.</p>
+    
+    <div class="footer">
+      &copy; 2025 Secure Platform. All rights reserved.<br>
+      This is an automated message, please do not reply.
+    </div>
+  </div>
+</body>
+</html>
+""")
@@ -0,0 +1,210 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+from src.config import Config
+from src.utils.metrics import Counter
+
+# Structured logging for the request and socket paths.
+#
+#   log = get_logger("ws")
+#   log.debug("📨 Frame received", user_id=user_id, type=frame.type, sample=Config.LOG_SAMPLE_RATE)
+#
+# Messages are constant strings and everything variable goes in fields, so a
+# disabled level costs one cached isEnabledFor() check and nothing is formatted.
+# Enabled records go onto a bounded queue; a listener thread redacts, truncates,
+# formats and writes them, so log I/O never runs on the event loop. When the
+# queue is full records are dropped and counted rather than blocking the loop.
+
+# Never written out, whatever level: secrets and message bodies
+REDACTED_FIELDS = frozenset({
+    "token", "access_token", "password", "otp",
+    "ciphertext", "encryptedMessage", "encrypted_message", "iv", "signature", "frame", "body",
+})
+
+log_dropped = Counter("qchat_log_dropped_total", "Log records dropped because the log queue was full")
+
+
+def _redact(value) -> str:
+    if isinstance(value, (str, bytes, bytearray)):
+        return f"<redacted {len(value)} bytes>"
+    return "<redacted>"
+
+
+def _truncate(value, limit: int):
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    text = value if isinstance(value, str) else str(value)
+    if len(text) > limit:
+        return f"{text[:limit]}…(+{len(text) - limit})"
+    return text
+
+
+def render_fields(fields: dict, limit: int) -> dict:
+    """Field values as they are written: secrets redacted, long values cut to limit"""
+    return {
+        key: _redact(value) if key in REDACTED_FIELDS else _truncate(value, limit)
+        for key, value in fields.items()
+    }
+
+
+class TextFormatter(logging.Formatter):
+    """2024-01-01T00:00:00.000Z INFO ws 🔗 User connected user_id=... active=3"""
+
+    def __init__(self, field_limit: int):
+        super().__init__()
+        self.field_limit = field_limit
+
+    def format(self, record: logging.LogRecord) -> str:
+        stamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+        line = f"{stamp}.{int(record.msecs):03d}Z {record.levelname} {record.name} {record.getMessage()}"
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in render_fields(fields, self.field_limit).items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class JsonFormatter(TextFormatter):
+    """One JSON object per line for log shippers"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(render_fields(fields, self.field_limit))
+        sample = getattr(record, "sample", 1.0)
+        if sample < 1.0:
+            entry["sample_rate"] = sample
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class StdoutHandler(logging.StreamHandler):
+    """Writes to whatever sys.stdout is when the record is emitted, like print() did"""
+
+    def __init__(self):
+        super().__init__(sys.stdout)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Hands records to the listener as they are.
+
+    The stock QueueHandler formats the message on the calling thread; here the
+    formatting is the listener's job, which is the point of having one.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_dropped.inc()
+
+
+class DrainingQueueListener(QueueListener):
+    """Stopping waits for room rather than failing when the queue is full"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class StructuredLogger:
+    """Thin wrapper over a stdlib logger taking a message plus keyword fields"""
+
+    def __init__(self, logger: logging.Logger):
+        self._logger = logger
+
+    def enabled(self, level: int) -> bool:
+        """Guard for call sites whose fields are themselves expensive to compute"""
+        return self._logger.isEnabledFor(level)
+
+    def _log(self, level: int, message: str, fields: dict):
+        if not self._logger.isEnabledFor(level):
+            return
+        sample = fields.pop("sample", 1.0)
+        if sample < 1.0 and random.random() >= sample:
+            return
+        exc_info = fields.pop("exc_info", None)
+        self._logger.log(level, message, exc_info=exc_info, extra={"fields": fields, "sample": sample})
+
+    def debug(self, message: str, **fields):
+        self._log(logging.DEBUG, message, fields)
+
+    def info(self, message: str, **fields):
+        self._log(logging.INFO, message, fields)
+
+    def warning(self, message: str, **fields):
+        self._log(logging.WARNING, message, fields)
+
+    def error(self, message: str, **fields):
+        self._log(logging.ERROR, message, fields)
+
+    def exception(self, message: str, **fields):
+        """error() with the current exception's traceback"""
+        fields["exc_info"] = True
+        self._log(logging.ERROR, message, fields)
+
+
+ROOT = "qchat"
+_listener: Optional[DrainingQueueListener] = None
+
+
+def get_logger(name: str) -> StructuredLogger:
+    return StructuredLogger(logging.getLogger(f"{ROOT}.{name}"))
+
+
+def configure_logging(
+    level: str = Config.LOG_LEVEL,
+    fmt: str = Config.LOG_FORMAT,
+    field_limit: int = Config.LOG_FIELD_MAX_LENGTH,
+    queue_size: int = Config.LOG_QUEUE_MAX
+):
+    """Route the app's loggers through the queue and start the writer thread. Idempotent."""
+    global _listener
+    if _listener is not None:
+        return
+
+    handler = StdoutHandler()
+    handler.setFormatter(JsonFormatter(field_limit) if fmt == "json" else TextFormatter(field_limit))
+
+    records = queue.Queue(maxsize=queue_size)
+    root = logging.getLogger(ROOT)
+    root.setLevel(level.upper())
+    root.handlers = [DroppingQueueHandler(records)]
+    root.propagate = False
+
+    _listener = DrainingQueueListener(records, handler, respect_handler_level=False)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Write out whatever is still queued and stop the writer thread"""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
@@ -0,0 +1,223 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Deque, Dict, List, Optional
+from src.config import Config
+from src.utils.log import get_logger
+from src.utils.metrics import Counter, Gauge, Histogram
+
+log = get_logger("loop")
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAX_STACK_FRAMES = 40
+MAX_SITES = 500
+
+loop_lag_seconds = Histogram(
+    "qchat_event_loop_lag_seconds", "How late the loop monitor's timer fired",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+loop_lag_max = Gauge("qchat_event_loop_lag_max_seconds", "Worst loop lag since the monitor started")
+loop_blocked = Counter("qchat_event_loop_blocked_total", "Callbacks that held the loop past the threshold, by call site", ["site"])
+
+
+def _frame_site(filename: str, lineno: int, name: str) -> str:
+    """src/... for our own code, the full path for libraries"""
+    if filename.startswith(APP_ROOT):
+        filename = os.path.relpath(filename, os.path.dirname(APP_ROOT))
+    return f"{filename}:{lineno} {name}"
+
+
+class LoopMonitor:
+    """Opt-in event-loop lag monitor and blocking-call detector.
+
+    A timer task on the loop sleeps interval seconds and records how late it
+    woke up - that lateness is the loop lag every other callback saw too. A
+    watchdog thread checks the timer's progress every threshold/4 seconds;
+    once the timer is overdue by more than threshold, something is holding
+    the loop, and the watchdog captures the loop thread's stack right then,
+    while the offending code is still on it. When the timer finally runs it
+    files the capture with the measured stall, grouped by the innermost frame
+    in our own code (e.g. send_to_peer -> insert_one), so /health/loop lists
+    every call site that blocked and how often. The stall is measured from the
+    timer's deadline, so it can read up to interval short of the real block.
+    """
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.1, history: int = 100):
+        self.interval = interval
+        self.threshold = threshold
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+
+        # Written by the timer, read by the watchdog
+        self._tick = 0
+        self._due = 0.0
+        # Written by the watchdog, consumed by the timer
+        self._capture: Optional[dict] = None
+
+        # Stats
+        self.samples = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.blocked = 0
+        self.recent: Deque[dict] = deque(maxlen=history)
+        self.sites: Dict[str, dict] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._due = time.monotonic() + self.interval
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+        log.info("🩺 Loop monitor started", interval=self.interval, threshold=self.threshold)
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stopping.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1.0)
+            self._watchdog = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - self._due)
+            capture, self._capture = self._capture, None
+            # Re-arm before moving the tick on, so the watchdog never sees the
+            # new tick against the old deadline
+            self._due = now + self.interval
+            self._tick += 1
+            self._record_lag(lag)
+            if lag >= self.threshold:
+                self._record_block(lag, capture)
+
+    def _record_lag(self, lag: float):
+        self.samples += 1
+        self.last_lag = lag
+        loop_lag_seconds.observe(lag)
+        if lag > self.max_lag:
+            self.max_lag = lag
+            loop_lag_max.set(lag)
+
+    def _watch(self):
+        """Watchdog thread: snapshot the loop thread's stack while it is stuck"""
+        captured_tick = -1
+        while not self._stopping.wait(self.threshold / 4):
+            tick = self._tick
+            if tick == captured_tick:
+                continue
+            overdue = time.monotonic() - self._due
+            if overdue < self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            captured_tick = tick
+            self._capture = {
+                "tick": tick,
+                "task": self._current_task_name(),
+                "stack": traceback.extract_stack(frame, limit=MAX_STACK_FRAMES),
+            }
+            del frame
+
+    def _current_task_name(self) -> Optional[str]:
+        try:
+            task = asyncio.current_task(self._loop)
+        except Exception:
+            return None
+        if task is None:
+            return None
+        coro = task.get_coro()
+        return f"{task.get_name()} ({getattr(coro, '__qualname__', coro)})"
+
+    def _record_block(self, lag: float, capture: Optional[dict]):
+        self.blocked += 1
+        # A capture from an earlier stall that was only noticed late is stale
+        if capture is None or capture["tick"] != self._tick - 1:
+            site, stack, task = "unknown", [], None
+        else:
+            stack = capture["stack"]
+            task = capture["task"]
+            site = self._site(stack)
+
+        detection = {
+            "at": time.time(),
+            "blocked_seconds": lag,
+            "site": site,
+            "task": task,
+            "stack": [_frame_site(f.filename, f.lineno, f.name) + (f": {f.line}" if f.line else "") for f in stack],
+        }
+        self.recent.append(detection)
+
+        entry = self.sites.get(site)
+        if entry is None and len(self.sites) < MAX_SITES:
+            entry = self.sites[site] = {"site": site, "count": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+        if entry is not None:
+            entry["count"] += 1
+            entry["total_seconds"] += lag
+            if lag >= entry["max_seconds"]:
+                entry["max_seconds"] = lag
+                entry["task"] = task
+                entry["stack"] = detection["stack"]
+        # Past MAX_SITES new call sites share one label
+        loop_blocked.labels(site if entry is not None else "other").inc()
+
+        log.warning("🐢 Event loop blocked", seconds=round(lag, 3), site=site, task=task)
+
+    def _site(self, stack: List[traceback.FrameSummary]) -> str:
+        """Innermost frame in our code, skipping this module; else the innermost frame"""
+        for frame in reversed(stack):
+            if frame.filename.startswith(APP_ROOT) and frame.filename != __file__:
+                return _frame_site(frame.filename, frame.lineno, frame.name)
+        if stack:
+            frame = stack[-1]
+            return _frame_site(frame.filename, frame.lineno, frame.name)
+        return "unknown"
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "threshold": self.threshold,
+            "samples": self.samples,
+            "last_lag": self.last_lag,
+            "max_lag": self.max_lag,
+            "blocked": self.blocked,
+        }
+
+    def report(self) -> dict:
+        """Stats plus every blocking call site, worst total first, and the latest detections"""
+        return {
+            **self.stats(),
+            "sites": sorted(self.sites.values(), key=lambda entry: entry["total_seconds"], reverse=True),
+            "recent": list(reversed(self.recent)),
+        }
+
+
+loop_monitor = LoopMonitor(
+    interval=Config.LOOP_MONITOR_INTERVAL,
+    threshold=Config.LOOP_BLOCK_THRESHOLD,
+    history=Config.LOOP_BLOCK_HISTORY
+)
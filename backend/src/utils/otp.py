@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import hmac
+import math
+import secrets
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Set
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+from src.config import Config
+from src.db.main import otp_rate_limits, otps
+from src.utils.ratelimit import MongoRateLimiter, RateLimiter
+
+# verify() outcomes
+OTP_OK = "ok"
+OTP_MISSING = "missing"
+OTP_EXPIRED = "expired"
+OTP_INVALID = "invalid"
+OTP_LOCKED = "locked"
+
+
+def describe_ttl(seconds: int) -> str:
+    """600 -> "10 minutes", for the mail and the API response"""
+    for unit, size in (("hour", 3600), ("minute", 60)):
+        if seconds >= size and seconds % size == 0:
+            count = seconds // size
+            return f"{count} {unit}{'s' if count != 1 else ''}"
+    return f"{seconds} second{'s' if seconds != 1 else ''}"
+
+
+def _digest(username: str, otp: str) -> str:
+    # Never keep the code itself - only a keyed digest of it
+    return hmac.new(Config.SECRET_KEY.encode(), f"{username}:{otp}".encode(), hashlib.sha256).hexdigest()
+
+
+class MongoOTPStore:
+    """One OTP document per user in a TTL-indexed collection, off the users document"""
+
+    def __init__(self, collection, max_attempts: int):
+        self.collection = collection
+        self.max_attempts = max_attempts
+
+    async def put(self, username: str, digest: str, expires_at: datetime):
+        await self.collection.update_one(
+            {"_id": username},
+            {"$set": {"digest": digest, "expires_at": expires_at, "attempts": 0}},
+            upsert=True
+        )
+
+    async def check(self, username: str, digest: str) -> str:
+        record = await self.collection.find_one_and_update(
+            {"_id": username},
+            {"$inc": {"attempts": 1}},
+            return_document=ReturnDocument.AFTER
+        )
+        if not record:
+            return OTP_MISSING
+        # The TTL monitor only sweeps about once a minute
+        if record["expires_at"] <= datetime.now(timezone.utc):
+            await self.collection.delete_one({"_id": username})
+            return OTP_EXPIRED
+        if record["attempts"] > self.max_attempts:
+            await self.collection.delete_one({"_id": username})
+            return OTP_LOCKED
+        if not hmac.compare_digest(record["digest"], digest):
+            return OTP_INVALID
+
+        await self.collection.delete_one({"_id": username})
+        return OTP_OK
+
+
+class ExpiryWheel:
+    """Hashed timing wheel that reclaims expired in-memory OTPs in O(1) per tick"""
+
+    def __init__(self, slots: int, resolution: float, on_expire):
+        self.slots = [set() for _ in range(slots)]
+        self.resolution = resolution
+        self.on_expire = on_expire
+        self._cursor = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def schedule(self, key: str, delay: float):
+        ticks = min(len(self.slots) - 1, max(1, math.ceil(delay / self.resolution)))
+        self.slots[(self._cursor + ticks) % len(self.slots)].add(key)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.resolution)
+            self._cursor = (self._cursor + 1) % len(self.slots)
+            due: Set[str] = self.slots[self._cursor]
+            self.slots[self._cursor] = set()
+            for key in due:
+                self.on_expire(key)
+
+
+class MemoryOTPStore:
+    """Per-process OTP store; an expiry wheel drops codes as they expire"""
+
+    def __init__(self, max_attempts: int, ttl: int):
+        self.max_attempts = max_attempts
+        self.records: Dict[str, dict] = {}
+        self.wheel = ExpiryWheel(slots=ttl + 2, resolution=1.0, on_expire=self._expire)
+
+    def _expire(self, username: str):
+        record = self.records.get(username)
+        # A re-issued code is scheduled separately - only drop it once it is really due
+        if record and record["deadline"] <= time.monotonic():
+            self.records.pop(username, None)
+
+    async def put(self, username: str, digest: str, expires_at: datetime):
+        ttl = (expires_at - datetime.now(timezone.utc)).total_seconds()
+        self.records[username] = {"digest": digest, "deadline": time.monotonic() + ttl, "attempts": 0}
+        self.wheel.schedule(username, ttl)
+
+    async def check(self, username: str, digest: str) -> str:
+        record = self.records.get(username)
+        if not record:
+            return OTP_MISSING
+        record["attempts"] += 1
+        if record["deadline"] <= time.monotonic():
+            self.records.pop(username, None)
+            return OTP_EXPIRED
+        if record["attempts"] > self.max_attempts:
+            self.records.pop(username, None)
+            return OTP_LOCKED
+        if not hmac.compare_digest(record["digest"], digest):
+            return OTP_INVALID
+
+        self.records.pop(username, None)
+        return OTP_OK
+
+
+class OTPEngine:
+    """Issues and verifies login OTPs with per-user and per-IP rate limits"""
+
+    def __init__(self, store, ttl: int, window: int):
+        self.store = store
+        self.ttl = ttl
+        self.expires_in = describe_ttl(ttl)
+        self.issue_per_user = create_rate_limiter("issue_user", Config.OTP_ISSUE_PER_USER, window)
+        self.issue_per_ip = create_rate_limiter("issue_ip", Config.OTP_ISSUE_PER_IP, window)
+        self.verify_per_user = create_rate_limiter("verify_user", Config.OTP_VERIFY_PER_USER, window)
+        self.verify_per_ip = create_rate_limiter("verify_ip", Config.OTP_VERIFY_PER_IP, window)
+
+    async def _limit(self, per_user, per_ip, username: str, client_ip: Optional[str]):
+        # Check both so one key can't be used to drain the other's budget unnoticed
+        user_ok = await per_user.hit(username)
+        ip_ok = await per_ip.hit(client_ip) if client_ip else True
+        if not (user_ok and ip_ok):
+            raise HTTPException(status_code=429, detail="Too many OTP requests. Please try again later.")
+
+    async def issue(self, username: str, client_ip: Optional[str] = None) -> str:
+        """Create a fresh 6-digit OTP for username, replacing any previous one"""
+        await self._limit(self.issue_per_user, self.issue_per_ip, username, client_ip)
+
+        otp = f"{secrets.randbelow(900000) + 100000}"
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=self.ttl)
+        await self.store.put(username, _digest(username, otp), expires_at)
+        return otp
+
+    async def verify(self, username: str, otp: str, client_ip: Optional[str] = None):
+        """Consume the OTP for username, raising the usual 400s when it doesn't check out"""
+        await self._limit(self.verify_per_user, self.verify_per_ip, username, client_ip)
+
+        result = await self.store.check(username, _digest(username, str(otp)))
+        if result == OTP_MISSING:
+            raise HTTPException(status_code=400, detail="No OTP found. Please request a new one.")
+        if result == OTP_EXPIRED:
+            raise HTTPException(status_code=400, detail="OTP has expired. Please request a new one.")
+        if result == OTP_LOCKED:
+            raise HTTPException(status_code=400, detail="Too many incorrect attempts. Please request a new OTP.")
+        if result == OTP_INVALID:
+            raise HTTPException(status_code=400, detail="Invalid OTP")
+
+        await self.verify_per_user.reset(username)
+
+
+# Limits follow the OTP store: shared through Mongo unless everything is per process anyway
+def create_rate_limiter(name: str, limit: int, window: int):
+    if Config.OTP_STORE == "memory":
+        return RateLimiter(limit, window)
+    return MongoRateLimiter(otp_rate_limits, name, limit, window)
+
+
+def create_otp_store():
+    if Config.OTP_STORE == "memory":
+        return MemoryOTPStore(Config.OTP_MAX_ATTEMPTS, Config.OTP_TTL_SECONDS)
+    return MongoOTPStore(otps, Config.OTP_MAX_ATTEMPTS)
+
+
+otp_engine = OTPEngine(create_otp_store(), Config.OTP_TTL_SECONDS, Config.OTP_RATE_WINDOW_SECONDS)
@@ -0,0 +1,38 @@
+import base64
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+from bson import ObjectId
+from fastapi import HTTPException
+
+# Pagination cursors are an opaque token around a (timestamp, _id) position.
+# _id breaks ties between documents written in the same millisecond. A cursor
+# marks the far end of a page in the direction it was read, so it is passed
+# back the same way (before -> before, after -> after).
+
+
+def encode_cursor(timestamp: datetime, _id: ObjectId) -> str:
+    millis = int(timestamp.timestamp() * 1000)
+    raw = f"{millis}:{_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> Tuple[datetime, ObjectId]:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+        millis, oid = raw.split(":", 1)
+        timestamp = datetime.fromtimestamp(int(millis) / 1000, tz=timezone.utc)
+        return timestamp, ObjectId(oid)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_filter(field: str, position: Optional[Tuple[datetime, ObjectId]], older: bool) -> dict:
+    """Match documents strictly before (older=True) or after a cursor position"""
+    if position is None:
+        return {}
+    timestamp, _id = position
+    op = "$lt" if older else "$gt"
+    return {"$or": [
+        {field: {op: timestamp}},
+        {field: timestamp, "_id": {op: _id}}
+    ]}
@@ -0,0 +1,129 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+import bcrypt
+from fastapi import HTTPException
+from src.config import Config
+from src.utils.log import get_logger
+from src.utils.metrics import password_hash_queue_seconds, password_hash_rejected
+
+log = get_logger("passwords")
+
+
+# These run inside the pool workers, so they have to stay module-level functions.
+# Each returns the wall-clock time it started so the caller can tell queueing from work.
+
+def _hash_in_worker(password: bytes, rounds: int) -> Tuple[bytes, float]:
+    started = time.time()
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)), started
+
+
+def _verify_in_worker(password: bytes, hashed: bytes) -> Tuple[bool, float]:
+    started = time.time()
+    return bcrypt.checkpw(password, hashed), started
+
+
+def hash_rounds(hashed: bytes) -> Optional[int]:
+    """Cost factor of a bcrypt hash like $2b$12$..."""
+    try:
+        return int(hashed.split(b"$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    """Runs bcrypt in a bounded process pool so logins never block the event loop.
+
+    At most max_pending hash/verify calls may be queued or running; beyond
+    that new calls are turned away with a 503 instead of piling up. Queue time
+    (submit until a worker picks the job up) is tracked per call.
+    """
+
+    def __init__(self, rounds: int = 12, workers: int = 0, max_pending: int = 64):
+        self.rounds = rounds
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.max_pending = max_pending
+        self.start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.pending = 0
+
+        # Stats
+        self.completed = 0
+        self.rejected = 0
+        self.queue_time_total = 0.0
+        self.queue_time_max = 0.0
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # Never fork: by the first login the process already runs the log writer,
+            # loop watchdog and driver threads, and a child forked while one of them
+            # holds a lock can deadlock. Workers come from a clean forkserver instead.
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(self.start_method)
+            )
+        return self._pool
+
+    async def start(self):
+        """Bring a worker up at startup so the first login doesn't pay for it"""
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor(), time.time)
+        except Exception:
+            # e.g. running inside a daemonic process, which may not have children.
+            # Not worth failing startup over - the pool is created on first use instead.
+            log.warning("⚠️ Password pool warm-up failed, starting it on first use", exc_info=True)
+            self.shutdown()
+
+    async def _submit(self, operation: str, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            password_hash_rejected.inc()
+            raise HTTPException(status_code=503, detail="Server busy, please try again")
+
+        self.pending += 1
+        submitted = time.time()
+        try:
+            result, started = await asyncio.get_running_loop().run_in_executor(self._executor(), fn, *args)
+        finally:
+            self.pending -= 1
+
+        queued = max(0.0, started - submitted)
+        self.completed += 1
+        self.queue_time_total += queued
+        self.queue_time_max = max(self.queue_time_max, queued)
+        password_hash_queue_seconds.labels(operation).observe(queued)
+        return result
+
+    async def hash(self, password: str) -> bytes:
+        return await self._submit("hash", _hash_in_worker, password.encode(), self.rounds)
+
+    async def verify(self, password: str, hashed: bytes) -> bool:
+        return await self._submit("verify", _verify_in_worker, password.encode(), hashed)
+
+    def needs_rehash(self, hashed: bytes) -> bool:
+        """True when a stored hash was made with a different cost than configured"""
+        return hash_rounds(hashed) != self.rounds
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "queue_time_avg": self.queue_time_total / self.completed if self.completed else 0.0,
+            "queue_time_max": self.queue_time_max,
+        }
+
+
+password_hasher = PasswordHasher(
+    rounds=Config.BCRYPT_ROUNDS,
+    workers=Config.PASSWORD_HASH_WORKERS,
+    max_pending=Config.PASSWORD_HASH_MAX_PENDING
+)
@@ -0,0 +1,62 @@
+import time
+from typing import Dict, Optional, Set
+from src.config import Config
+from src.utils.cache import TTLCache
+
+# The slim user view authenticated requests get - no password hash, public keys, OTP state
+# or legacy contact arrays (contacts live in the connections collection)
+PRINCIPAL_PROJECTION = {
+    "connected_users": 0,
+    "password_hash": 0,
+    "kyber_public_key": 0,
+    "dilithium_public_key": 0,
+    "key_fingerprint": 0,
+    "key_version": 0,
+    "login_otp": 0,
+    "login_otp_expiry": 0,
+}
+
+
+class PrincipalCache:
+    """Token -> authenticated user cache for get_current_user / get_current_user_ws.
+
+    Entries live until the configured TTL or the token's own expiry, whichever
+    comes first, so a hit can skip both JWT verification and the users lookup.
+    Only the fields PRINCIPAL_PROJECTION keeps are cached, so anything that
+    changes one of those must call invalidate_user(); writes confined to the
+    excluded fields (password hash, keys, legacy contacts) need not.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self._cache = TTLCache(max_size, ttl, on_evict=self._forget)
+        self._tokens_by_user: Dict[str, Set[str]] = {}
+
+    def get(self, token: str) -> Optional[dict]:
+        user = self._cache.get(token)
+        # Hand out copies so routes can't mutate the cached view
+        return dict(user) if user is not None else None
+
+    def put(self, token: str, user: dict, expires_at: Optional[float] = None):
+        ttl = None
+        if expires_at is not None:
+            ttl = expires_at - time.time()
+        self._cache.set(token, user, ttl)
+        if token in self._cache:
+            self._tokens_by_user.setdefault(user["id"], set()).add(token)
+
+    def invalidate_user(self, user_id: str):
+        for token in list(self._tokens_by_user.get(str(user_id), ())):
+            self._cache.pop(token)
+
+    def _forget(self, token: str, user: dict):
+        tokens = self._tokens_by_user.get(user["id"])
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                self._tokens_by_user.pop(user["id"], None)
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+principal_cache = PrincipalCache(Config.PRINCIPAL_CACHE_SIZE, Config.PRINCIPAL_CACHE_TTL)
@@ -0,0 +1,73 @@
+import time
+from datetime import datetime, timezone
+from pymongo import ReturnDocument
+from src.utils.cache import TTLCache
+
+
+class RateLimiter:
+    """Fixed-window counter per key, e.g. "at most 5 OTPs per user per 10 minutes".
+
+    Counters live in a bounded TTL cache, so they are per process and idle keys
+    simply expire. With several workers each keeps its own count - use
+    MongoRateLimiter there.
+    """
+
+    def __init__(self, limit: int, window: float, max_keys: int = 100000):
+        self.limit = limit
+        self.window = window
+        self._counters = TTLCache(max_keys, window)
+        self.rejected = 0
+
+    async def hit(self, key: str) -> bool:
+        """Count one event for key; False once the key is over its limit"""
+        counter = self._counters.get(key)
+        if counter is None:
+            # Counted in place, so the window keeps its original expiry
+            counter = [0]
+            self._counters.set(key, counter)
+        counter[0] += 1
+        if counter[0] > self.limit:
+            self.rejected += 1
+            return False
+        return True
+
+    async def reset(self, key: str):
+        self._counters.pop(key)
+
+
+class MongoRateLimiter:
+    """The same limit shared by every worker: one counter document per key and window.
+
+    Windows are aligned to the clock (window_index = now // window) rather than
+    starting at a key's first hit, so the document id alone picks the counter and
+    a single upsert both creates and bumps it. A TTL index on expires_at clears
+    finished windows.
+    """
+
+    def __init__(self, collection, name: str, limit: int, window: int):
+        self.collection = collection
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.rejected = 0
+
+    def _window(self):
+        index = int(time.time() // self.window)
+        return index, datetime.fromtimestamp((index + 1) * self.window, timezone.utc)
+
+    async def hit(self, key: str) -> bool:
+        index, expires_at = self._window()
+        counter = await self.collection.find_one_and_update(
+            {"_id": f"{self.name}:{key}:{index}"},
+            {"$inc": {"count": 1}, "$setOnInsert": {"expires_at": expires_at}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if counter["count"] > self.limit:
+            self.rejected += 1
+            return False
+        return True
+
+    async def reset(self, key: str):
+        index, _ = self._window()
+        await self.collection.delete_one({"_id": f"{self.name}:{key}:{index}"})
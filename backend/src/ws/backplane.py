@@ -0,0 +1,246 @@
+import asyncio
+import json
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Dict, List, Optional
+from urllib.parse import urlparse
+from src.utils.log import get_logger
+
+log = get_logger("ws.backplane")
+
+# handler(channel, message) is called for every message published on a subscribed channel
+MessageHandler = Callable[[str, dict], Awaitable[None]]
+
+
+class Backplane(ABC):
+    """Pub/sub transport that lets ConnectionManagers on different workers talk to each other"""
+
+    @abstractmethod
+    async def start(self, channels: List[str], handler: MessageHandler):
+        ...
+
+    @abstractmethod
+    async def publish(self, channel: str, message: dict) -> int:
+        """Publish a message and return how many subscribers received it"""
+
+    @abstractmethod
+    async def stop(self):
+        ...
+
+
+class InProcessBackplane(Backplane):
+    """Backplane for a single process - every manager sharing a hub sees each other's messages"""
+
+    _default_hub: Dict[str, List[MessageHandler]] = {}
+
+    def __init__(self, hub: Optional[Dict[str, List[MessageHandler]]] = None):
+        self.hub = self._default_hub if hub is None else hub
+        self.channels: List[str] = []
+        self.handler: Optional[MessageHandler] = None
+
+    async def start(self, channels: List[str], handler: MessageHandler):
+        self.channels = list(channels)
+        self.handler = handler
+        for channel in self.channels:
+            self.hub.setdefault(channel, []).append(handler)
+
+    async def publish(self, channel: str, message: dict) -> int:
+        handlers = list(self.hub.get(channel, []))
+        for handler in handlers:
+            # Dispatch like a real broker would: the publisher never runs the subscriber inline
+            asyncio.create_task(handler(channel, message))
+        return len(handlers)
+
+    async def stop(self):
+        for channel in self.channels:
+            handlers = self.hub.get(channel, [])
+            if self.handler in handlers:
+                handlers.remove(self.handler)
+            if not handlers:
+                self.hub.pop(channel, None)
+        self.channels = []
+
+
+class RedisProtocolError(Exception):
+    pass
+
+
+# Anything that means the subscriber stream can't be trusted any more; garbled
+# length headers surface as ValueError
+STREAM_ERRORS = (OSError, asyncio.IncompleteReadError, RedisProtocolError, ValueError)
+
+
+def encode_command(*args) -> bytes:
+    """Encode a command as a RESP array of bulk strings"""
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(out)
+
+
+async def read_reply(reader: asyncio.StreamReader):
+    """Read one RESP reply from the stream"""
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Backplane connection closed")
+    prefix, body = line[:1], line[1:-2]
+
+    if prefix == b"+":
+        return body.decode()
+    if prefix == b"-":
+        raise RedisProtocolError(body.decode())
+    if prefix == b":":
+        return int(body)
+    if prefix == b"$":
+        length = int(body)
+        if length == -1:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2]
+    if prefix == b"*":
+        length = int(body)
+        if length == -1:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    raise RedisProtocolError(f"Unexpected reply prefix: {prefix!r}")
+
+
+class RedisBackplane(Backplane):
+    """Backplane speaking the Redis protocol (RESP) over plain asyncio streams.
+
+    Works against Redis or any RESP-compatible server, so a local stand-in can be
+    used in development. Uses one connection for PUBLISH and one for SUBSCRIBE.
+    """
+
+    def __init__(self, url: str, reconnect_delay: float = 1.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = (parsed.path or "/").lstrip("/") or "0"
+        self.reconnect_delay = reconnect_delay
+
+        self.channels: List[str] = []
+        self.handler: Optional[MessageHandler] = None
+        self._pub: Optional[tuple] = None
+        self._pub_lock = asyncio.Lock()
+        self._listener: Optional[asyncio.Task] = None
+        self._closing = False
+
+    async def _open(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            writer.write(encode_command("AUTH", self.password))
+            await writer.drain()
+            await read_reply(reader)
+        return reader, writer
+
+    async def start(self, channels: List[str], handler: MessageHandler):
+        self.channels = list(channels)
+        self.handler = handler
+        self._closing = False
+        self._pub = await self._open()
+        # Pub/sub messages are not scoped to a db, but SELECT validates the URL early
+        reader, writer = self._pub
+        writer.write(encode_command("SELECT", self.db))
+        await writer.drain()
+        await read_reply(reader)
+
+        sub = await self._subscribe()
+        self._listener = asyncio.create_task(self._listen(sub))
+
+    async def _subscribe(self):
+        reader, writer = await self._open()
+        try:
+            writer.write(encode_command("SUBSCRIBE", *self.channels))
+            await writer.drain()
+            for _ in self.channels:
+                await read_reply(reader)
+        except BaseException:
+            writer.close()
+            raise
+        return reader, writer
+
+    async def _resubscribe(self) -> Optional[tuple]:
+        """Reconnect every reconnect_delay until subscribed again; None once stopping"""
+        while not self._closing:
+            await asyncio.sleep(self.reconnect_delay)
+            try:
+                sub = await self._subscribe()
+                log.info("🔁 Backplane subscriber reconnected")
+                return sub
+            except STREAM_ERRORS as e:
+                log.warning("⚠️ Backplane reconnect failed", error=e)
+        return None
+
+    async def _listen(self, sub):
+        reader, writer = sub
+        while not self._closing:
+            try:
+                reply = await read_reply(reader)
+            except asyncio.CancelledError:
+                break
+            except STREAM_ERRORS as e:
+                if self._closing:
+                    break
+                # Dropped, or out of step with the server - either way start a fresh session
+                log.warning("⚠️ Backplane subscriber lost connection", error=e)
+                writer.close()
+                try:
+                    sub = await self._resubscribe()
+                except asyncio.CancelledError:
+                    return
+                if sub is None:
+                    return
+                reader, writer = sub
+                continue
+
+            try:
+                if not isinstance(reply, list) or len(reply) != 3 or reply[0] != b"message":
+                    continue
+                channel = reply[1].decode()
+                message = json.loads(reply[2])
+                asyncio.create_task(self.handler(channel, message))
+            except Exception:
+                # One bad message - the stream itself is fine
+                log.exception("❌ Backplane listener error")
+
+        writer.close()
+
+    async def publish(self, channel: str, message: dict) -> int:
+        data = json.dumps(message)
+        async with self._pub_lock:
+            for attempt in range(2):
+                try:
+                    reader, writer = self._pub
+                    writer.write(encode_command("PUBLISH", channel, data))
+                    await writer.drain()
+                    return await read_reply(reader)
+                except (ConnectionError, asyncio.IncompleteReadError, OSError):
+                    if attempt:
+                        raise
+                    self._pub = await self._open()
+        return 0
+
+    async def stop(self):
+        self._closing = True
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._pub:
+            self._pub[1].close()
+            self._pub = None
+
+
+def create_backplane(url: str) -> Backplane:
+    """Build a backplane from a URL: empty for in-process, redis:// for the Redis protocol"""
+    if not url or url.startswith("memory://"):
+        return InProcessBackplane()
+    if url.startswith("redis://"):
+        return RedisBackplane(url)
+    raise ValueError(f"Unsupported backplane URL: {url}")
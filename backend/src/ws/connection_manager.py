@@ -1,186 +1,473 @@
+from bson import ObjectId
 from fastapi import WebSocket
-from typing import Dict
-from src.db.main import messages  # Assuming Motor is used here
+from typing import Dict, Iterable, Optional, Set
+from src.db.writer import message_writer
+from src.db.recent import recent_messages
+from src.db.migrations import conversation_id
+from src.db.contacts import is_contact
+from src.ws.backplane import Backplane, create_backplane
+from src.ws.outbound import OutboundQueue
+from src.ws.offline import offline_queue
+from src.ws.presence import OFFLINE, ONLINE, PresenceBatch, PresenceBatcher, PresenceGraph
+from src.ws.session import Session
+from src.ws.protocol import JSON, TYPE_NAMES, Frame, FrameType, Status, encode_control, encode_presence, encode_status, pack_frame, unpack_frame
+from src.utils.log import get_logger
+from src.utils.metrics import send_to_peer_seconds, ws_connections, ws_error_statuses, ws_frames_out
+from src.config import Config
 from datetime import datetime, timezone
-import json
 import asyncio
+import os
+import socket
+import time
+import uuid
 from fastapi.websockets import WebSocketState
 
+log = get_logger("ws")
+
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
-        self.paired_users: Dict[str, str] = {}
+    def __init__(self, backplane: Optional[Backplane] = None, worker_id: Optional[str] = None):
+        # One session per locally connected user
+        self.sessions: Dict[str, Session] = {}
+        self.graph = PresenceGraph()
+        self.presence = PresenceBatcher(Config.PRESENCE_BATCH_WINDOW, self._flush_presence)
+
+        # Cross-worker routing: which worker holds each remote user's socket
+        self.worker_id = worker_id or Config.WORKER_ID or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.backplane = backplane or create_backplane(Config.BACKPLANE_URL)
+        self.remote_users: Dict[str, str] = {}
+        self._channel_prefix = Config.BACKPLANE_CHANNEL_PREFIX
+        self._presence_channel = f"{self._channel_prefix}:presence"
+        self._started = False
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _worker_channel(self, worker_id: str) -> str:
+        return f"{self._channel_prefix}:worker:{worker_id}"
+
+    def _spawn(self, coro):
+        """Run a coroutine in the background from sync code.
+
+        The task is held until it finishes - the loop only keeps a weak
+        reference - and a failure is logged rather than lost.
+        """
+        try:
+            task = asyncio.get_running_loop().create_task(coro)
+        except RuntimeError:
+            coro.close()
+            return None
+        self._tasks.add(task)
+        task.add_done_callback(self._reap)
+        return task
+
+    def _reap(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.error("❌ Background task failed", task=task.get_name(), exc_info=task.exception())
+
+    async def start(self):
+        """Join the backplane and ask the other workers who they are holding"""
+        if self._started:
+            return
+        await self.backplane.start(
+            [self._presence_channel, self._worker_channel(self.worker_id)],
+            self._on_backplane_message
+        )
+        self._started = True
+        await self._publish_presence({"event": "sync"})
+        log.info("🛰️ Joined the backplane", worker=self.worker_id)
+
+    async def stop(self):
+        """Tell the other workers our users are gone and leave the backplane"""
+        if not self._started:
+            return
+        try:
+            await self._publish_presence({"event": "worker-down"})
+        except Exception as e:
+            log.warning("⚠️ Failed to announce worker shutdown", error=e)
+        await self.backplane.stop()
+        self._started = False
+
+    async def _publish_presence(self, event: dict):
+        if not self._started:
+            return
+        event["worker"] = self.worker_id
+        try:
+            await self.backplane.publish(self._presence_channel, event)
+        except Exception as e:
+            log.warning("⚠️ Failed to publish presence event", presence_event=event.get("event"), error=e)
+
+    async def _on_backplane_message(self, channel: str, message: dict):
+        """Handle presence events and frames routed to us by other workers"""
+        worker = message.get("worker")
+        if worker == self.worker_id:
+            return
+
+        try:
+            if channel == self._presence_channel:
+                event = message.get("event")
+                if event == "online":
+                    user_id = message["user_id"]
+                    self.remote_users[user_id] = worker
+                    # The user reconnected on another worker - drop our old socket
+                    if user_id in self.sessions:
+                        self.disconnect(user_id, announce=False)
+                    else:
+                        self._announce(user_id, ONLINE)
+                elif event == "offline":
+                    user_id = message["user_id"]
+                    if self.remote_users.get(user_id) == worker:
+                        self.remote_users.pop(user_id, None)
+                        self._announce(user_id, OFFLINE)
+                        self.graph.drop_pairings(user_id)
+                elif event == "worker-down":
+                    gone = [uid for uid, w in self.remote_users.items() if w == worker]
+                    for uid in gone:
+                        self.remote_users.pop(uid, None)
+                        self._announce(uid, OFFLINE)
+                        self.graph.drop_pairings(uid)
+                elif event == "sync":
+                    await self.backplane.publish(self._worker_channel(worker), {
+                        "kind": "presence-snapshot",
+                        "worker": self.worker_id,
+                        "users": list(self.sessions)
+                    })
+                return
+
+            kind = message.get("kind")
+            if kind == "presence-snapshot":
+                for user_id in message.get("users", []):
+                    if user_id not in self.sessions:
+                        self.remote_users[user_id] = worker
+            elif kind == "deliver":
+                await self._deliver_routed(message)
+
+        except Exception:
+            log.exception("❌ Error handling backplane message", channel=channel)
+
+    async def _deliver_routed(self, message: dict):
+        """Deliver a frame or status another worker routed to one of our users"""
+        receiver_id = message["to"]
+        sender_id = message.get("from")
+        ack = bool(sender_id and message.get("ack"))
+        session = self.sessions.get(receiver_id)
+
+        if not session or session.websocket.client_state != WebSocketState.CONNECTED:
+            if session:
+                self.disconnect(receiver_id)
+            if ack:
+                await self.send_status_message(sender_id, Status.PEER_OFFLINE, receiver_id)
+            return
+
+        if "status" in message:
+            self._queue(
+                session, "status",
+                encode_status(session.protocol, Status(message["status"]), *message.get("args", [])),
+                droppable=True
+            )
+            return
+
+        frame = unpack_frame(message["frame"])
+        if sender_id:
+            # The sending worker stored this message - our copy of the conversation is behind
+            recent_messages.invalidate(conversation_id(sender_id, receiver_id))
+        data = frame.encode(session.protocol)
+        on_done = self._delivery_ack(sender_id, receiver_id, self._relay_id(frame)) if ack else None
+        if not self._queue(session, TYPE_NAMES.get(frame.type, "unknown"), data, on_done) and ack:
+            await self.send_status_message(sender_id, Status.PEER_SLOW, receiver_id)
+
+    @staticmethod
+    def _relay_id(frame: Frame) -> Optional[str]:
+        """Client id relay acks are correlated by; other frames are acked without one"""
+        return frame.get("id") if frame.type == FrameType.RELAY else None
+
+    def _delivery_ack(self, sender_id: str, receiver_id: str, message_id: Optional[str] = None):
+        """Build the writer callback that tells the sender how delivery went"""
+        async def on_done(success: bool):
+            if success and message_id:
+                # Relay frames carry a client id the sender correlates acks with
+                await self.send_status_message(sender_id, Status.RELAY_DELIVERED, message_id)
+            elif success:
+                await self.send_status_message(sender_id, Status.DELIVERED)
+            else:
+                await self.send_status_message(sender_id, Status.PEER_GONE, receiver_id)
+        return on_done
+
+    def _queue(self, session: Session, kind: str, data, on_done=None, droppable: bool = False) -> bool:
+        """Queue data on session's socket, counted as an outbound frame of kind"""
+        queued = session.queue.put(data, on_done, droppable)
+        if queued:
+            ws_frames_out.labels(kind).inc()
+        return queued
+
+    def send_ping(self, user_id: str) -> bool:
+        session = self.sessions.get(user_id)
+        if session is None:
+            return False
+        return self._queue(session, "ping", encode_control(session.protocol, FrameType.PING), droppable=True)
+
+    def close_idle(self, user_id: str):
+        """Heartbeat timeout: close a socket that has gone silent"""
+        self.disconnect(user_id, code=1001, reason="Idle timeout")
+
+    def _kick_slow_consumer(self, user_id: str, session: Optional[Session] = None):
+        """Overflow policy "disconnect": close a socket that never catches up"""
+        self.disconnect(user_id, code=1013, reason="Receiver too slow", session=session)
+
+    async def _route_remote(self, user_id: str, payload: dict, sender_id: Optional[str] = None, ack: bool = False) -> bool:
+        """Publish a frame ({"frame": ...}) or status ({"status": ..., "args": ...}) to the
+        worker holding user_id, which encodes it for that user's protocol; False if
+        nobody picked it up"""
+        worker = self.remote_users.get(user_id)
+        if not worker or not self._started:
+            return False
+        try:
+            receivers = await self.backplane.publish(self._worker_channel(worker), {
+                "kind": "deliver",
+                "worker": self.worker_id,
+                "to": user_id,
+                "from": sender_id,
+                "ack": ack,
+                **payload
+            })
+        except Exception as e:
+            log.error("❌ Backplane publish failed", worker=worker, error=e)
+            return False
+
+        if not receivers:
+            # That worker is gone without saying goodbye
+            log.warning("⚠️ Worker did not receive frame, dropping stale presence", worker=worker, user_id=user_id)
+            self.remote_users.pop(user_id, None)
+            return False
+        return True
+
+    def _announce(self, user_id: str, status: str):
+        """Queue word to local users who pair with or follow user_id that it came or went.
+
+        Pairing is read now, since a disconnect drops it before the batch goes out.
+        """
+        for watcher in self.graph.audience(user_id):
+            if watcher in self.sessions:
+                self.presence.add(watcher, user_id, status, self.graph.peer_of(watcher) == user_id)
+
+    def _flush_presence(self, batch: PresenceBatch):
+        """One frame per watcher: a diff for subscribers, otherwise only news of
+        their paired peer as the classic status line"""
+        for watcher, changes in batch.items():
+            session = self.sessions.get(watcher)
+            if session is None:
+                continue
+            if session.presence:
+                online = [uid for uid, (status, _) in changes.items() if status == ONLINE]
+                offline = [uid for uid, (status, _) in changes.items() if status == OFFLINE]
+                self._queue(session, "presence", encode_presence(session.protocol, online, offline))
+                continue
+            for uid, (status, paired) in changes.items():
+                if paired:
+                    self._queue(session, "status", encode_status(session.protocol, Status.PEER_STATUS, uid, status), droppable=True)
+
+    def presence_of(self, user_ids: Iterable[str]) -> Dict[str, bool]:
+        """Online state of each user, on this or any other worker"""
+        return {user_id: self.is_user_online(user_id) for user_id in user_ids}
+
+    def subscribe_presence(self, session: Session):
+        """Start pushing presence diffs to session, beginning with a snapshot of its contacts"""
+        session.presence = True
+        snapshot = self.presence_of(session.contacts)
+        self._queue(session, "presence", encode_presence(
+            session.protocol,
+            [uid for uid, online in snapshot.items() if online],
+            [uid for uid, online in snapshot.items() if not online]
+        ))
+
+    def unsubscribe_presence(self, session: Session):
+        session.presence = False
 
-    async def connect(self, websocket: WebSocket, user_id: str):
+    async def connect(self, websocket: WebSocket, user_id: str, protocol: str = JSON, contacts: Iterable[str] = ()) -> Session:
         """Connect a user, handling existing connections properly"""
         # If user already has an active connection, close it first
-        if user_id in self.active_connections:
-            old_ws = self.active_connections[user_id]
+        old = self.sessions.pop(user_id, None)
+        if old:
             try:
-                if old_ws.client_state == WebSocketState.CONNECTED:
-                    await old_ws.close(code=1000, reason="New connection established")
+                if old.websocket.client_state == WebSocketState.CONNECTED:
+                    await old.websocket.close(code=1000, reason="New connection established")
             except Exception as e:
-                print(f"⚠️ Error closing old connection for {user_id}: {e}")
+                log.warning("⚠️ Error closing old connection", user_id=user_id, error=e)
             finally:
-                self.active_connections.pop(user_id, None)
-        
-        self.active_connections[user_id] = websocket
-        print(f"🔗 User {user_id} connected. Active connections: {list(self.active_connections.keys())}")
+                old.queue.close()
+                self.graph.unwatch(user_id, old.contacts)
+
+        queue = OutboundQueue(
+            websocket,
+            user_id,
+            max_size=Config.OUTBOUND_QUEUE_MAX,
+            high_watermark=Config.OUTBOUND_HIGH_WATERMARK,
+            low_watermark=Config.OUTBOUND_LOW_WATERMARK,
+            policy=Config.OUTBOUND_OVERFLOW_POLICY,
+            stall_timeout=Config.OUTBOUND_STALL_TIMEOUT,
+            # Bound to this session, so a superseded socket's writer can't take down
+            # the user's newer connection
+            on_overflow=lambda uid: self._kick_slow_consumer(uid, session=session),
+            on_error=lambda uid: self.disconnect(uid, session=session)
+        )
+        session = Session(user_id, websocket, queue, protocol, contacts)
+        self.sessions[user_id] = session
+        self.graph.watch(user_id, session.contacts)
+        self.remote_users.pop(user_id, None)
+        log.info("🔗 User connected", user_id=user_id, protocol=protocol, active=len(self.sessions))
+        if not old:
+            self._announce(user_id, ONLINE)
+        await self._publish_presence({"event": "online", "user_id": user_id})
+        return session
+
+    def disconnect(
+        self,
+        user_id: str,
+        announce: bool = True,
+        code: int = 1000,
+        reason: str = "User disconnected",
+        session: Optional[Session] = None
+    ):
+        """Disconnect a user and clean up all related data.
+
+        Pass session to only disconnect that particular connection, so a socket
+        that was already replaced can't take the user's newer one down with it.
+        """
+        current = self.sessions.get(user_id)
+        if session is not None and current is not session:
+            return
 
-    def disconnect(self, user_id: str):
-        """Disconnect a user and clean up all related data"""
         # Remove from active connections
-        websocket = self.active_connections.pop(user_id, None)
-        
-        if websocket:
+        self.sessions.pop(user_id, None)
+        if current:
+            current.queue.close()
+            self.graph.unwatch(user_id, current.contacts)
+            if announce:
+                self._announce(user_id, OFFLINE)
+                self._spawn(self._publish_presence({"event": "offline", "user_id": user_id}))
+
             try:
                 # Attempt to close the websocket if it's still connected
-                if websocket.client_state == WebSocketState.CONNECTED:
-                    asyncio.create_task(websocket.close(code=1000, reason="User disconnected"))
+                if current.websocket.client_state == WebSocketState.CONNECTED:
+                    asyncio.create_task(current.websocket.close(code=code, reason=reason))
             except Exception as e:
-                print(f"⚠️ Error closing websocket for {user_id}: {e}")
-
-        # Remove all pairings involving this user
-        self.paired_users.pop(user_id, None)
-        # Remove reverse pairings
-        to_remove = [k for k, v in self.paired_users.items() if v == user_id]
-        for k in to_remove:
-            self.paired_users.pop(k, None)
+                log.warning("⚠️ Error closing websocket", user_id=user_id, error=e)
+
+        # Remove all pairings involving this user, including reverse pairings
+        self.graph.drop_pairings(user_id)
         
-        print(f"🔌 Disconnected {user_id}. Active: {list(self.active_connections.keys())}")
+        log.info("🔌 Disconnected", user_id=user_id, code=code, active=len(self.sessions))
+
+    def add_contact(self, user_id: str, contact_id: str):
+        """A new connection was made - start following its presence if user_id is here"""
+        session = self.sessions.get(user_id)
+        if session and contact_id not in session.contacts:
+            session.contacts.add(contact_id)
+            self.graph.watch(user_id, (contact_id,))
 
     def pair_users(self, sender_id: str, receiver_id: str):
         """Pair users for messaging"""
-        if sender_id in self.active_connections and receiver_id in self.active_connections:
-            self.paired_users[sender_id] = receiver_id
-            print(f"👥 Paired: {sender_id} -> {receiver_id}")
-            print(f"🔗 All pairings: {self.paired_users}")
+        if sender_id in self.sessions and self.is_user_online(receiver_id):
+            if self.graph.peer_of(sender_id) != receiver_id:
+                self.graph.pair(sender_id, receiver_id)
+                log.debug("👥 Paired", sender_id=sender_id, receiver_id=receiver_id)
         else:
-            print(f"❌ Cannot pair users - one or both not connected: {sender_id}, {receiver_id}")
+            log.warning("❌ Cannot pair users - one or both not connected", sender_id=sender_id, receiver_id=receiver_id)
 
     def is_mutually_paired(self, user1_id: str, user2_id: str) -> bool:
         """Check if two users are mutually paired"""
-        mutual = (
-            self.paired_users.get(user1_id) == user2_id and
-            self.paired_users.get(user2_id) == user1_id
-        )
-        print(f"🤝 Mutual pairing check {user1_id} <-> {user2_id}: {mutual}")
-        return mutual
+        return self.graph.is_mutual(user1_id, user2_id)
 
-    async def send_status_message(self, user_id: str, status: str):
+    async def send_status_message(self, user_id: str, code: Status, *args):
         """Send status messages separately from encrypted messages"""
-        if user_id not in self.active_connections:
-            print(f"❌ User {user_id} not in active connections for status message")
+        if code >= 100:
+            ws_error_statuses.labels(code.name.lower()).inc()
+        session = self.sessions.get(user_id)
+        if session is None:
+            if await self._route_remote(user_id, {"status": int(code), "args": [str(arg) for arg in args]}):
+                return True
+            log.debug("❌ Status for a user not connected anywhere", user_id=user_id, status=code.name)
             return False
-            
-        websocket = self.active_connections[user_id]
         
         try:
             # Check if websocket is still connected
-            if websocket.client_state != WebSocketState.CONNECTED:
-                print(f"❌ WebSocket for {user_id} is not connected (state: {websocket.client_state})")
+            if session.websocket.client_state != WebSocketState.CONNECTED:
+                log.warning("❌ WebSocket not connected for status message", user_id=user_id, state=session.websocket.client_state)
                 self.disconnect(user_id)
                 return False
                 
-            await websocket.send_text(f"STATUS:{status}")
-            print(f"📊 Status sent to {user_id}: {status}")
+            # Status frames are the first thing shed when the receiver is congested
+            if not self._queue(session, "status", encode_status(session.protocol, code, *args), droppable=True):
+                return False
+            log.debug("📊 Status queued", user_id=user_id, status=code.name, sample=Config.LOG_SAMPLE_RATE)
             return True
             
-        except Exception as e:
-            print(f"❌ Failed to send status to {user_id}: {e}")
+        except Exception:
+            log.exception("❌ Failed to send status", user_id=user_id)
             self.disconnect(user_id)
             return False
 
-    async def send_to_peer(self, sender_id: str, encrypted_payload):
+    async def send_to_peer(self, sender_id: str, frame: Frame):
         """Send encrypted message to paired peer with signature support"""
+        started = time.perf_counter()
+        sent = False
+        try:
+            sent = await self._send_to_peer(sender_id, frame)
+            return sent
+        finally:
+            send_to_peer_seconds.labels("ok" if sent else "failed").observe(time.perf_counter() - started)
+
+    async def _send_to_peer(self, sender_id: str, frame: Frame):
         # Get receiver from payload (more reliable than pairing lookup)
-        receiver_id = encrypted_payload.get("to")
+        receiver_id = frame.get("to")
 
         if not receiver_id:
-            print(f"❌ No receiver specified in payload from {sender_id}")
-            await self.send_status_message(sender_id, "❌ No receiver specified")
+            log.warning("❌ No receiver specified", sender_id=sender_id)
+            await self.send_status_message(sender_id, Status.NO_RECEIVER)
             return False
 
-        print(f"📤 Attempting to send from {sender_id} to {receiver_id}")
+        log.debug("📤 Sending message", sender_id=sender_id, receiver_id=receiver_id, signed=bool(frame.get("signature")), sample=Config.LOG_SAMPLE_RATE)
 
-        # Log signature information
-        has_signature = bool(encrypted_payload.get("signature"))
-        print(f"📝 Message from {sender_id} has signature: {has_signature}")
+        # Receiver lives on another worker - route it there, that worker acks the sender
+        receiver = self.sessions.get(receiver_id)
+        if receiver is None and receiver_id in self.remote_users:
+            routed = await self._route_remote(receiver_id, {"frame": pack_frame(frame)}, sender_id, ack=True)
+            if routed:
+                log.debug("🛰️ Routed message", receiver_id=receiver_id, worker=self.remote_users.get(receiver_id), sample=Config.LOG_SAMPLE_RATE)
+                self._save_message(sender_id, receiver_id, frame)
+                return True
 
-        # Check if receiver is online
-        if receiver_id not in self.active_connections:
-            print(f"❌ Receiver {receiver_id} not in active connections")
-            await self.send_status_message(sender_id, f"❌ User {receiver_id} is offline")
-            return False
-
-        receiver_ws = self.active_connections[receiver_id]
+        # Receiver is not connected anywhere - store and forward on reconnect
+        if receiver is None:
+            return await self.queue_offline(sender_id, receiver_id, frame)
 
         # Check if receiver's websocket is still connected
-        if receiver_ws.client_state != WebSocketState.CONNECTED:
-            print(f"❌ Receiver {receiver_id} websocket is not connected")
+        if receiver.websocket.client_state != WebSocketState.CONNECTED:
+            log.warning("❌ Receiver websocket is not connected", receiver_id=receiver_id)
             self.disconnect(receiver_id)
-            await self.send_status_message(sender_id, f"❌ User {receiver_id} disconnected")
+            await self.send_status_message(sender_id, Status.PEER_DISCONNECTED, receiver_id)
             return False
 
         try:
-            # Send the encrypted payload as JSON string (includes signature if present)
-            await receiver_ws.send_text(json.dumps(encrypted_payload))
-            print(f"✅ Message sent successfully to {receiver_id}")
-            if has_signature:
-                print(f"📝 Signature included in message to {receiver_id}")
-
-            # IMPROVED: Save chat to MongoDB with better error handling
-            try:
-                # Validate required fields before insertion
-                required_fields = ["ciphertext", "encryptedMessage", "iv"]
-                missing_fields = [field for field in required_fields if not encrypted_payload.get(field)]
-
-                if missing_fields:
-                    print(f"⚠️ Missing required fields for DB save: {missing_fields}")
-                    # Still continue - message was delivered
-                else:
-                    # Create the message document with all necessary fields
-                    message_doc = {
-                        "sender_id": sender_id,
-                        "receiver_id": receiver_id,
-                        "message_type": "encrypted",
-                        "ciphertext": encrypted_payload.get("ciphertext"),
-                        "encrypted_message": encrypted_payload.get("encryptedMessage"),  # Note: field name mapping
-                        "iv": encrypted_payload.get("iv"),
-                        "timestamp": datetime.now(timezone.utc)
-                    }
-
-                    # Add signature if present
-                    if encrypted_payload.get("signature"):
-                        message_doc["signature"] = encrypted_payload.get("signature")
-                        print(f"💾 Preparing to save message with signature from {sender_id}")
-
-                    print(f"💾 Attempting to save message doc: {message_doc}")
-
-                    # Insert the message - SYNCHRONOUS call since you're not using Motor
-                    result = messages.insert_one(message_doc)
-
-                    if result.inserted_id:
-                        print(f"✅ Message saved to database with ID: {result.inserted_id}")
-                        if message_doc.get("signature"):
-                            print(f"📝 Signature saved to database for message {result.inserted_id}")
-                    else:
-                        print(f"❌ Failed to save message - no inserted_id returned")
+            # Queue the frame, in the receiver's protocol, for their writer task; the
+            # sender is acked from there once the frame has actually been written
+            queued = self._queue(
+                receiver, TYPE_NAMES.get(frame.type, "unknown"),
+                frame.encode(receiver.protocol),
+                self._delivery_ack(sender_id, receiver_id, self._relay_id(frame))
+            )
+            if not queued:
+                log.warning("❌ Outbound queue rejected message", sender_id=sender_id, receiver_id=receiver_id)
+                await self.send_status_message(sender_id, Status.PEER_SLOW, receiver_id)
+                return False
 
-            except Exception as db_error:
-                print(f"❌ Database save failed: {db_error}")
-                print(f"❌ Error type: {type(db_error)}")
-                import traceback
-                traceback.print_exc()
-                # Don't fail the message delivery if DB save fails
+            log.debug("✅ Message queued", receiver_id=receiver_id, sample=Config.LOG_SAMPLE_RATE)
 
-            # Send success status to sender
-            await self.send_status_message(sender_id, "✅ Message delivered")
+            self._save_message(sender_id, receiver_id, frame)
             return True
 
         except Exception as e:
-            print(f"❌ Failed to send to {receiver_id}: {e}")
-            await self.send_status_message(sender_id, f"❌ Delivery failed: {str(e)}")
+            log.exception("❌ Failed to send", receiver_id=receiver_id)
+            await self.send_status_message(sender_id, Status.SEND_ERROR, str(e))
 
             # Check if the error is due to connection issues
             if "ConnectionClosed" in str(type(e)) or "websocket" in str(e).lower():
@@ -188,35 +475,154 @@ class ConnectionManager:
 
             return False
 
+    def _message_document(self, sender_id: str, receiver_id: str, frame: Frame) -> Optional[dict]:
+        if frame.type == FrameType.RELAY:
+            return self._relay_document(sender_id, receiver_id, frame)
+        return self._encrypted_document(sender_id, receiver_id, frame)
+
+    def _save_message(self, sender_id: str, receiver_id: str, frame: Frame, message_doc: Optional[dict] = None):
+        """Hand a delivered message to the write-behind buffer; the sender gets a
+        separate "stored" ack once it is durable"""
+        if message_doc is None:
+            message_doc = self._message_document(sender_id, receiver_id, frame)
+            if message_doc is None:
+                # Still continue - message was delivered
+                return
+
+        message_id = self._relay_id(frame)
+
+        async def on_stored(success: bool):
+            if success and message_id:
+                await self.send_status_message(sender_id, Status.RELAY_STORED, message_id)
+            elif success:
+                await self.send_status_message(sender_id, Status.STORED)
+            else:
+                recent_messages.discard(message_doc["conversation_id"], message_doc["_id"])
+                await self.send_status_message(sender_id, Status.NOT_STORED)
+
+        if not message_writer.put(message_doc, on_stored):
+            log.error("❌ Message backlog full, not storing message", sender_id=sender_id)
+            self._spawn(self.send_status_message(sender_id, Status.NOT_STORED))
+            return
+        # put() assigned the _id; history reads can now serve it from memory
+        recent_messages.append(message_doc["conversation_id"], message_doc)
+
+    def _relay_document(self, sender_id: str, receiver_id: str, frame: Frame) -> dict:
+        """A relay is stored as the very frame that was forwarded; the body is never unpacked"""
+        return {
+            "sender_id": sender_id,
+            "receiver_id": receiver_id,
+            "conversation_id": conversation_id(sender_id, receiver_id),
+            "message_type": "relay",
+            "relay_id": frame.get("id"),
+            "frame": frame.raw,
+            "protocol": frame.protocol,
+            "timestamp": datetime.now(timezone.utc)
+        }
+
+    def _encrypted_document(self, sender_id: str, receiver_id: str, frame: Frame) -> Optional[dict]:
+        # Validate required fields before buffering
+        required_fields = ["ciphertext", "encryptedMessage", "iv"]
+        missing_fields = [field for field in required_fields if not frame.get(field)]
+
+        if missing_fields:
+            log.warning("⚠️ Missing required fields for DB save", missing=missing_fields)
+            return None
+
+        # Create the message document with all necessary fields; byte fields are
+        # stored base64 whichever protocol they came in on
+        message_doc = {
+            "sender_id": sender_id,
+            "receiver_id": receiver_id,
+            "conversation_id": conversation_id(sender_id, receiver_id),
+            "message_type": "encrypted",
+            "ciphertext": frame.b64("ciphertext"),
+            "encrypted_message": frame.b64("encryptedMessage"),  # Note: field name mapping
+            "iv": frame.b64("iv"),
+            "timestamp": datetime.now(timezone.utc)
+        }
+
+        # Add signature if present
+        if frame.get("signature"):
+            message_doc["signature"] = frame.b64("signature")
+        return message_doc
+
+    async def queue_offline(self, sender_id: str, receiver_id: str, frame: Frame) -> bool:
+        """Keep a message for a receiver that is offline until they connect"""
+        log.debug("📥 Receiver offline, queueing message", sender_id=sender_id, receiver_id=receiver_id, sample=Config.LOG_SAMPLE_RATE)
+
+        # Only contacts may leave messages, so nobody can fill a stranger's queue -
+        # or one for a made-up id. The session's list may predate a new connection.
+        sender = self.sessions.get(sender_id)
+        if not (sender and receiver_id in sender.contacts) and not await is_contact(sender_id, receiver_id):
+            log.warning("🚫 Offline message for a non-contact", sender_id=sender_id, receiver_id=receiver_id)
+            await self.send_status_message(sender_id, Status.NOT_A_CONTACT, receiver_id)
+            return False
+        if await offline_queue.is_full(receiver_id):
+            log.warning("📪 Offline queue full", receiver_id=receiver_id)
+            await self.send_status_message(sender_id, Status.QUEUE_FULL, receiver_id)
+            return False
+
+        async def on_stored(success: bool):
+            if not success:
+                await self.send_status_message(sender_id, Status.QUEUE_FAILED, receiver_id)
+                return
+            await self.send_status_message(sender_id, Status.QUEUED_OFFLINE, receiver_id)
+            # They may have connected while the write was in flight
+            if receiver_id in self.sessions:
+                self._spawn(offline_queue.drain(receiver_id, self))
+
+        # The history copy is written now, so the queued copy carries its id and
+        # timestamp - the receiver sees both and has to know they are one message
+        message_doc = self._message_document(sender_id, receiver_id, frame)
+        pending = frame
+        if message_doc is not None:
+            message_doc["_id"] = ObjectId()
+            if frame.type == FrameType.ENCRYPTED_MESSAGE:
+                pending = frame.stamped(messageId=str(message_doc["_id"]), timestamp=message_doc["timestamp"].isoformat())
+
+        # Kept in the protocol it arrived in; the drain converts if the receiver differs
+        queued = offline_queue.enqueue(
+            receiver_id, sender_id, pending.encode(frame.protocol), frame.protocol, on_stored, self._relay_id(frame)
+        )
+        if not queued:
+            await self.send_status_message(sender_id, Status.QUEUE_FULL, receiver_id)
+            return False
+
+        if message_doc is not None:
+            self._save_message(sender_id, receiver_id, frame, message_doc)
+        return True
+
     async def broadcast_user_status(self, user_id: str, status: str):
-        """Broadcast user status to all paired users"""
-        paired_users = [uid for uid, paired_with in self.paired_users.items() if paired_with == user_id]
-        
-        for paired_user in paired_users:
-            await self.send_status_message(paired_user, f"👤 {user_id} is {status}")
+        """Broadcast user status to everyone paired with or following user_id"""
+        for watcher in self.graph.audience(user_id):
+            await self.send_status_message(watcher, Status.PEER_STATUS, user_id, status)
 
     def get_active_users(self) -> list:
         """Get list of currently active user IDs"""
-        return list(self.active_connections.keys())
+        return list(self.sessions)
+
+    def get_queue_stats(self) -> dict:
+        """Session and outbound queue counters for every local connection"""
+        return {user_id: session.stats() for user_id, session in self.sessions.items()}
 
     def is_user_online(self, user_id: str) -> bool:
-        """Check if a specific user is online"""
-        if user_id not in self.active_connections:
-            return False
-        
-        websocket = self.active_connections[user_id]
-        return websocket.client_state == WebSocketState.CONNECTED
+        """Check if a specific user is online on this or any other worker"""
+        session = self.sessions.get(user_id)
+        if session is None:
+            return user_id in self.remote_users
+        return session.websocket.client_state == WebSocketState.CONNECTED
 
     async def cleanup_stale_connections(self):
         """Clean up connections that are no longer active"""
-        stale_users = []
-        
-        for user_id, websocket in self.active_connections.items():
-            if websocket.client_state != WebSocketState.CONNECTED:
-                stale_users.append(user_id)
+        stale_users = [
+            user_id for user_id, session in self.sessions.items()
+            if session.websocket.client_state != WebSocketState.CONNECTED
+        ]
         
         for user_id in stale_users:
-            print(f"🧹 Cleaning up stale connection for {user_id}")
+            log.info("🧹 Cleaning up stale connection", user_id=user_id)
             self.disconnect(user_id)
 
-manager = ConnectionManager()
\ No newline at end of file
+manager = ConnectionManager()
+ws_connections.set_function(lambda: len(manager.sessions))
\ No newline at end of file
@@ -0,0 +1,113 @@
+import asyncio
+import random
+import time
+from typing import Optional
+from src.config import Config
+from src.ws.connection_manager import manager
+from src.utils.log import get_logger
+
+log = get_logger("ws.heartbeat")
+
+
+class HeartbeatScheduler:
+    """Single periodic task that owns heartbeats for every local socket.
+
+    The receive loops no longer run a timer per frame; they only stamp their
+    session's last_seen. Every tick (tick seconds, +/- jitter so workers don't
+    fire in lockstep) this walks the connections once: sockets silent for
+    ping_interval get a ping, sockets silent for idle_timeout are closed, and
+    connections whose socket already died are reaped. Clients answer pings
+    with a pong, which counts as traffic.
+    """
+
+    def __init__(
+        self,
+        manager,
+        tick: float = 5.0,
+        jitter: float = 0.2,
+        ping_interval: float = 25.0,
+        idle_timeout: float = 75.0,
+        yield_every: int = 1000,
+    ):
+        if idle_timeout and idle_timeout <= ping_interval:
+            raise ValueError("idle_timeout must be longer than ping_interval")
+        self.manager = manager
+        self.tick_interval = tick
+        self.jitter = jitter
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self.yield_every = yield_every
+        self._task: Optional[asyncio.Task] = None
+
+        # Stats
+        self.ticks = 0
+        self.pings = 0
+        self.idle_closed = 0
+        self.last_tick_duration = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def _next_delay(self) -> float:
+        return self.tick_interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self._next_delay())
+            try:
+                await self.tick()
+            except Exception:
+                log.exception("❌ Heartbeat tick failed")
+
+    async def tick(self):
+        """One pass over every local connection"""
+        started = time.monotonic()
+        await self.manager.cleanup_stale_connections()
+
+        now = time.monotonic()
+        for i, session in enumerate(list(self.manager.sessions.values())):
+            idle = now - session.last_seen
+            if self.idle_timeout and idle >= self.idle_timeout:
+                log.info("💤 Closing idle socket", user_id=session.user_id, idle_seconds=round(idle))
+                self.manager.close_idle(session.user_id)
+                self.idle_closed += 1
+            elif idle >= self.ping_interval and now - session.last_ping >= self.ping_interval:
+                if self.manager.send_ping(session.user_id):
+                    session.last_ping = now
+                    self.pings += 1
+
+            if (i + 1) % self.yield_every == 0:
+                # Let receive loops run between slices of a large pass
+                await asyncio.sleep(0)
+
+        self.ticks += 1
+        self.last_tick_duration = time.monotonic() - started
+
+    def stats(self) -> dict:
+        return {
+            "connections": len(self.manager.sessions),
+            "ticks": self.ticks,
+            "pings": self.pings,
+            "idle_closed": self.idle_closed,
+            "last_tick_duration": self.last_tick_duration,
+        }
+
+
+heartbeat = HeartbeatScheduler(
+    manager,
+    tick=Config.HEARTBEAT_TICK,
+    jitter=Config.HEARTBEAT_JITTER,
+    ping_interval=Config.HEARTBEAT_PING_INTERVAL,
+    idle_timeout=Config.HEARTBEAT_IDLE_TIMEOUT
+)
@@ -0,0 +1,199 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import Optional, Set, Tuple
+from pymongo import ASCENDING
+from src.config import Config
+from src.db.main import pending_messages
+from src.db.writer import MessageWriter, StoredCallback
+from src.ws.protocol import JSON, Data, Status, decode
+from src.utils.metrics import ws_frames_out
+from src.utils.log import get_logger
+
+log = get_logger("ws.offline")
+
+# How a drain pass ended
+DRAINED = "drained"
+GONE = "gone"
+BACKED_UP = "backed-up"
+
+
+class OfflineQueue:
+    """Store-and-forward queue for recipients that are not connected anywhere.
+
+    Frames for offline users are persisted as pending documents through a
+    write-behind writer. When the user connects, drain() streams them back in
+    order, batch_size documents at a time using a keyset cursor on
+    (created_at, _id), pushes each batch through the user's outbound queue and
+    deletes it once the writer confirms the batch was sent. A semaphore caps
+    how many drains run at once so a reconnect storm can't flood the loop.
+    When the outbound queue turns a frame away the pass stops there, keeping
+    order, and the drain is retried after retry_delay.
+    """
+
+    def __init__(
+        self,
+        collection,
+        batch_size: int = 50,
+        max_concurrent_drains: int = 32,
+        retry_delay: float = 1.0,
+        max_pending: int = 1000
+    ):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.max_pending = max_pending
+        self.writer = MessageWriter(
+            collection,
+            batch_size=Config.MESSAGE_FLUSH_BATCH_SIZE,
+            flush_interval=Config.MESSAGE_FLUSH_INTERVAL,
+            max_backlog=Config.MESSAGE_BACKLOG_MAX,
+            max_retries=Config.MESSAGE_FLUSH_MAX_RETRIES,
+            retry_base_delay=Config.MESSAGE_FLUSH_RETRY_DELAY,
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrent_drains)
+        self._draining: Set[str] = set()
+        self._drain_again: Set[str] = set()
+
+    async def start(self):
+        self.writer.start()
+
+    async def stop(self):
+        await self.writer.stop()
+
+    async def is_full(self, receiver_id: str) -> bool:
+        """Whether receiver_id already has max_pending messages waiting.
+
+        Counts what is in the collection, so frames still in the writer's buffer
+        can take a receiver slightly past the cap.
+        """
+        count = await self.collection.count_documents({"receiver_id": receiver_id}, limit=self.max_pending)
+        return count >= self.max_pending
+
+    def enqueue(
+        self,
+        receiver_id: str,
+        sender_id: str,
+        frame: Data,
+        protocol: str = JSON,
+        on_stored: Optional[StoredCallback] = None,
+        relay_id: Optional[str] = None
+    ) -> bool:
+        """Persist a frame, as sent in protocol, for later delivery; False if the backlog is full.
+
+        relay_id is the client id of a relay frame, so its delivery is acked the
+        same way as a live one.
+        """
+        doc = {
+            "receiver_id": receiver_id,
+            "sender_id": sender_id,
+            "frame": frame,
+            "protocol": protocol,
+            "created_at": datetime.now(timezone.utc)
+        }
+        if relay_id:
+            doc["relay_id"] = relay_id
+        return self.writer.put(doc, on_stored)
+
+    async def drain(self, user_id: str, manager) -> int:
+        """Deliver everything pending for user_id to their local connection"""
+        if user_id in self._draining:
+            # The running drain will pick up anything that was stored meanwhile
+            self._drain_again.add(user_id)
+            return 0
+
+        self._draining.add(user_id)
+        delivered = 0
+        outcome = DRAINED
+        try:
+            async with self._semaphore:
+                while True:
+                    self._drain_again.discard(user_id)
+                    sent, outcome = await self._drain_pass(user_id, manager)
+                    delivered += sent
+                    if outcome != DRAINED or user_id not in self._drain_again:
+                        break
+        except Exception:
+            log.exception("❌ Offline drain failed", user_id=user_id)
+        finally:
+            self._draining.discard(user_id)
+            self._drain_again.discard(user_id)
+
+        if delivered:
+            log.info("📬 Delivered pending messages", user_id=user_id, count=delivered)
+        if outcome == BACKED_UP:
+            # Still connected, just behind - let the outbound queue catch up first
+            log.debug("⏳ Offline drain backed up, retrying", user_id=user_id, delay=self.retry_delay)
+            asyncio.get_running_loop().call_later(self.retry_delay, lambda: manager._spawn(self.drain(user_id, manager)))
+        return delivered
+
+    async def _drain_pass(self, user_id: str, manager) -> Tuple[int, str]:
+        """One ordered pass over the pending documents: (delivered, how it ended)"""
+        loop = asyncio.get_running_loop()
+        projection = {"frame": 1, "protocol": 1, "sender_id": 1, "relay_id": 1, "created_at": 1}
+        sort = [("created_at", ASCENDING), ("_id", ASCENDING)]
+        last = None
+        delivered = 0
+
+        while True:
+            query = {"receiver_id": user_id}
+            if last:
+                query["$or"] = [
+                    {"created_at": {"$gt": last[0]}},
+                    {"created_at": last[0], "_id": {"$gt": last[1]}}
+                ]
+            batch = await self.collection.find(query, projection).sort(sort).limit(self.batch_size).to_list()
+            if not batch:
+                return delivered, DRAINED
+
+            session = manager.sessions.get(user_id)
+            if session is None:
+                return delivered, GONE
+            queue, protocol = session.queue, session.protocol
+
+            results = []
+            for doc in batch:
+                result = loop.create_future()
+
+                async def on_done(success: bool, result=result):
+                    result.set_result(success)
+
+                # Frames queued before the protocol field existed are JSON
+                stored_protocol = doc.get("protocol", JSON)
+                frame = doc["frame"]
+                if stored_protocol != protocol:
+                    frame = decode(stored_protocol, frame).encode(protocol)
+
+                if not queue.put(frame, on_done):
+                    # Queueing anything after this one would deliver out of order
+                    break
+                ws_frames_out.labels("offline-drain").inc()
+                results.append(result)
+
+            outcomes = await asyncio.gather(*results)
+            # A frame that failed to write fails everything queued behind it too
+            sent = [doc for doc, ok in zip(batch, outcomes) if ok]
+            if sent:
+                await self.collection.delete_many({"_id": {"$in": [doc["_id"] for doc in sent]}})
+                delivered += len(sent)
+                for doc in sent:
+                    if doc.get("relay_id"):
+                        await manager.send_status_message(doc["sender_id"], Status.RELAY_DELIVERED, doc["relay_id"])
+                    else:
+                        await manager.send_status_message(doc["sender_id"], Status.DELIVERED)
+
+            if len(sent) < len(batch):
+                # The rest stays pending: for the next connection if this one is gone,
+                # or for a retry once the outbound queue has room again
+                if manager.sessions.get(user_id) is not session or queue.closed:
+                    return delivered, GONE
+                return delivered, BACKED_UP
+            last = (batch[-1]["created_at"], batch[-1]["_id"])
+
+
+offline_queue = OfflineQueue(
+    pending_messages,
+    batch_size=Config.OFFLINE_DRAIN_BATCH_SIZE,
+    max_concurrent_drains=Config.OFFLINE_MAX_CONCURRENT_DRAINS,
+    retry_delay=Config.OFFLINE_DRAIN_RETRY_DELAY,
+    max_pending=Config.OFFLINE_MAX_PENDING_PER_RECEIVER
+)
@@ -0,0 +1,181 @@
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Optional, Tuple
+from fastapi import WebSocket
+from src.ws.protocol import Data, send_frame
+from src.config import Config
+from src.utils.log import get_logger
+
+log = get_logger("ws.outbound")
+
+# on_done(success) is awaited by the writer once a frame was sent or given up on
+DoneCallback = Callable[[bool], Awaitable[None]]
+
+DROP = "drop"
+DISCONNECT = "disconnect"
+
+
+class OutboundQueue:
+    """Bounded per-connection send queue drained by its own writer task.
+
+    Callers never await the socket: put() only appends, so a slow receiver can
+    no longer stall the sender's receive loop. Once the depth reaches the high
+    watermark the queue is congested until it drains below the low watermark.
+    While congested, droppable frames (status updates) are discarded, and a full
+    queue or a congestion that outlasts stall_timeout is handled by the policy:
+    "drop" rejects new frames, "disconnect" kicks the slow peer.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        user_id: str,
+        max_size: int = 256,
+        high_watermark: int = 192,
+        low_watermark: int = 64,
+        policy: str = DROP,
+        stall_timeout: float = 30.0,
+        on_overflow: Optional[Callable[[str], None]] = None,
+        on_error: Optional[Callable[[str], None]] = None,
+    ):
+        if not 0 <= low_watermark < high_watermark <= max_size:
+            raise ValueError("Expected 0 <= low_watermark < high_watermark <= max_size")
+        if policy not in (DROP, DISCONNECT):
+            raise ValueError(f"Unknown overflow policy: {policy}")
+
+        self.websocket = websocket
+        self.user_id = user_id
+        self.max_size = max_size
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.policy = policy
+        self.stall_timeout = stall_timeout
+        self.on_overflow = on_overflow
+        self.on_error = on_error
+
+        self._items: Deque[Tuple[Data, Optional[DoneCallback]]] = deque()
+        self._wakeup = asyncio.Event()
+        self._closed = False
+        self._congested_since: Optional[float] = None
+        self._writer = asyncio.create_task(self._run())
+
+        # Stats
+        self.enqueued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._items)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def congested(self) -> bool:
+        return self._congested_since is not None
+
+    def put(self, data: Data, on_done: Optional[DoneCallback] = None, droppable: bool = False) -> bool:
+        """Queue a frame for sending; False if it was dropped"""
+        if self._closed:
+            return False
+
+        if self.congested:
+            if droppable:
+                self.dropped += 1
+                return False
+            if time.monotonic() - self._congested_since > self.stall_timeout:
+                return self._overflow(f"stalled for more than {self.stall_timeout}s")
+
+        if len(self._items) >= self.max_size:
+            return self._overflow("queue full")
+
+        self._items.append((data, on_done))
+        self.enqueued += 1
+        depth = len(self._items)
+        if depth > self.max_depth:
+            self.max_depth = depth
+        if depth >= self.high_watermark and not self.congested:
+            self._congested_since = time.monotonic()
+            log.warning("⏳ Outbound queue congested", user_id=self.user_id, depth=depth)
+        self._wakeup.set()
+        return True
+
+    def _overflow(self, reason: str) -> bool:
+        self.dropped += 1
+        if self.policy == DISCONNECT:
+            log.warning("🚫 Disconnecting slow consumer", user_id=self.user_id, reason=reason)
+            if self.on_overflow:
+                self.on_overflow(self.user_id)
+        else:
+            log.warning("🗑️ Dropping frame for slow consumer", user_id=self.user_id, reason=reason, sample=Config.LOG_SAMPLE_RATE)
+        return False
+
+    async def _run(self):
+        while True:
+            if not self._items:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            data, on_done = self._items.popleft()
+            if self.congested and len(self._items) <= self.low_watermark:
+                self._congested_since = None
+
+            try:
+                await send_frame(self.websocket, data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("❌ Writer failed", user_id=self.user_id, error=e)
+                if on_done:
+                    await self._notify(on_done, False)
+                await self._fail_pending()
+                if self.on_error:
+                    self.on_error(self.user_id)
+                return
+
+            self.sent += 1
+            if on_done:
+                await self._notify(on_done, True)
+
+    async def _notify(self, on_done: DoneCallback, success: bool):
+        try:
+            await on_done(success)
+        except Exception:
+            log.exception("⚠️ Outbound callback failed", user_id=self.user_id)
+
+    async def _fail_pending(self):
+        pending, self._items = self._items, deque()
+        self._closed = True
+        for _, on_done in pending:
+            if on_done:
+                await self._notify(on_done, False)
+
+    def close(self):
+        """Stop the writer; frames still queued are reported as failed"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        pending, self._items = self._items, deque()
+        callbacks = [on_done for _, on_done in pending if on_done]
+        if callbacks:
+            async def fail_all():
+                for on_done in callbacks:
+                    await self._notify(on_done, False)
+            asyncio.create_task(fail_all())
+
+    def stats(self) -> dict:
+        return {
+            "depth": len(self._items),
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "congested": self.congested,
+        }
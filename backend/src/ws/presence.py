@@ -0,0 +1,125 @@
+import asyncio
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+from src.utils.log import get_logger
+
+log = get_logger("ws.presence")
+
+ONLINE = "online"
+OFFLINE = "offline"
+
+# watcher -> {user_id: (status, watcher is paired with user_id)}
+PresenceBatch = Dict[str, Dict[str, Tuple[str, bool]]]
+
+
+class PresenceGraph:
+    """Pairings and presence watchers as adjacency maps.
+
+    pairs:     user -> the peer they are currently paired with (forward edge)
+    paired_by: user -> users currently paired with them (reverse edges)
+    watchers:  user -> local users who have them as a contact
+
+    Every update only touches the edges of the users involved, so dropping a
+    user or finding who to tell about them costs O(degree), not a scan over
+    every pairing. Empty sets are removed so departed users leave nothing behind.
+    """
+
+    def __init__(self):
+        self.pairs: Dict[str, str] = {}
+        self.paired_by: Dict[str, Set[str]] = {}
+        self.watchers: Dict[str, Set[str]] = {}
+
+    @staticmethod
+    def _unlink(index: Dict[str, Set[str]], key: str, member: str):
+        members = index.get(key)
+        if members is not None:
+            members.discard(member)
+            if not members:
+                del index[key]
+
+    def pair(self, user_id: str, peer_id: str):
+        previous = self.pairs.get(user_id)
+        if previous == peer_id:
+            return
+        if previous is not None:
+            self._unlink(self.paired_by, previous, user_id)
+        self.pairs[user_id] = peer_id
+        self.paired_by.setdefault(peer_id, set()).add(user_id)
+
+    def peer_of(self, user_id: str) -> Optional[str]:
+        return self.pairs.get(user_id)
+
+    def is_mutual(self, user1_id: str, user2_id: str) -> bool:
+        return self.pairs.get(user1_id) == user2_id and self.pairs.get(user2_id) == user1_id
+
+    def drop_pairings(self, user_id: str):
+        """Remove every pairing involving user_id, in either direction"""
+        peer = self.pairs.pop(user_id, None)
+        if peer is not None:
+            self._unlink(self.paired_by, peer, user_id)
+        for other in self.paired_by.pop(user_id, ()):
+            self.pairs.pop(other, None)
+
+    def watch(self, user_id: str, contacts: Iterable[str]):
+        for contact in contacts:
+            self.watchers.setdefault(contact, set()).add(user_id)
+
+    def unwatch(self, user_id: str, contacts: Iterable[str]):
+        for contact in contacts:
+            self._unlink(self.watchers, contact, user_id)
+
+    def audience(self, user_id: str) -> Set[str]:
+        """Local users who should hear when user_id comes or goes"""
+        return self.paired_by.get(user_id, set()) | self.watchers.get(user_id, set())
+
+    def stats(self) -> dict:
+        return {
+            "pairings": len(self.pairs),
+            "watched_users": len(self.watchers),
+            "watch_edges": sum(len(w) for w in self.watchers.values()),
+        }
+
+
+class PresenceBatcher:
+    """Collects presence changes per watcher and hands them over once per window.
+
+    A user flapping inside one window only shows up with their latest state,
+    and each watcher gets a single update per window however many of their
+    contacts changed - so a mass reconnect costs one frame per watcher per
+    window instead of one per (watcher, contact) pair.
+    """
+
+    def __init__(self, window: float, flush: Callable[[PresenceBatch], None]):
+        self.window = window
+        self.flush = flush
+        self._pending: PresenceBatch = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+        # Stats
+        self.changes = 0
+        self.flushes = 0
+
+    def add(self, watcher: str, user_id: str, status: str, paired: bool):
+        self._pending.setdefault(watcher, {})[user_id] = (status, paired)
+        self.changes += 1
+        if self._timer is None:
+            try:
+                self._timer = asyncio.get_running_loop().call_later(self.window, self._run)
+            except RuntimeError:
+                # No loop (e.g. at import time) - nobody is connected to tell anyway
+                self._pending.clear()
+
+    def _run(self):
+        self._timer = None
+        batch, self._pending = self._pending, {}
+        self.flushes += 1
+        try:
+            self.flush(batch)
+        except Exception:
+            log.exception("❌ Presence flush failed")
+
+    def stats(self) -> dict:
+        return {
+            "pending_watchers": len(self._pending),
+            "changes": self.changes,
+            "flushes": self.flushes,
+        }
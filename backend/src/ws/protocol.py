@@ -0,0 +1,435 @@
+"""Wire formats for the chat socket.
+
+Clients that offer the "qchat.bin.v1" subprotocol get binary frames; everyone
+else keeps the original JSON text frames and "STATUS:..." strings.
+
+A binary frame is a small header followed by length-prefixed fields, all
+integers big-endian:
+
+    u8  version (1)
+    u8  frame type            (FrameType)
+    then, until the end of the frame:
+    u8  field id              (Field)
+    u32 length
+    ... length bytes
+
+Ciphertext, encrypted body, IV and signature travel as raw bytes instead of
+base64, ids and status arguments as UTF-8. Status updates are a STATUS frame
+carrying a numeric code plus its arguments, so clients can localise them.
+
+RELAY frames are the passthrough mode: a to/from/id header plus an opaque
+body the server never looks inside. Binary relays put the body field last;
+JSON relays are a one-line header object, a newline, then the body as
+base64 text. Either way only the header is parsed, and the original frame is
+what gets forwarded and stored.
+
+Messages held for an offline receiver are stored in history as they are
+queued, and the queued copy carries that record's messageId and server
+timestamp, so a client that also reads history can tell the two are one.
+
+After a PRESENCE_SUBSCRIBE the server pushes PRESENCE frames: coalesced lists
+of contacts that came online / went offline (comma-separated ids in binary).
+The first one after subscribing is a snapshot of every contact.
+"""
+import base64
+import binascii
+import json
+import struct
+from enum import IntEnum
+from typing import Dict, Iterable, List, Optional, Union
+from fastapi import WebSocket
+
+JSON = "json"
+BINARY = "binary"
+BINARY_SUBPROTOCOL = "qchat.bin.v1"
+
+VERSION = 1
+
+# What actually goes over the socket: text for JSON, bytes for binary
+Data = Union[str, bytes]
+
+
+class ProtocolError(ValueError):
+    """A frame that can't be parsed"""
+
+
+class FrameType(IntEnum):
+    ENCRYPTED_MESSAGE = 1
+    PAIR = 2
+    PING = 3
+    PONG = 4
+    STATUS = 5
+    RELAY = 6
+    PRESENCE = 7
+    PRESENCE_SUBSCRIBE = 8
+    PRESENCE_UNSUBSCRIBE = 9
+
+
+class Field(IntEnum):
+    TO = 1
+    FROM = 2
+    CIPHERTEXT = 3
+    ENCRYPTED_MESSAGE = 4
+    IV = 5
+    SIGNATURE = 6
+    CODE = 7
+    ARG = 8
+    ID = 9
+    BODY = 10
+    ONLINE = 11
+    OFFLINE = 12
+    MESSAGE_ID = 13
+    TIMESTAMP = 14
+
+
+# JSON "type" values and keys for the binary ids
+TYPE_NAMES: Dict[FrameType, str] = {
+    FrameType.ENCRYPTED_MESSAGE: "encrypted-message",
+    FrameType.PAIR: "pair",
+    FrameType.PING: "ping",
+    FrameType.PONG: "pong",
+    FrameType.RELAY: "relay",
+    FrameType.PRESENCE: "presence",
+    FrameType.PRESENCE_SUBSCRIBE: "presence-subscribe",
+    FrameType.PRESENCE_UNSUBSCRIBE: "presence-unsubscribe",
+}
+TYPES_BY_NAME: Dict[str, FrameType] = {name: frame_type for frame_type, name in TYPE_NAMES.items()}
+
+FIELD_NAMES: Dict[Field, str] = {
+    Field.TO: "to",
+    Field.FROM: "from",
+    Field.CIPHERTEXT: "ciphertext",
+    Field.ENCRYPTED_MESSAGE: "encryptedMessage",
+    Field.IV: "iv",
+    Field.SIGNATURE: "signature",
+    Field.ID: "id",
+    Field.MESSAGE_ID: "messageId",
+    Field.TIMESTAMP: "timestamp",
+    # Keep last: header fields come first so relays are routed without walking the body
+    Field.BODY: "body",
+}
+FIELDS_BY_NAME: Dict[str, Field] = {name: field for field, name in FIELD_NAMES.items()}
+
+# Raw bytes on the binary wire, base64 strings in JSON and in the database
+BYTES_FIELDS = frozenset({"ciphertext", "encryptedMessage", "iv", "signature", "body"})
+
+# Routing header of a relay frame
+RELAY_HEADER = ("to", "from", "id")
+
+
+class Status(IntEnum):
+    # 1-99: informational
+    CONNECTED = 1
+    DELIVERED = 2
+    STORED = 3
+    QUEUED_OFFLINE = 4
+    PAIRED = 5
+    PEER_STATUS = 6
+    RELAY_DELIVERED = 7
+    RELAY_STORED = 8
+    NOT_STORED = 50
+    # 100+: errors
+    UNAUTHORIZED = 100
+    UNKNOWN_TYPE = 101
+    INVALID_FORMAT = 102
+    PROCESSING_ERROR = 103
+    MISSING_FIELDS = 104
+    SENDER_MISMATCH = 105
+    MISSING_RECIPIENT = 106
+    NO_RECEIVER = 107
+    DELIVERY_FAILED = 108
+    HANDLING_ERROR = 109
+    PEER_OFFLINE = 110
+    PEER_DISCONNECTED = 111
+    PEER_SLOW = 112
+    PEER_GONE = 113
+    SEND_ERROR = 114
+    QUEUE_FAILED = 115
+    QUEUE_FULL = 116
+    PAIR_MISSING_PEER = 117
+    PEER_NOT_ONLINE = 118
+    PAIRING_ERROR = 119
+    NOT_A_CONTACT = 120
+
+
+# The JSON protocol's STATUS: strings, {} filled from the status arguments
+STATUS_TEXT: Dict[Status, str] = {
+    Status.CONNECTED: "✅ Connected successfully",
+    Status.DELIVERED: "✅ Message delivered",
+    Status.STORED: "💾 Message stored",
+    Status.QUEUED_OFFLINE: "📥 User {} is offline, message queued",
+    Status.PAIRED: "🔐 Paired with {}",
+    Status.PEER_STATUS: "👤 {} is {}",
+    Status.RELAY_DELIVERED: "✅ Message {} delivered",
+    Status.RELAY_STORED: "💾 Message {} stored",
+    Status.NOT_STORED: "⚠️ Message delivered but not stored",
+    Status.UNAUTHORIZED: "❌ Unauthorized - Please log in",
+    Status.UNKNOWN_TYPE: "❌ Unknown message type",
+    Status.INVALID_FORMAT: "❌ Invalid message format",
+    Status.PROCESSING_ERROR: "❌ Message processing error",
+    Status.MISSING_FIELDS: "❌ Missing fields: {}",
+    Status.SENDER_MISMATCH: "❌ Sender ID mismatch",
+    Status.MISSING_RECIPIENT: "❌ Missing recipient",
+    Status.NO_RECEIVER: "❌ No receiver specified",
+    Status.DELIVERY_FAILED: "❌ Failed to deliver message",
+    Status.HANDLING_ERROR: "❌ Message handling error",
+    Status.PEER_OFFLINE: "❌ User {} is offline",
+    Status.PEER_DISCONNECTED: "❌ User {} disconnected",
+    Status.PEER_SLOW: "❌ Delivery failed: {} is not keeping up",
+    Status.PEER_GONE: "❌ Delivery failed: {} disconnected",
+    Status.SEND_ERROR: "❌ Delivery failed: {}",
+    Status.QUEUE_FAILED: "❌ Could not queue message for {}",
+    Status.QUEUE_FULL: "❌ User {} is offline and their queue is full",
+    Status.PAIR_MISSING_PEER: "❌ Missing 'to' field in pair request",
+    Status.PEER_NOT_ONLINE: "❌ User {} is not online",
+    Status.PAIRING_ERROR: "❌ Pairing error",
+    Status.NOT_A_CONTACT: "❌ User {} is not one of your contacts",
+}
+
+_HEADER = struct.Struct(">BB")
+_FIELD = struct.Struct(">BI")
+_CODE = struct.Struct(">H")
+
+
+def negotiate(offered: Iterable[str]) -> str:
+    """Pick the protocol from the client's Sec-WebSocket-Protocol offer"""
+    return BINARY if BINARY_SUBPROTOCOL in offered else JSON
+
+
+def _pack(frame_type: int, fields: Iterable[tuple]) -> bytes:
+    parts = [_HEADER.pack(VERSION, frame_type)]
+    for field, value in fields:
+        parts.append(_FIELD.pack(field, len(value)))
+        parts.append(value)
+    return b"".join(parts)
+
+
+def _unpack(data: bytes):
+    if len(data) < _HEADER.size:
+        raise ProtocolError("Frame too short")
+    version, frame_type = _HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ProtocolError(f"Unsupported frame version {version}")
+
+    view = memoryview(data)
+    offset = _HEADER.size
+    fields = []
+    while offset < len(data):
+        if offset + _FIELD.size > len(data):
+            raise ProtocolError("Truncated field header")
+        field, length = _FIELD.unpack_from(data, offset)
+        offset += _FIELD.size
+        if offset + length > len(data):
+            raise ProtocolError("Truncated field value")
+        fields.append((field, view[offset:offset + length]))
+        offset += length
+    return frame_type, fields
+
+
+class Frame:
+    """One client frame, in whichever protocol it arrived.
+
+    fields holds the JSON-style keys ("to", "ciphertext", ...). Byte fields are
+    zero-copy views into the frame when it came in binary and base64 strings
+    when it came in as JSON; b64() and raw_bytes() give either form. raw keeps
+    the original frame so forwarding to a peer on the same protocol costs no
+    re-encoding. A JSON relay body is only sliced out of raw when asked for.
+    """
+
+    __slots__ = ("type", "fields", "protocol", "raw", "body_at")
+
+    def __init__(
+        self,
+        frame_type: Optional[FrameType],
+        fields: dict,
+        protocol: str,
+        raw: Optional[Data] = None,
+        body_at: Optional[int] = None
+    ):
+        self.type = frame_type
+        self.fields = fields
+        self.protocol = protocol
+        self.raw = raw
+        self.body_at = body_at
+
+    def get(self, name: str):
+        if name == "body" and self.body_at is not None:
+            return self.raw[self.body_at:]
+        return self.fields.get(name)
+
+    def has_body(self) -> bool:
+        """Whether a relay carries a body, without slicing a JSON one out of raw"""
+        if self.body_at is not None:
+            return len(self.raw) > self.body_at
+        return self.fields.get("body") is not None
+
+    def stamped(self, **fields) -> "Frame":
+        """A copy with extra fields set; it is re-encoded rather than forwarded as raw"""
+        return Frame(self.type, {**self.fields, **fields}, self.protocol)
+
+    def b64(self, name: str) -> Optional[str]:
+        value = self.get(name)
+        if isinstance(value, (bytes, memoryview)):
+            return base64.b64encode(value).decode()
+        return value
+
+    def raw_bytes(self, name: str) -> Optional[bytes]:
+        value = self.get(name)
+        if isinstance(value, str):
+            try:
+                return base64.b64decode(value, validate=True)
+            except binascii.Error:
+                raise ProtocolError(f"Field {name} is not valid base64")
+        return value
+
+    def encode(self, protocol: str) -> Data:
+        """The frame as it goes out to a client speaking protocol"""
+        if protocol == self.protocol and self.raw is not None:
+            return self.raw
+        if protocol == BINARY:
+            fields = []
+            for name, field in FIELDS_BY_NAME.items():
+                if self.get(name) is None:
+                    continue
+                if name in BYTES_FIELDS:
+                    fields.append((field, self.raw_bytes(name)))
+                else:
+                    fields.append((field, str(self.fields[name]).encode()))
+            return _pack(self.type, fields)
+
+        if self.type == FrameType.RELAY:
+            header = {"type": TYPE_NAMES[FrameType.RELAY]}
+            header.update((name, self.fields[name]) for name in RELAY_HEADER if self.fields.get(name) is not None)
+            return json.dumps(header) + "\n" + (self.b64("body") or "")
+
+        payload = {"type": TYPE_NAMES.get(self.type)}
+        for name in FIELDS_BY_NAME:
+            if self.get(name) is not None:
+                payload[name] = self.b64(name)
+        return json.dumps(payload)
+
+
+_json_decoder = json.JSONDecoder()
+
+
+def decode_json(text: str) -> Frame:
+    # raw_decode, unlike loads, won't skip leading whitespace; lstrip returns text
+    # itself when there is none, so the common case copies nothing
+    text = text.lstrip()
+    try:
+        # raw_decode stops at the end of the first object, so a relay's body is never scanned
+        data, end = _json_decoder.raw_decode(text)
+    except json.JSONDecodeError as e:
+        raise ProtocolError(str(e))
+    if not isinstance(data, dict):
+        raise ProtocolError("Expected a JSON object")
+
+    frame_type = TYPES_BY_NAME.get(data.get("type"))
+    if frame_type == FrameType.RELAY:
+        if text[end:end + 1] != "\n":
+            raise ProtocolError("Relay header must be followed by a newline and the body")
+        return Frame(frame_type, data, JSON, text, body_at=end + 1)
+    if text[end:].strip():
+        raise ProtocolError("Extra data after JSON object")
+    return Frame(frame_type, data, JSON, text)
+
+
+def decode_binary(data: bytes) -> Frame:
+    frame_type, raw_fields = _unpack(data)
+    fields = {}
+    for field, value in raw_fields:
+        if field == Field.CODE:
+            if len(value) != _CODE.size:
+                raise ProtocolError("Status code field must be 2 bytes")
+            fields["code"] = _CODE.unpack(value)[0]
+            continue
+        if field == Field.ARG:
+            fields.setdefault("args", []).append(str(value, "utf-8", "replace"))
+            continue
+        if field in (Field.ONLINE, Field.OFFLINE):
+            ids = str(value, "utf-8", "replace")
+            fields["online" if field == Field.ONLINE else "offline"] = ids.split(",") if ids else []
+            continue
+        name = FIELD_NAMES.get(field)
+        if name is None:
+            # Unknown fields are skipped so newer clients can add some
+            continue
+        if name in BYTES_FIELDS:
+            fields[name] = value
+        else:
+            try:
+                fields[name] = str(value, "utf-8")
+            except UnicodeDecodeError:
+                raise ProtocolError(f"Field {name} is not valid UTF-8")
+    try:
+        frame_type = FrameType(frame_type)
+    except ValueError:
+        frame_type = None
+    return Frame(frame_type, fields, BINARY, data)
+
+
+def decode(protocol: str, data: Data) -> Frame:
+    """Parse a stored or routed frame that was sent in protocol"""
+    return decode_binary(data) if protocol == BINARY else decode_json(data)
+
+
+def decode_message(message: dict) -> Frame:
+    """Parse an ASGI websocket.receive message; either protocol may send text"""
+    if message.get("bytes") is not None:
+        return decode_binary(message["bytes"])
+    if message.get("text") is not None:
+        return decode_json(message["text"])
+    raise ProtocolError("Empty frame")
+
+
+def status_text(code: Status, *args) -> str:
+    return STATUS_TEXT[code].format(*args)
+
+
+def encode_status(protocol: str, code: Status, *args) -> Data:
+    if protocol == BINARY:
+        fields = [(Field.CODE, _CODE.pack(code))]
+        fields.extend((Field.ARG, str(arg).encode()) for arg in args)
+        return _pack(FrameType.STATUS, fields)
+    return "STATUS:" + status_text(code, *args)
+
+
+def encode_presence(protocol: str, online: List[str], offline: List[str]) -> Data:
+    if protocol == BINARY:
+        return _pack(FrameType.PRESENCE, [
+            (Field.ONLINE, ",".join(online).encode()),
+            (Field.OFFLINE, ",".join(offline).encode()),
+        ])
+    return json.dumps({"type": TYPE_NAMES[FrameType.PRESENCE], "online": online, "offline": offline})
+
+
+def encode_control(protocol: str, frame_type: FrameType) -> Data:
+    """ping / pong"""
+    if protocol == BINARY:
+        return _HEADER.pack(VERSION, frame_type)
+    return json.dumps({"type": TYPE_NAMES[frame_type]})
+
+
+def pack_frame(frame: Frame) -> dict:
+    """JSON-safe form of a frame for the backplane"""
+    raw = frame.encode(frame.protocol)
+    if isinstance(raw, bytes):
+        raw = base64.b64encode(raw).decode()
+    return {"protocol": frame.protocol, "data": raw}
+
+
+def unpack_frame(packed: dict) -> Frame:
+    if packed["protocol"] == BINARY:
+        try:
+            data = base64.b64decode(packed["data"], validate=True)
+        except binascii.Error:
+            raise ProtocolError("Routed frame is not valid base64")
+        return decode_binary(data)
+    return decode_json(packed["data"])
+
+
+async def send_frame(websocket: WebSocket, data: Data):
+    if isinstance(data, bytes):
+        await websocket.send_bytes(data)
+    else:
+        await websocket.send_text(data)
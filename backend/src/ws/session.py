@@ -0,0 +1,48 @@
+import time
+from datetime import datetime, timezone
+from typing import Iterable
+from fastapi import WebSocket
+from src.ws.outbound import OutboundQueue
+
+
+class Session:
+    """Everything the manager keeps about one local connection.
+
+    Slotted because a worker holds one of these per connected user; tens of
+    thousands of them shouldn't each carry a dict.
+    """
+
+    __slots__ = (
+        "user_id", "websocket", "queue", "protocol", "contacts",
+        "connected_at", "last_seen", "last_ping", "frames_in", "presence",
+    )
+
+    def __init__(self, user_id: str, websocket: WebSocket, queue: OutboundQueue, protocol: str, contacts: Iterable[str] = ()):
+        self.user_id = user_id
+        self.websocket = websocket
+        self.queue = queue
+        self.protocol = protocol
+        # Users whose presence this user follows (their connections)
+        self.contacts = set(contacts)
+        self.connected_at = datetime.now(timezone.utc)
+        # Monotonic times for the heartbeat
+        self.last_seen = time.monotonic()
+        self.last_ping = 0.0
+        self.frames_in = 0
+        # Subscribed to presence diffs for their contacts
+        self.presence = False
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+        self.frames_in += 1
+
+    def stats(self) -> dict:
+        return {
+            "protocol": self.protocol,
+            "connected_at": self.connected_at.isoformat(),
+            "idle": time.monotonic() - self.last_seen,
+            "frames_in": self.frames_in,
+            "contacts": len(self.contacts),
+            "presence": self.presence,
+            **self.queue.stats(),
+        }
@@ -1,6 +1,7 @@
 import { useChatStore } from "../context/useChatStore";
 import { useState, useEffect } from "react";
 import axios from "axios";
+import { prefetchKeys } from "../utils/keyDirectory";
 import { Users, MessageCircle, Shield, Search, X, LogOut } from "lucide-react";
 
 export default function ChatSidebar({ onSelectUser }) {
@@ -16,8 +17,22 @@ export default function ChatSidebar({ onSelectUser }) {
   useEffect(() => {
     const fetchConnections = async () => {
       try {
-        const res = await axios.get("/api/v1/user/connections", { withCredentials: true });
-        setConnections(res.data); // expects [{ user_id, username }]
+        // Paged as { connections: [{ user_id, username }], next_cursor } - show each page as it lands
+        let cursor = null;
+        let loaded = [];
+        do {
+          const res = await axios.get("/api/v1/user/connections", {
+            params: cursor ? { cursor } : {},
+            withCredentials: true,
+          });
+          loaded = loaded.concat(res.data.connections);
+          setConnections(loaded);
+          // One batch key request per page instead of one per chat opened
+          prefetchKeys(res.data.connections.map((c) => c.user_id)).catch((err) =>
+            console.error("Failed to prefetch public keys", err)
+          );
+          cursor = res.data.next_cursor;
+        } while (cursor);
       } catch (err) {
         console.error("Failed to fetch connections", err);
       }
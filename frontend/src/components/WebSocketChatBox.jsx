@@ -7,6 +7,30 @@ import {
   decryptMessage, // Keep as fallback
 } from "../utils/crypto";
 import { chatStorage } from "../utils/chatStorage";
+import { getPeerKeys } from "../utils/keyDirectory";
+
+// Merge local and server messages, remove duplicates, and sort by time
+function mergeMessages(existing, incoming) {
+  const allMessages = [...existing];
+  
+  for (const serverMsg of incoming) {
+    // Check if this server message is already in local messages
+    const isDuplicate = allMessages.some(localMsg => 
+      (serverMsg.serverId && localMsg.serverId === serverMsg.serverId) ||
+      Math.abs(new Date(localMsg.timestamp) - new Date(serverMsg.timestamp)) < 1000 &&
+      localMsg.text === serverMsg.text &&
+      localMsg.sender === serverMsg.sender
+    );
+    
+    if (!isDuplicate) {
+      allMessages.push(serverMsg);
+    }
+  }
+
+  // Final sort by timestamp
+  allMessages.sort((a, b) => new Date(a.timestamp) - new Date(b.timestamp));
+  return allMessages;
+}
 
 export default function WebSocketChatBox({ peer }) {
   const { user } = useAuthStore();
@@ -25,9 +49,13 @@ export default function WebSocketChatBox({ peer }) {
   const [isConnecting, setIsConnecting] = useState(false);
   const [dbInitialized, setDbInitialized] = useState(false);
   const [isUserOnline, setIsUserOnline] = useState(true); // New state for online status
+  const [historyCursor, setHistoryCursor] = useState(null); // next_cursor of the oldest page loaded
+  const [loadingOlder, setLoadingOlder] = useState(false);
   
   const socket = useRef(null);
   const scrollRef = useRef();
+  const keepScrollRef = useRef(false); // Set while prepending older history
+  const peerDilithiumKeyRef = useRef(null);
   const reconnectTimeoutRef = useRef(null);
   const reconnectAttempts = useRef(0);
   const maxReconnectAttempts = 5;
@@ -122,33 +150,28 @@ export default function WebSocketChatBox({ peer }) {
   // Updated function to fetch both Kyber and Dilithium public keys
   const fetchPeerPublicKeys = useCallback(async (peerId) => {
     try {
-      const res = await fetch(`https://quantumchattingapp-backend.onrender.com/api/v1/user/keys/${peerId}`, {
-        credentials: "include",
-      });
-      if (!res.ok) {
-        throw new Error(`Failed to fetch peer public keys: ${res.status}`);
-      }
-      const data = await res.json();
+      // Served from the batch-loaded key directory; only unknown peers cost a request
+      const data = await getPeerKeys(peerId);
       
-      if (!data.kyber_public_key) {
+      if (!data.kyberPublicKey) {
         throw new Error("No kyberPublicKey found in response");
       }
       
-      if (!data.dilithium_public_key) {
+      if (!data.dilithiumPublicKey) {
         throw new Error("No dilithiumPublicKey found in response");
       }
       
       // Validate Base64 strings
       try {
-        atob(data.kyber_public_key);
-        atob(data.dilithium_public_key);
+        atob(data.kyberPublicKey);
+        atob(data.dilithiumPublicKey);
       } catch (base64Error) {
         throw new Error(`Invalid Base64 public keys: ${base64Error.message}`);
       }
       
       return {
-        kyberPublicKey: data.kyber_public_key,
-        dilithiumPublicKey: data.dilithium_public_key
+        kyberPublicKey: data.kyberPublicKey,
+        dilithiumPublicKey: data.dilithiumPublicKey
       };
     } catch (error) {
       console.error("❌ Error fetching peer public keys:", error);
@@ -156,6 +179,132 @@ export default function WebSocketChatBox({ peer }) {
     }
   }, []);
 
+  // Decrypt one page of server history and store newly seen messages locally
+  const processServerMessages = useCallback(async (serverData, peerDilithiumPublicKey) => {
+    const serverMessages = [];
+    
+    for (const msg of serverData) {
+      try {
+        const isMyMessage = msg.sender_id === user._id;
+        const messageTimestamp = msg.timestamp;
+        
+        // Check if we already have this message locally
+        const alreadyExists = await chatStorage.messageExists(
+          chatId, 
+          messageTimestamp, 
+          msg.sender_id, 
+          msg.encrypted_message || msg.message
+        );
+        
+        if (alreadyExists) {
+          console.log("⏭️ Message already exists locally, skipping");
+          continue;
+        }
+
+        let messageText;
+        let signatureVerified = null;
+
+        if (msg.message_type === "encrypted" && msg.ciphertext && msg.encrypted_message && msg.iv) {
+          if (isMyMessage) {
+            // For your own messages from server, show as sent (you can't decrypt them)
+            console.log("📤 Found your encrypted message on server");
+            continue;
+          } else {
+            // Decrypt received messages with signature verification if available
+            if (msg.signature && peerDilithiumPublicKey) {
+              try {
+                const result = await decryptAndVerifyMessage({
+                  kyberPrivateKeyBase64: kyberPrivateKey,
+                  kyberCiphertextBase64: msg.ciphertext,
+                  encryptedMessageBase64: msg.encrypted_message,
+                  ivBase64: msg.iv,
+                  signature: msg.signature,
+                  dilithiumPublicKeyBase64: peerDilithiumPublicKey,
+                });
+                messageText = result.message;
+                signatureVerified = result.signatureValid;
+              } catch (sigError) {
+                console.warn("⚠️ Signature verification failed, falling back to regular decryption:", sigError);
+                messageText = await decryptMessage({
+                  kyberPrivateKeyBase64: kyberPrivateKey,
+                  kyberCiphertextBase64: msg.ciphertext,
+                  encryptedMessageBase64: msg.encrypted_message,
+                  ivBase64: msg.iv,
+                });
+                signatureVerified = false;
+              }
+            } else {
+              // Regular decryption for messages without signatures
+              messageText = await decryptMessage({
+                kyberPrivateKeyBase64: kyberPrivateKey,
+                kyberCiphertextBase64: msg.ciphertext,
+                encryptedMessageBase64: msg.encrypted_message,
+                ivBase64: msg.iv,
+              });
+            }
+            
+            // Store decrypted message locally
+            await chatStorage.storeReceivedMessage(
+              chatId,
+              {
+                message: messageText,
+                ciphertext: msg.ciphertext,
+                encryptedMessage: msg.encrypted_message,
+                iv: msg.iv,
+                signature: msg.signature,
+                signatureVerified: signatureVerified,
+              },
+              messageTimestamp,
+              msg.sender_id,
+              msg.receiver_id
+            );
+            console.log("📥 Stored new received message locally");
+          }
+        } else if (msg.message) {
+          messageText = msg.message;
+        } else {
+          messageText = "[Unable to decrypt message]";
+        }
+
+        serverMessages.push({
+          sender: isMyMessage ? "me" : "them",
+          text: messageText,
+          timestamp: messageTimestamp,
+          serverId: msg._id,
+          signatureVerified: signatureVerified
+        });
+      } catch (decryptError) {
+        console.error("❌ Failed to process server message:", msg._id, decryptError);
+        serverMessages.push({
+          sender: msg.sender_id === user._id ? "me" : "them",
+          text: "[Failed to decrypt message]",
+          timestamp: msg.timestamp,
+          serverId: msg._id,
+          signatureVerified: false
+        });
+      }
+    }
+
+    return serverMessages;
+  }, [user, chatId, kyberPrivateKey]);
+
+  // Fetch one page of history; without a cursor this is the newest page
+  const fetchHistoryPage = useCallback(async (before = null) => {
+    const query = before ? `?before=${encodeURIComponent(before)}` : "";
+    const res = await fetch(
+      `https://quantumchattingapp-backend.onrender.com/api/v1/messages/${peerId}${query}`,
+      {
+        credentials: "include",
+      }
+    );
+
+    if (!res.ok) {
+      console.warn(`⚠️ Server fetch failed: ${res.status}`);
+      return null;
+    }
+    return res.json();
+  }, [peerId]);
+
   // Load messages from IndexedDB first, then fetch from server
   // Updated to handle signature verification
   useEffect(() => {
@@ -164,6 +313,7 @@ export default function WebSocketChatBox({ peer }) {
     const loadMessages = async () => {
       try {
         console.log("📱 Loading messages for chat:", chatId);
+        setHistoryCursor(null);
         
         // Load from IndexedDB first
         const localMessages = await chatStorage.getMessages(chatId);
@@ -251,144 +401,20 @@ export default function WebSocketChatBox({ peer }) {
         console.log("📱 Processed local messages:", processedLocal.length);
 
         // Fetch from server to sync any new messages
-        const res = await fetch(
-          `https://quantumchattingapp-backend.onrender.com/api/v1/messages/${peerId}`,
-          {
-            credentials: "include",
-          }
-        );
-
-        if (!res.ok) {
-          console.warn(`⚠️ Server fetch failed: ${res.status}`);
+        const page = await fetchHistoryPage();
+        if (!page) {
           return; // Use local messages if server fails
         }
 
-        const serverData = await res.json();
+        // Newest page of history; older pages are loaded on request via next_cursor
+        const { messages: serverData, next_cursor: nextCursor } = page;
         console.log("📜 Server messages found:", serverData.length);
+        peerDilithiumKeyRef.current = peerDilithiumPublicKey;
+        setHistoryCursor(nextCursor);
 
-        // Process server messages and store new ones locally
-        const serverMessages = [];
-        
-        for (const msg of serverData) {
-          try {
-            const isMyMessage = msg.sender_id === user._id;
-            const messageTimestamp = msg.timestamp;
-            
-            // Check if we already have this message locally
-            const alreadyExists = await chatStorage.messageExists(
-              chatId, 
-              messageTimestamp, 
-              msg.sender_id, 
-              msg.message
-            );
-            
-            if (alreadyExists) {
-              console.log("⏭️ Message already exists locally, skipping");
-              continue;
-            }
-
-            let messageText;
-            let signatureVerified = null;
+        const serverMessages = await processServerMessages(serverData, peerDilithiumPublicKey);
 
-            if (msg.message_type === "encrypted" && msg.ciphertext && msg.encrypted_message && msg.iv) {
-              if (isMyMessage) {
-                // For your own messages from server, show as sent (you can't decrypt them)
-                console.log("📤 Found your encrypted message on server");
-                continue;
-              } else {
-                // Decrypt received messages with signature verification if available
-                if (msg.signature && peerDilithiumPublicKey) {
-                  try {
-                    const result = await decryptAndVerifyMessage({
-                      kyberPrivateKeyBase64: kyberPrivateKey,
-                      kyberCiphertextBase64: msg.ciphertext,
-                      encryptedMessageBase64: msg.encrypted_message,
-                      ivBase64: msg.iv,
-                      signature: msg.signature,
-                      dilithiumPublicKeyBase64: peerDilithiumPublicKey,
-                    });
-                    messageText = result.message;
-                    signatureVerified = result.signatureValid;
-                  } catch (sigError) {
-                    console.warn("⚠️ Signature verification failed, falling back to regular decryption:", sigError);
-                    messageText = await decryptMessage({
-                      kyberPrivateKeyBase64: kyberPrivateKey,
-                      kyberCiphertextBase64: msg.ciphertext,
-                      encryptedMessageBase64: msg.encrypted_message,
-                      ivBase64: msg.iv,
-                    });
-                    signatureVerified = false;
-                  }
-                } else {
-                  // Regular decryption for messages without signatures
-                  messageText = await decryptMessage({
-                    kyberPrivateKeyBase64: kyberPrivateKey,
-                    kyberCiphertextBase64: msg.ciphertext,
-                    encryptedMessageBase64: msg.encrypted_message,
-                    ivBase64: msg.iv,
-                  });
-                }
-                
-                // Store decrypted message locally
-                await chatStorage.storeReceivedMessage(
-                  chatId,
-                  {
-                    message: messageText,
-                    ciphertext: msg.ciphertext,
-                    encryptedMessage: msg.encrypted_message,
-                    iv: msg.iv,
-                    signature: msg.signature,
-                    signatureVerified: signatureVerified,
-                  },
-                  messageTimestamp,
-                  msg.sender_id,
-                  msg.receiver_id
-                );
-                console.log("📥 Stored new received message locally");
-              }
-            } else if (msg.message) {
-              messageText = msg.message;
-            } else {
-              messageText = "[Unable to decrypt message]";
-            }
-
-            serverMessages.push({
-              sender: isMyMessage ? "me" : "them",
-              text: messageText,
-              timestamp: messageTimestamp,
-              serverId: msg._id,
-              signatureVerified: signatureVerified
-            });
-          } catch (decryptError) {
-            console.error("❌ Failed to process server message:", msg._id, decryptError);
-            serverMessages.push({
-              sender: msg.sender_id === user._id ? "me" : "them",
-              text: "[Failed to decrypt message]",
-              timestamp: msg.timestamp,
-              serverId: msg._id,
-              signatureVerified: false
-            });
-          }
-        }
-
-        // Merge local and server messages, remove duplicates, and sort by time
-        const allMessages = [...processedLocal];
-        
-        for (const serverMsg of serverMessages) {
-          // Check if this server message is already in local messages
-          const isDuplicate = allMessages.some(localMsg => 
-            Math.abs(new Date(localMsg.timestamp) - new Date(serverMsg.timestamp)) < 1000 &&
-            localMsg.text === serverMsg.text &&
-            localMsg.sender === serverMsg.sender
-          );
-          
-          if (!isDuplicate) {
-            allMessages.push(serverMsg);
-          }
-        }
-
-        // Final sort by timestamp
-        allMessages.sort((a, b) => new Date(a.timestamp) - new Date(b.timestamp));
+        const allMessages = mergeMessages(processedLocal, serverMessages);
         
         console.log("📜 Final merged messages:", allMessages.length);
         setMessages(allMessages);
@@ -400,7 +426,28 @@ export default function WebSocketChatBox({ peer }) {
     };
 
     loadMessages();
-  }, [peerId, user, kyberPrivateKey, dilithiumPrivateKey, dbInitialized, chatId, fetchPeerPublicKeys]);
+  }, [peerId, user, kyberPrivateKey, dilithiumPrivateKey, dbInitialized, chatId, fetchPeerPublicKeys, fetchHistoryPage, processServerMessages]);
+
+  // Load the page of history before the oldest one loaded so far
+  const loadOlderMessages = useCallback(async () => {
+    if (!historyCursor || loadingOlder) return;
+
+    setLoadingOlder(true);
+    try {
+      const page = await fetchHistoryPage(historyCursor);
+      if (!page) return;
+
+      const olderMessages = await processServerMessages(page.messages, peerDilithiumKeyRef.current);
+      console.log("📜 Older server messages found:", page.messages.length);
+      keepScrollRef.current = true;
+      setMessages(prev => mergeMessages(prev, olderMessages));
+      setHistoryCursor(page.next_cursor);
+    } catch (err) {
+      console.error("❌ Error loading older messages:", err);
+    } finally {
+      setLoadingOlder(false);
+    }
+  }, [historyCursor, loadingOlder, fetchHistoryPage, processServerMessages]);
 
   // WebSocket connection updated to handle signatures
   useEffect(() => {
@@ -450,6 +497,12 @@ export default function WebSocketChatBox({ peer }) {
 
           const data = JSON.parse(rawData);
 
+          // Server heartbeat - answering keeps the connection from being reaped as idle
+          if (data.type === "ping") {
+            ws.send(JSON.stringify({ type: "pong" }));
+            return;
+          }
+
           if (data.type === "encrypted-message") {
             let decryptedText;
             let signatureVerified = null;
@@ -496,10 +549,13 @@ export default function WebSocketChatBox({ peer }) {
               });
             }
 
+            // Messages held while we were offline carry their history id and server
+            // time, so the same message fetched from history is recognised
             const newMessage = {
               sender: "them",
               text: decryptedText,
-              timestamp: new Date().toISOString(),
+              timestamp: data.timestamp || new Date().toISOString(),
+              serverId: data.messageId,
               signatureVerified: signatureVerified,
             };
 
@@ -575,6 +631,11 @@ export default function WebSocketChatBox({ peer }) {
   }, [user, peerId, kyberPrivateKey, dilithiumPrivateKey, dbInitialized, chatId, fetchPeerPublicKeys]);
 
   useEffect(() => {
+    // Older history goes on top - stay where the reader is
+    if (keepScrollRef.current) {
+      keepScrollRef.current = false;
+      return;
+    }
     scrollRef.current?.scrollIntoView({ behavior: "smooth" });
   }, [messages]);
 
@@ -695,6 +756,18 @@ export default function WebSocketChatBox({ peer }) {
             </div>
           )}
           
+          {historyCursor && (
+            <div className="text-center">
+              <button
+                onClick={loadOlderMessages}
+                disabled={loadingOlder}
+                className="px-4 py-1.5 text-xs text-purple-200 bg-purple-900/40 hover:bg-purple-800/50 disabled:opacity-50 border border-purple-500/30 rounded-full transition-colors"
+              >
+                {loadingOlder ? "Loading..." : "Load older messages"}
+              </button>
+            </div>
+          )}
+
           {messages.map((msg, idx) => (
             <div
               key={idx}
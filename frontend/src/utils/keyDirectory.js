@@ -0,0 +1,42 @@
+// Peer public keys by user id. The sidebar loads the whole contact list's keys in one
+// batch request; the backend sends an ETag and Cache-Control, so repeat visits are
+// answered from the browser cache or a 304.
+const KEYS_URL = "https://quantumchattingapp-backend.onrender.com/api/v1/user/keys";
+const BATCH_MAX = 200;
+
+const keys = new Map();
+
+function toPeerKeys(record) {
+  return {
+    kyberPublicKey: record.kyber_public_key,
+    dilithiumPublicKey: record.dilithium_public_key,
+    fingerprint: record.key_fingerprint,
+    version: record.key_version,
+  };
+}
+
+export async function prefetchKeys(userIds) {
+  const wanted = [...new Set(userIds)].filter((id) => id && !keys.has(id));
+  for (let i = 0; i < wanted.length; i += BATCH_MAX) {
+    const batch = wanted.slice(i, i + BATCH_MAX);
+    const res = await fetch(`${KEYS_URL}?user_ids=${batch.join(",")}`, {
+      credentials: "include",
+    });
+    if (!res.ok) {
+      throw new Error(`Failed to fetch public keys: ${res.status}`);
+    }
+    const data = await res.json();
+    Object.entries(data.keys).forEach(([id, record]) => keys.set(id, toPeerKeys(record)));
+  }
+}
+
+export async function getPeerKeys(userId) {
+  if (!keys.has(userId)) {
+    await prefetchKeys([userId]);
+  }
+  const peerKeys = keys.get(userId);
+  if (!peerKeys) {
+    throw new Error(`No public keys found for ${userId}`);
+  }
+  return peerKeys;
+}